@@ -0,0 +1,196 @@
+"""
+Seeded generator of synthetic product catalogs in the shape of the files users upload.
+
+A catalog has product_count products with 1 to max_variants variant rows each,
+the columns of a typical shopify export and extra_columns columns that are not
+mapped. Values include the blanks, padding and invalid values found in real
+files, so every branch of ProductGenerator is exercised. The same seed always
+gives the same catalog.
+
+Usage: python benchmarks/catalog_generator.py OUTPUT.csv|OUTPUT.xlsx [--products N]
+       [--max-variants N] [--extra-columns N] [--seed N]
+"""
+import argparse
+import csv
+import io
+import random
+
+
+COLUMNS = [
+    'Handle', 'Title', 'Body', 'Vendor', 'Type', 'Tags', 'Published', 'Option1 Name', 'Option1 Value',
+    'Option2 Name', 'Option2 Value', 'SKU', 'Weight', 'Tracked', 'Quantity', 'Policy', 'Price',
+    'Compare At Price', 'Requires Shipping', 'Taxable', 'Barcode', 'Image Src', 'Variant Image',
+    'SEO Title', 'SEO Description', 'Status', 'Collections', 'Material', 'Cost'
+]
+
+# field_details of the mappings benchmarks and tests are run with, by name
+MAPPINGS = {
+    'minimal': {
+        'title': [{'index': '1'}],
+        'option1Name': [{'index': '7'}],
+        'option1Value': [{'index': '8'}],
+        'variantPrice': [{'index': '16'}],
+    },
+    'full': {
+        'handle': [{'index': '0'}],
+        'title': [{'index': '1'}],
+        'descriptionHtml': [{'index': '2'}],
+        'vendor': [{'index': '3'}],
+        'productType': [{'index': '4'}],
+        'tags': [{'index': '5'}],
+        'published': [{'index': '6'}],
+        'option1Name': [{'index': '7'}],
+        'option1Value': [{'index': '8'}],
+        'option2Name': [{'index': '9'}],
+        'option2Value': [{'index': '10'}],
+        'variantSku': [{'index': '11'}],
+        'variantWeight': [{'index': '12', 'weightUnit': 'KILOGRAMS'}],
+        'variantTracked': [{'index': '13'}],
+        'variantQuantity': [{'index': '14', 'location': 'gid://shopify/Location/1'}],
+        'variantInventoryPolicy': [{'index': '15'}],
+        'variantPrice': [{'index': '16'}],
+        'variantCompareAtPrice': [{'index': '17'}],
+        'variantRequireShipping': [{'index': '18'}],
+        'variantTaxable': [{'index': '19'}],
+        'variantBarcode': [{'index': '20'}],
+        'imageSrc': [{'index': '21'}],
+        'variantImage': [{'index': '22'}],
+        'seoTitle': [{'index': '23'}],
+        'seoDescription': [{'index': '24'}],
+        'status': [{'index': '25'}],
+        'customCollections': [{'index': '26'}],
+        'metafields': [{'index': '27', 'name': 'material'}],
+        'variantCost': [{'index': '28'}],
+    },
+}
+
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+COLORS = ['Red', 'Blue', 'Green', 'Black', 'White', 'Grey', 'Navy', 'Olive']
+
+
+class CatalogGenerator:
+    """
+    Class to generate a synthetic catalog of products from a seed
+    """
+
+    def __init__(self, product_count, max_variants=5, extra_columns=0, seed=1):
+        """
+        Parameters
+        ----------
+        product_count: int, required
+            number of products in the catalog
+
+        max_variants: int, optional
+            the largest number of variant rows of a product
+
+        extra_columns: int, optional
+            number of columns after the mapped ones that are not mapped
+
+        seed: int, optional
+            seed of the random values
+        """
+        self._product_count = product_count
+        self._max_variants = max_variants
+        self._extra_columns = extra_columns
+        self._seed = seed
+
+
+    def get_header(self):
+        return COLUMNS + ['Extra ' + str(column + 1) for column in range(self._extra_columns)]
+
+
+    def get_rows(self):
+        """Returns the rows of the catalog as lists of strings, without the header"""
+        rand = random.Random(self._seed)
+        rows = []
+        for product in range(self._product_count):
+            variant_count = rand.randint(1, self._max_variants)
+            handle = 'product-' + str(product)
+            title = 'Product ' + str(product)
+            for variant in range(variant_count):
+                row = self.__get_variant_row(rand, handle, title, variant)
+                rows.append(row + [self.__pick(rand, 'x' + str(column), '') for column in range(self._extra_columns)])
+        return rows
+
+
+    def get_csv(self):
+        """Returns the catalog as the bytes of a csv file"""
+        content = io.StringIO()
+        writer = csv.writer(content)
+        writer.writerow(self.get_header())
+        writer.writerows(self.get_rows())
+        return content.getvalue().encode('utf-8')
+
+
+    def get_xlsx(self):
+        """Returns the catalog as the bytes of an excel file"""
+        import openpyxl
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(self.get_header())
+        for row in self.get_rows():
+            sheet.append([None if value == '' else value for value in row])
+        content = io.BytesIO()
+        workbook.save(content)
+        return content.getvalue()
+
+
+    def __get_variant_row(self, rand, handle, title, variant):
+        pick = self.__pick
+        is_first = variant == 0
+        size = SIZES[variant % len(SIZES)]
+        color = COLORS[(variant // len(SIZES)) % len(COLORS)]
+        return [
+            handle,
+            title if is_first or rand.random() < 0.5 else '',
+            pick(rand, '<p>Soft cotton ' + title + '</p>', '') if is_first else '',
+            pick(rand, 'Acme', 'Globex', ' Initech ', '') if is_first else '',
+            pick(rand, 'Shirts', 'Pants', '') if is_first else '',
+            pick(rand, 'summer,sale', 'new;cotton', '') if is_first else '',
+            pick(rand, 'TRUE', 'yes', 'n', 'maybe', '') if is_first else '',
+            'Size' if is_first else '',
+            size,
+            'Color' if is_first else '',
+            color,
+            'SKU-' + handle + '-' + str(variant),
+            pick(rand, '0.5', '1.25', ' 2 ', 'heavy', ''),
+            pick(rand, 'true', 'false', 'sometimes', ''),
+            pick(rand, '5', '12', ' 7', 'many', ''),
+            pick(rand, 'continue', 'deny', 'Deny ', 'stop', ''),
+            pick(rand, '19.99', '24.50', ' 5 ', 'free', ''),
+            pick(rand, '29.99', '', 'n/a'),
+            pick(rand, 'y', 'n', '?', ''),
+            pick(rand, 'yes', 'no', '??', ''),
+            pick(rand, '0123456789012', '', '9'),
+            pick(rand, 'https://cdn.example.com/' + handle + '.jpg;https://cdn.example.com/' + handle + '-2.jpg', '') if is_first else '',
+            pick(rand, 'https://cdn.example.com/' + handle + '-' + str(variant) + '.jpg', ''),
+            pick(rand, title + ' | Shop', '') if is_first else '',
+            pick(rand, 'Buy ' + title, '') if is_first else '',
+            pick(rand, 'active', 'Draft', 'archived', 'bogus', '') if is_first else '',
+            pick(rand, 'Summer,Sale', '') if is_first else '',
+            pick(rand, 'cotton', 'wool', '') if is_first else '',
+            pick(rand, '3.30', 'cheap', ''),
+        ]
+
+
+    def __pick(self, rand, *values):
+        return values[rand.randrange(len(values))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic product catalog')
+    parser.add_argument('output', help='path of the csv or xlsx file to write')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--max-variants', type=int, default=5)
+    parser.add_argument('--extra-columns', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    generator = CatalogGenerator(args.products, args.max_variants, args.extra_columns, args.seed)
+    content = generator.get_xlsx() if args.output.endswith('.xlsx') else generator.get_csv()
+    with open(args.output, 'wb') as file:
+        file.write(content)
+
+
+if __name__ == '__main__':
+    main()
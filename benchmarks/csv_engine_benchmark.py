@@ -0,0 +1,103 @@
+"""
+Compares the csv engines SheetReader reads chunks of csv files with.
+
+Each configuration generates a seeded catalog with catalog_generator and reads
+it with SheetReader once with each engine, from the file bytes to the last data
+frame, the way ProductGenerator reads it with a chunk size. The frames of both
+engines are checked to be equal before the median times are reported, so a
+speedup never comes from reading different values.
+
+pyarrow is needed to run the pyarrow engine, which is skipped without it.
+
+Usage: python benchmarks/csv_engine_benchmark.py [--quick] [--runs N] [--only NAME]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+from catalog_generator import CatalogGenerator, MAPPINGS
+
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+CONFIGURATIONS = [
+    {'name': 'rows-30k-minimal', 'products': 10000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'minimal'},
+    {'name': 'rows-30k-full', 'products': 10000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full'},
+    {'name': 'rows-150k-full', 'products': 50000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full'},
+    {'name': 'columns-150-minimal', 'products': 3000, 'max_variants': 5, 'extra_columns': 150, 'mapping': 'minimal'},
+    {'name': 'columns-150-full', 'products': 3000, 'max_variants': 5, 'extra_columns': 150, 'mapping': 'full'},
+]
+
+CHUNK_SIZE = 5000
+# --quick runs every configuration on a catalog this many times smaller
+QUICK_FACTOR = 10
+
+
+def read_frames(content, field_details, csv_engine):
+    from utility.row_plan import get_row_plan
+    from utility.sheet_reader import SheetReader
+
+    file_obj = {'id': 'benchmark', 'file_type': 'CSV', 'header_row': '0', 'field_details': field_details}
+    column_indexes = get_row_plan(field_details).column_indexes
+    return list(SheetReader(file_obj, io.BytesIO(content), CHUNK_SIZE, csv_engine=csv_engine).read(column_indexes))
+
+
+def run_configuration(configuration, engines, runs, quick):
+    import pandas as pd
+
+    product_count = configuration['products']
+    if quick:
+        product_count = max(1, product_count // QUICK_FACTOR)
+    catalog = CatalogGenerator(product_count, configuration['max_variants'], configuration['extra_columns'])
+    content = catalog.get_csv()
+    field_details = MAPPINGS[configuration['mapping']]
+
+    result = {'rows': len(catalog.get_rows()), 'file_bytes': len(content)}
+    expected = None
+    for csv_engine in engines:
+        timings = []
+        for run in range(runs):
+            start = time.perf_counter()
+            frames = read_frames(content, field_details, csv_engine)
+            timings.append(time.perf_counter() - start)
+        frame = pd.concat(frames)
+        if expected is None:
+            expected = frame
+        elif not frame.equals(expected) or not frame.index.equals(expected.index):
+            raise AssertionError(configuration['name'] + ': ' + csv_engine.name + ' read different rows')
+        result[csv_engine.name] = statistics.median(timings)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the csv engines of SheetReader on synthetic catalogs')
+    parser.add_argument('--runs', type=int, default=3, help='number of timed runs of each engine')
+    parser.add_argument('--quick', action='store_true', help='use catalogs ' + str(QUICK_FACTOR) + ' times smaller')
+    parser.add_argument('--only', action='append', help='name of a configuration to run, can be repeated')
+    args = parser.parse_args()
+    sys.path.insert(0, SRC_DIRECTORY)
+    from datamodel.custom_enums import CsvEngine
+
+    engines = [CsvEngine.PANDAS]
+    try:
+        import pyarrow
+        engines.append(CsvEngine.PYARROW)
+    except ImportError:
+        print('pyarrow is not installed, only the pandas engine is run')
+
+    print('{:<22} {:>8} {:>10} {:>10} {:>10} {:>9}'.format('configuration', 'rows', 'MB', 'pandas', 'pyarrow', 'speedup'))
+    for configuration in CONFIGURATIONS:
+        if args.only is not None and configuration['name'] not in args.only:
+            continue
+        result = run_configuration(configuration, engines, args.runs, args.quick)
+        line = '{:<22} {:>8} {:>10.1f} {:>10.3f}'.format(configuration['name'], result['rows'], result['file_bytes'] / (1024 * 1024), result['PANDAS'])
+        if 'PYARROW' in result:
+            line += ' {:>10.3f} {:>8.2f}x'.format(result['PYARROW'], result['PANDAS'] / result['PYARROW'])
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark suite for ProductGenerator on synthetic catalogs.
+
+Each configuration generates a seeded catalog with catalog_generator and runs
+ProductGenerator.get_products on it end to end, from the file bytes to the
+product dicts. Configurations vary the number of rows, the variants per
+product, the number of unmapped columns, the field_details mapping, the file
+type, the csv chunk size and whether excel files are streamed. For each one
+the median time of the runs gives rows/sec, and a separate run under
+tracemalloc gives the peak memory.
+
+Everything runs offline. Results can be saved with --output and compared with
+the results of another commit with --compare.
+
+Usage: python benchmarks/generator_benchmark.py [--quick] [--runs N] [--only NAME]
+       [--output RESULTS.json] [--compare BASELINE.json]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from catalog_generator import CatalogGenerator, MAPPINGS
+
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+CONFIGURATIONS = [
+    # row counts
+    {'name': 'rows-2k', 'products': 700, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'CSV'},
+    {'name': 'rows-30k', 'products': 10000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'CSV'},
+    {'name': 'rows-30k-chunked', 'products': 10000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'CSV', 'chunk_size': 5000},
+    # variant fan-out
+    {'name': 'fanout-1', 'products': 10000, 'max_variants': 1, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'CSV'},
+    {'name': 'fanout-100', 'products': 200, 'max_variants': 100, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'CSV'},
+    # column counts
+    {'name': 'columns-150-minimal', 'products': 3000, 'max_variants': 5, 'extra_columns': 150, 'mapping': 'minimal', 'file_type': 'CSV'},
+    {'name': 'columns-150-full', 'products': 3000, 'max_variants': 5, 'extra_columns': 150, 'mapping': 'full', 'file_type': 'CSV'},
+    # mappings
+    {'name': 'mapping-minimal', 'products': 10000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'minimal', 'file_type': 'CSV'},
+    # excel
+    {'name': 'xlsx-6k', 'products': 2000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'EXCEL'},
+    {'name': 'xlsx-6k-streamed', 'products': 2000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'EXCEL', 'stream_excel': True},
+    {'name': 'xlsx-30k-streamed', 'products': 10000, 'max_variants': 5, 'extra_columns': 0, 'mapping': 'full', 'file_type': 'EXCEL', 'stream_excel': True},
+]
+
+# --quick runs every configuration on a catalog this many times smaller
+QUICK_FACTOR = 10
+
+
+def run_configuration(configuration, runs, quick):
+    from datamodel.custom_enums import TaskType
+    from utility.product_generator import ProductGenerator
+
+    product_count = configuration['products']
+    if quick:
+        product_count = max(1, product_count // QUICK_FACTOR)
+    catalog = CatalogGenerator(product_count, configuration['max_variants'], configuration['extra_columns'])
+    row_count = len(catalog.get_rows())
+    if configuration['file_type'] == 'EXCEL':
+        content = catalog.get_xlsx()
+    else:
+        content = catalog.get_csv()
+
+    def generate():
+        info = {
+            'file_object': {
+                'id': configuration['name'],
+                'file_type': configuration['file_type'],
+                'header_row': '0',
+                'field_details': MAPPINGS[configuration['mapping']]
+            },
+            'file_content': io.BytesIO(content),
+            'job_type': TaskType.IMPORT_CREATE,
+            'options': {'addedTags': ['imported'], 'defaultPublishedStatus': True, 'defaultStatus': 'DRAFT'},
+            'chunk_size': configuration.get('chunk_size'),
+            'stream_excel': configuration.get('stream_excel', False),
+        }
+        return ProductGenerator(info).get_products()
+
+    timings = []
+    for run in range(runs):
+        start = time.perf_counter()
+        products = generate()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    generate()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    seconds = statistics.median(timings)
+    return {
+        'rows': row_count,
+        'products': len(products),
+        'file_bytes': len(content),
+        'seconds': seconds,
+        'rows_per_second': row_count / seconds,
+        'peak_memory_mb': peak_memory / (1024 * 1024),
+    }
+
+
+def print_results(results, baseline):
+    header = '{:<22} {:>8} {:>9} {:>10} {:>12} {:>10}'.format('configuration', 'rows', 'products', 'seconds', 'rows/sec', 'peak MB')
+    if baseline is not None:
+        header += ' {:>10} {:>10}'.format('speedup', 'memory')
+    print(header)
+    for name, result in results.items():
+        line = '{:<22} {:>8} {:>9} {:>10.3f} {:>12.0f} {:>10.1f}'.format(
+            name, result['rows'], result['products'], result['seconds'], result['rows_per_second'], result['peak_memory_mb'])
+        if baseline is not None and name in baseline:
+            line += ' {:>9.2f}x {:>9.2f}x'.format(
+                baseline[name]['seconds'] / result['seconds'], result['peak_memory_mb'] / baseline[name]['peak_memory_mb'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ProductGenerator on synthetic catalogs')
+    parser.add_argument('--runs', type=int, default=3, help='number of timed runs of each configuration')
+    parser.add_argument('--quick', action='store_true', help='use catalogs ' + str(QUICK_FACTOR) + ' times smaller')
+    parser.add_argument('--only', action='append', help='name of a configuration to run, can be repeated')
+    parser.add_argument('--output', help='path to save the results to as json')
+    parser.add_argument('--compare', help='path of results saved with --output to compare with')
+    args = parser.parse_args()
+    sys.path.insert(0, SRC_DIRECTORY)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+
+    results = {}
+    for configuration in CONFIGURATIONS:
+        if args.only is not None and configuration['name'] not in args.only:
+            continue
+        results[configuration['name']] = run_configuration(configuration, args.runs, args.quick)
+    print_results(results, baseline)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'quick': args.quick, 'runs': args.runs, 'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
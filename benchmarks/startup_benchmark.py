@@ -0,0 +1,90 @@
+"""
+Measures the cold start and warm invocation overhead of the lambda handler.
+
+Cold start is the time to import app in a fresh interpreter, which is what a
+new container pays before its first invocation. It is measured with pandas
+imported lazily (the current app) and with pandas imported up front, the way
+app imported ProductGenerator before.
+
+Warm invocation overhead is the time to get a DataAccess at the start of an
+invocation: creating a new one with its boto3 clients on every invocation,
+against reusing the one created by the first invocation of the container.
+No AWS calls are made, clients are only created.
+
+Usage: python benchmarks/startup_benchmark.py [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+ENVIRONMENT = {
+    'AWS_DEFAULT_REGION': 'us-east-2',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'bulk_manager_table': 'BulkManager',
+}
+
+COLD_START_SCRIPTS = {
+    'lazy pandas import': 'import app',
+    'eager pandas import': 'import app; import utility.product_generator',
+}
+
+
+def time_cold_start(script, runs):
+    """Returns the seconds taken by each fresh interpreter to run script"""
+    timed_script = 'import time; start = time.perf_counter(); ' + script + '; print(time.perf_counter() - start)'
+    environment = dict(os.environ)
+    environment.update(ENVIRONMENT)
+    timings = []
+    for run in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', timed_script], cwd=SRC_DIRECTORY, env=environment)
+        timings.append(float(output))
+    return timings
+
+
+def time_warm_invocations(runs):
+    """Returns the seconds taken to get a DataAccess per invocation, new and reused"""
+    os.environ.update(ENVIRONMENT)
+    sys.path.insert(0, SRC_DIRECTORY)
+    import app
+    from dataaccess.data_access import DataAccess
+
+    # the first invocation of a container creates the clients in both cases
+    app.get_data_access()
+    new_timings = []
+    reused_timings = []
+    for run in range(runs):
+        start = time.perf_counter()
+        DataAccess()
+        new_timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        app.get_data_access()
+        reused_timings.append(time.perf_counter() - start)
+    return {'new DataAccess per invocation': new_timings, 'reused DataAccess': reused_timings}
+
+
+def print_timings(title, timings):
+    print(title)
+    for name, values in timings.items():
+        print('  {:<32} median {:>9.2f} ms   min {:>9.2f} ms'.format(
+            name, statistics.median(values) * 1000, min(values) * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure handler cold start and warm invocation overhead')
+    parser.add_argument('--runs', type=int, default=10, help='number of runs of each measurement')
+    args = parser.parse_args()
+
+    cold_start_timings = {name: time_cold_start(script, args.runs) for name, script in COLD_START_SCRIPTS.items()}
+    print_timings('Cold start (import app)', cold_start_timings)
+    print_timings('Warm invocation (get DataAccess)', time_warm_invocations(args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures how product generation time scales with the number of variants per product.
+
+Each run generates the same number of rows, split into products with more and
+more variants. With constant-time duplicate variant detection the time per
+variant stays flat as products grow; a check against a list of the titles seen
+so far makes it grow with the number of variants of the product.
+
+Usage: python benchmarks/variant_scaling_benchmark.py [--rows N] [--runs N]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+
+SRC_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+VARIANTS_PER_PRODUCT = [1, 10, 100, 500, 1000, 2000]
+FIELD_DETAILS = {
+    'title': [{'index': '0'}],
+    'option1Name': [{'index': '1'}],
+    'option1Value': [{'index': '2'}],
+    'variantSku': [{'index': '3'}],
+    'variantPrice': [{'index': '4'}],
+}
+
+
+def build_csv(row_count, variants_per_product):
+    lines = ['Title,Option1 Name,Option1 Value,SKU,Price']
+    for row in range(row_count):
+        product = row // variants_per_product
+        variant = row % variants_per_product
+        lines.append('Product ' + str(product) + ',Size,Size ' + str(variant) + ',SKU-' + str(row) + ',' + str(10 + variant % 7))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def time_generation(content, runs):
+    from datamodel.custom_enums import TaskType
+    from utility.product_generator import ProductGenerator
+
+    timings = []
+    for run in range(runs):
+        info = {
+            'file_object': {'id': 'benchmark', 'file_type': 'CSV', 'header_row': '0', 'field_details': FIELD_DETAILS},
+            'file_content': io.BytesIO(content),
+            'job_type': TaskType.IMPORT_CREATE,
+            'options': {'addedTags': [], 'defaultPublishedStatus': True, 'defaultStatus': 'DRAFT'},
+        }
+        start = time.perf_counter()
+        ProductGenerator(info).get_products()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure generation time against variants per product')
+    parser.add_argument('--rows', type=int, default=20000, help='number of variant rows in each file')
+    parser.add_argument('--runs', type=int, default=3, help='number of runs of each measurement')
+    args = parser.parse_args()
+    sys.path.insert(0, SRC_DIRECTORY)
+
+    print('{:>20} {:>12} {:>18}'.format('variants/product', 'total ms', 'us per variant'))
+    for variants_per_product in VARIANTS_PER_PRODUCT:
+        content = build_csv(args.rows, variants_per_product)
+        seconds = statistics.median(time_generation(content, args.runs))
+        print('{:>20} {:>12.1f} {:>18.2f}'.format(variants_per_product, seconds * 1000, seconds / args.rows * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,527 @@
+import io
 import json
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataaccess.data_access import DataAccess
-from datamodel.custom_enums import JobStatus, TaskType
-from utility.product_generator import ProductGenerator
+from dataaccess.prepared_products_writer import FORMAT_EXTENSIONS
+from dataaccess.product_processor_publisher import MessageQueue
+from datamodel.custom_enums import CsvEngine, FileType, JobStatus, ProductsFormat, TaskType
+from utility.csv_engines import is_pyarrow_wanted
+from utility.job_metrics import JobMetrics
+from utility.product_hashes import ProductHashes, merge_job_hashes
+from utility.sheet_cache import SheetCache
+
+
+DEFAULT_MAX_CONCURRENT_JOBS = 4
+DEFAULT_CSV_CHUNK_SIZE = 5000
+
+# created on the first invocation of a container and reused by the warm ones
+job_executor = None
+sheet_cache = None
+sheet_cache_lock = threading.Lock()
+thread_data = threading.local()
+data_access_lock = threading.Lock()
 
 
 def lambda_handler(event, context):
-    """Sample pure Lambda function
+    """Prepares the products of every job in an SNS event
+
+    Jobs are prepared on a bounded pool of threads, so the S3 and DynamoDB
+    calls of one job overlap with the parsing of another. A job that fails
+    is marked as failed without affecting the other jobs of the event.
 
     Parameters
     ----------
     event: dict, required
-        API Gateway Lambda Proxy Input Format
+        SNS event with a record per job
 
     context: object, required
         Lambda Context runtime methods and attributes
 
     Returns
     ------
-    API Gateway Lambda Proxy Output Format: dict
+    None
     """
-    user_limit = 250 ##this is hardcoded for now. will update later to included in user with the different plans
-    dataAccess = DataAccess()
-    message_payload = json.loads(event['Records'][0]['Sns']['Message'])
-    file_id = message_payload['fileId']
-    job_id = message_payload['jobId']
-    user_id = message_payload['userId']
-    
+    records = event['Records']
+    if len(records) == 1:
+        process_record(records[0])
+        return None
+
+    executor = get_job_executor()
+    pending_jobs = [executor.submit(process_record, record) for record in records]
+    for pending_job in pending_jobs:
+        pending_job.result()
+    return None
+
+
+def process_record(record):
+    """Prepares the products of the job in an SNS record, marking the job as failed if it can't"""
     try:
-        file_obj = dataAccess.get_file(file_id)
-        job = dataAccess.get_job(job_id, user_id)
-        dataAccess.update_job_transaction({
-                'id': job_id,
-                'user_id': job['user_id'],
-                'status': JobStatus.PREPARING.name
-            })
-        product_file_content = dataAccess.get_product_file(file_obj['s3_key'])
+        message_payload = json.loads(record['Sns']['Message'])
+        file_id = message_payload['fileId']
+        job_id = message_payload['jobId']
+        user_id = message_payload['userId']
+    except Exception as error:
+        logging.exception('Could not read job from record. Details: %s', error)
+        return
+
+    dataAccess = get_data_access()
+    metrics = JobMetrics()
+    details = {'jobId': job_id, 'userId': user_id, 'fileId': file_id}
+    progress = {'preparing': False, 'processing': False}
+    try:
+        prepare_products(dataAccess, file_id, job_id, user_id, metrics, details, progress)
+        details['failed'] = False
+        metrics.log(details)
+    except Exception as error:
+        logging.exception('Job failed to prepare products. Details: %s', error)
+        details['failed'] = True
+        metrics.log(details)
+        try:
+            mark_job_failed(dataAccess, job_id, user_id, progress)
+        except Exception as update_error:
+            logging.exception('Could not mark job ' + job_id + ' as failed. Details: %s', update_error)
+
 
+def mark_job_failed(dataAccess, job_id, user_id, progress):
+    """
+    Marks a job as failed, giving back its active job count only if the PREPARING transaction took it
+
+    A job the product processor already started on is left to the processor,
+    which sets its final status from the failed manifest. A job that wasn't
+    marked as preparing may have failed because it doesn't exist, so it is only
+    marked as failed when its record exists.
+    """
+    if progress['processing']:
+        logging.warning('Job ' + job_id + ' failed after the product processor started on it, so only its manifest is marked as failed')
+        return
+    job_update = {
+        'id': job_id,
+        'user_id': user_id,
+        'status': JobStatus.FAILED.name
+    }
+    if progress['preparing']:
+        dataAccess.update_failed_job_transaction(job_update)
+    else:
+        dataAccess.basic_job_update(job_update, only_existing=True)
+
+
+def prepare_products(dataAccess, file_id, job_id, user_id, metrics=None, details=None, progress=None):
+    """
+    Prepares the products of a job, timing each stage in metrics and adding the file type to details
+
+    progress['preparing'] is set once the job is marked as preparing, so a
+    caller that marks the job as failed knows whether its active job count
+    was incremented. progress['processing'] is set once the product processor
+    was told about the products. A batched job that fails after that only
+    marks its manifest as failed and truncated.
+    """
+    if metrics is None:
+        metrics = JobMetrics()
+    if details is None:
+        details = {}
+    if progress is None:
+        progress = {}
+    user_limit = 250 ##this is hardcoded for now. will update later to included in user with the different plans
+    with metrics.timer('lookup'):
+        file_obj, job = dataAccess.get_file_and_job(file_id, job_id, user_id)
+    details['fileType'] = file_obj['file_type']
+    prepared_products_key = 'products' + '_job_id_' + job_id
+    batch_size = get_products_batch_size()
+    products_format = get_products_format()
+
+    with metrics.timer('prefetch'):
+        product_file, ProductGenerator, cached_sheet, previous_hashes = prefetch_job(dataAccess, file_obj, job, metrics, progress)
+    product_hashes = get_product_hashes(job, previous_hashes)
+    with product_file:
         product_generator_info = {
             'file_object': file_obj,
-            'file_content': product_file_content, 
+            'file_content': product_file,
             'job_type': TaskType[job['type']],
-            'options': job['options'] 
+            'options': job['options'],
+            'chunk_size': get_csv_chunk_size(),
+            'csv_engine': get_csv_engine(),
+            'stream_excel': is_stream_excel(),
+            'processes': get_generator_processes(),
+            'product_limit': user_limit,
+            'cached_sheet': cached_sheet,
+            'metrics': metrics
         }
         product_generator = ProductGenerator(product_generator_info)
-        products = product_generator.get_products()
-        product_limit_exceeded = False
-        if len(products) > user_limit: 
-            products = products[0:user_limit]
-            product_limit_exceeded = True
-        prepared_products_file_key = 'products' + '_job_id_' + job_id + '.json'
-        dataAccess.save_prepared_products(prepared_products_file_key, json.dumps(products))
-        dataAccess.basic_job_update({
-            'id': job_id,
-            'user_id': job['user_id'],
-            'total_products': len(products),
-            'current_batch': 1,
-            'input_products': prepared_products_file_key,
-            'product_limit_exceeded': product_limit_exceeded
-        })
-        dataAccess.publish_to_product_processor({
+        message_queue = None
+        if batch_size is None:
+            input_products = prepared_products_key + FORMAT_EXTENSIONS[products_format]
+            writer = dataAccess.get_prepared_products_writer(input_products, metrics, product_hashes, products_format)
+        else:
+            writer, message_queue = get_batched_products_writer(dataAccess, metrics, job, user_id, prepared_products_key, batch_size, product_hashes, products_format, progress)
+            input_products = writer.get_manifest_key()
+        with writer:
+            total_products = writer.write_all(product_generator.iter_products())
+    product_limit_exceeded = product_generator.is_product_limit_exceeded()
+    job_update = {
+        'id': job_id,
+        'user_id': job['user_id'],
+        'total_products': total_products,
+        'current_batch': 1,
+        'input_products': input_products,
+        'products_format': products_format.name,
+        'product_limit_exceeded': product_limit_exceeded
+    }
+    if batch_size is not None:
+        job_update['total_batches'] = writer.get_batch_count()
+    if product_hashes is not None and is_only_changed_products(job):
+        job_update['unchanged_products'] = product_hashes.get_unchanged_count()
+    if is_save_job_metrics():
+        # saved before the job is updated, so the update and publish stages aren't part of them
+        job_update['metrics'] = metrics.to_dict()
+    if batch_size is None:
+        update_and_publish(dataAccess, metrics, job_update, {
             'jobId': job_id,
             'userId': user_id
         })
-    except Exception as error:
-        logging.exception('Job failed to prepare products. Details: %s', error)
-        dataAccess.update_failed_job_transaction({
-                'id': job_id,
-                'user_id': job['user_id'],
-                'status': JobStatus.FAILED.name
+        progress['processing'] = True
+    else:
+        # the processor already started on the first batch, and knows how many
+        # batches there are before the messages of the last ones are published
+        try:
+            with metrics.timer('update'):
+                dataAccess.basic_job_update(job_update)
+            if message_queue is not None:
+                message_queue.flush()
+        except Exception:
+            writer.fail()
+            raise
+    if product_hashes is not None:
+        save_product_hashes(dataAccess, job, product_hashes)
+
+
+def get_batched_products_writer(dataAccess, metrics, job, user_id, prepared_products_key, batch_size, product_hashes, products_format, progress=None):
+    """
+    Gets a writer that saves the prepared products of a job in batches
+
+    The job is pointed at the manifest of the batches, and the product processor
+    is told about it, as soon as the first batch is saved. With fan out, a
+    message is published for each batch instead, so each batch can be processed
+    by an invocation of its own. Messages are published ten at a time with
+    PublishBatch, except for the first batch, which is published right away.
+    progress['processing'] is set once the processor was told about the manifest.
+
+    Returns
+    ------
+    writer and message queue: tuple
+        the writer and, with fan out, the queue with the messages of the last
+        batches, which should be flushed once the writer is closed
+    """
+    message_queue = None
+    if is_fan_out():
+        def publish_batch(messages):
+            with metrics.timer('publish'):
+                dataAccess.publish_batch_to_product_processor(messages)
+        message_queue = MessageQueue(publish_batch)
+
+    def add_batch(batch_number, batch_key, product_count):
+        message_queue.add({
+            'jobId': job['id'],
+            'userId': user_id,
+            'manifest': writer.get_manifest_key(),
+            'batch': batch_number,
+            'batchKey': batch_key,
+            'batchProducts': product_count
+        })
+
+    def start_processing(manifest_key):
+        job_update = {
+            'id': job['id'],
+            'user_id': job['user_id'],
+            'current_batch': 1,
+            'input_products': manifest_key,
+            'products_format': products_format.name
+        }
+        if message_queue is not None:
+            job_update['fan_out'] = True
+        if message_queue is None or writer.get_batch_count() == 0:
+            update_and_publish(dataAccess, metrics, job_update, {
+                'jobId': job['id'],
+                'userId': user_id,
+                'manifest': manifest_key
             })
-    return None
+        else:
+            with metrics.timer('update'):
+                dataAccess.basic_job_update(job_update)
+            message_queue.flush()
+        if progress is not None:
+            progress['processing'] = True
+
+    on_batch = None if message_queue is None else add_batch
+    writer = dataAccess.get_batched_products_writer(prepared_products_key, batch_size, start_processing, metrics, product_hashes, on_batch, products_format)
+    return writer, message_queue
+
+
+def update_and_publish(dataAccess, metrics, job_update, message):
+    """Updates the job with where its prepared products are, and tells the product processor they are ready"""
+    with metrics.timer('update'):
+        dataAccess.basic_job_update(job_update)
+    with metrics.timer('publish'):
+        dataAccess.publish_to_product_processor(message)
+
+
+def get_product_hashes(job, previous_hashes):
+    """
+    Gets the hashes that find the products which changed since the user's last import
+
+    Imports record the content hash of each product handle. Edit imports with
+    the onlyChangedProducts option leave out the products whose hash is the
+    same as in the last completed import, so only changed products are processed.
+
+    Returns
+    ------
+    product hashes: ProductHashes
+        the hashes, or None for jobs that aren't imports
+    """
+    job_type = TaskType[job['type']]
+    if job_type != TaskType.IMPORT_CREATE and job_type != TaskType.IMPORT_EDIT:
+        return None
+    return ProductHashes(previous_hashes, is_only_changed_products(job))
+
+
+def is_only_changed_products(job):
+    """Returns whether a job leaves out the products that haven't changed since the user's last import"""
+    return TaskType[job['type']] == TaskType.IMPORT_EDIT and job['options'].get('onlyChangedProducts', False)
+
+
+def get_previous_product_hashes(dataAccess, job, metrics=None):
+    """
+    Gets the hash each product handle had in the user's last completed imports
+
+    The hashes only save work, so when they can't be read every product is
+    handled as changed.
+
+    Returns
+    ------
+    hashes: dict
+        the hash of each handle, empty when they can't be read
+    """
+    if metrics is None:
+        metrics = JobMetrics()
+    try:
+        with metrics.timer('hashes'):
+            job_hashes = dataAccess.get_product_hashes(job['user_id'])
+            job_statuses = dataAccess.get_job_statuses(job['user_id'], [job_hash['job_id'] for job_hash in job_hashes])
+            return merge_job_hashes(job_hashes, job_statuses)
+    except Exception as error:
+        logging.warning('Could not get product hashes of job ' + job['id'] + ', so every product is handled as changed. Details: %s', error)
+        return {}
+
+
+def save_product_hashes(dataAccess, job, product_hashes):
+    """Saves the hashes of the job's products once the job is handed to the product processor
+
+    The job is already prepared, so it doesn't fail when the hashes can't be
+    saved. The next edit import then compares with older hashes, and processes
+    more products than it has to.
+    """
+    try:
+        dataAccess.save_product_hashes(job['user_id'], job['id'], product_hashes.get_hashes())
+    except Exception as error:
+        logging.exception('Could not save product hashes of job ' + job['id'] + '. Details: %s', error)
+
+
+def prefetch_job(dataAccess, file_obj, job, metrics=None, progress=None):
+    """
+    Opens the product file while the job is marked as preparing and pandas is imported
+
+    Only the download depends on the file record, so the PREPARING status
+    transaction and the import run on other threads while the file is opened.
+    Edit imports that only prepare changed products also read the product
+    hashes of the user's last imports on another thread. None of them use
+    the dynamodb resource of dataAccess while another one does.
+    The status transaction has finished when this returns, also when it raises,
+    so a failed job is never marked as preparing after it was marked as failed.
+    progress['preparing'] is set when the transaction succeeded, even if the
+    file could not be opened.
+
+    csv files are parsed as they download, except for the ones read with
+    pyarrow, which are downloaded into a seekable file first, so pyarrow can
+    read them again with pandas when it fails on a row.
+
+    Excel files whose sheet was parsed by an earlier job of the container, and
+    that haven't changed since, aren't downloaded again. Their ETag is only
+    asked for when a sheet of the file is cached. Streamed excel files aren't
+    cached, since their sheet is never held whole.
+
+    Returns
+    ------
+    product file, generator, cached sheet and previous hashes: tuple
+        the opened product file, which the caller should close, the ProductGenerator
+        class, the cached sheet of an excel file, or None for csv files, and the
+        hash each product handle had in the last imports, empty unless the job
+        only prepares changed products
+    """
+    # excel files need seeking, like the csv files read with pyarrow
+    is_excel_file = FileType[file_obj['file_type']] == FileType.EXCEL
+    is_seekable_file = is_excel_file or is_pyarrow_file(file_obj)
+    cached_sheet = None
+    status_update = None
+    previous_hashes = None
+    try:
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            status_update = executor.submit(dataAccess.update_job_transaction, {
+                    'id': job['id'],
+                    'user_id': job['user_id'],
+                    'status': JobStatus.PREPARING.name
+                })
+            generator_import = executor.submit(import_product_generator)
+            if is_only_changed_products(job):
+                previous_hashes = executor.submit(get_previous_product_hashes, dataAccess, job, metrics)
+            s3_key = file_obj['s3_key']
+            is_cached_file = is_excel_file and get_sheet_cache() is not None and not is_stream_excel()
+            if is_cached_file and get_sheet_cache().has_file(s3_key):
+                # the ETag changes when the file is uploaded again under the same key
+                cached_sheet = get_sheet_cache().get_sheet(s3_key + '#' + dataAccess.get_file_etag(s3_key))
+            if cached_sheet is not None and cached_sheet.frame is not None:
+                if metrics is not None:
+                    metrics.add_count('sheet_cache_hits')
+                product_file = io.BytesIO()
+            elif is_cached_file:
+                # a miss takes the ETag of the version it downloads from the download itself
+                product_file, etag = dataAccess.download_product_file(s3_key, metrics)
+                cached_sheet = get_sheet_cache().get_sheet(s3_key + '#' + etag)
+            else:
+                product_file = dataAccess.open_product_file(s3_key, seekable=is_seekable_file, metrics=metrics)
+    finally:
+        # the executor has waited for the transaction
+        if progress is not None and status_update is not None and status_update.exception() is None:
+            progress['preparing'] = True
+
+    try:
+        status_update.result()
+        return product_file, generator_import.result(), cached_sheet, {} if previous_hashes is None else previous_hashes.result()
+    except Exception:
+        product_file.close()
+        raise
+
+
+def is_pyarrow_file(file_obj):
+    """Returns whether a csv file is read with pyarrow, which it only is when it is downloaded into a seekable file"""
+    if FileType[file_obj['file_type']] != FileType.CSV:
+        return False
+    return is_pyarrow_wanted(get_csv_engine(), int(file_obj.get('actual_row_count') or 0))
+
+
+def import_product_generator():
+    """Imports ProductGenerator, and with it pandas, once there is a file to read"""
+    from utility.product_generator import ProductGenerator
+    return ProductGenerator
+
+
+def get_data_access():
+    """Returns the DataAccess of the current thread, so its boto3 clients are only created once per thread
+
+    boto3 resources can't be shared between threads, and the default session
+    that creates them isn't thread safe either, so they are created one at a time.
+    """
+    if not hasattr(thread_data, 'data_access'):
+        with data_access_lock:
+            thread_data.data_access = DataAccess()
+    return thread_data.data_access
+
+
+def get_sheet_cache():
+    """Returns the cache of parsed excel sheets, which is kept for the warm invocations, or None when it is turned off"""
+    global sheet_cache
+    if sheet_cache is None:
+        with sheet_cache_lock:
+            if sheet_cache is None:
+                memory_limit = get_megabytes('sheet_cache_memory_mb', 0)
+                disk_limit = get_megabytes('sheet_cache_disk_mb', 0)
+                if memory_limit == 0 and disk_limit == 0:
+                    return None
+                sheet_cache = SheetCache(memory_limit=memory_limit, disk_limit=disk_limit)
+    return sheet_cache
+
+
+def get_job_executor():
+    """Returns the pool of threads jobs are prepared on, which is kept for the warm invocations"""
+    global job_executor
+    if job_executor is None:
+        job_executor = ThreadPoolExecutor(max_workers=get_max_concurrent_jobs())
+    return job_executor
+
+
+def get_max_concurrent_jobs():
+    """Returns the number of jobs of an event that are prepared at the same time"""
+    max_concurrent_jobs = os.environ.get('max_concurrent_jobs')
+    if max_concurrent_jobs is None or max_concurrent_jobs == '':
+        return DEFAULT_MAX_CONCURRENT_JOBS
+    return int(max_concurrent_jobs)
+
+
+def is_save_job_metrics():
+    """Returns whether the stage metrics of a job are saved on its record as well as logged"""
+    return os.environ.get('save_job_metrics', '').lower() == 'true'
+
+
+def get_megabytes(name, default):
+    """Returns the number of bytes set in megabytes by an environment variable"""
+    megabytes = os.environ.get(name)
+    if megabytes is None or megabytes == '':
+        return default
+    return int(megabytes) * 1024 * 1024
+
+
+def get_generator_processes():
+    """Returns the number of processes products are generated with
+
+    Lambda only gives a function more than one vCPU from 1769 MB, so more than
+    one process is only faster with a MemorySize of about 3538 MB or more.
+    """
+    processes = os.environ.get('generator_processes')
+    if processes is None or processes == '':
+        return 1
+    return int(processes)
+
+
+def get_products_format():
+    """Returns the format prepared products are saved in, a json array unless products_format is set"""
+    products_format = os.environ.get('products_format')
+    if products_format is None or products_format == '':
+        return ProductsFormat.JSON
+    return ProductsFormat[products_format]
+
+
+def is_stream_excel():
+    """Returns whether xlsx files are streamed chunk by chunk, with their cells read as text like csv files"""
+    return os.environ.get('stream_excel', '').lower() == 'true'
+
+
+def is_fan_out():
+    """Returns whether a message is published for each batch of prepared products, rather than one per job"""
+    return os.environ.get('products_fan_out', '').lower() == 'true'
+
+
+def get_products_batch_size():
+    """Returns the number of products in each prepared products batch, or None to prepare them as a single file"""
+    batch_size = os.environ.get('products_batch_size')
+    if batch_size is None or batch_size == '':
+        return None
+    return int(batch_size)
+
+
+def get_csv_engine():
+    """Returns the parser csv files are read with, picked for each file unless csv_engine is set"""
+    csv_engine = os.environ.get('csv_engine')
+    if csv_engine is None or csv_engine == '':
+        return CsvEngine.AUTO
+    return CsvEngine[csv_engine]
+
+
+def get_csv_chunk_size():
+    """Returns the number of rows to read at a time from csv files, or None to read them whole when csv_chunk_size is 0"""
+    chunk_size = os.environ.get('csv_chunk_size')
+    if chunk_size is None or chunk_size == '':
+        return DEFAULT_CSV_CHUNK_SIZE
+    if int(chunk_size) == 0:
+        return None
+    return int(chunk_size)
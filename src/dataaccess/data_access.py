@@ -1,14 +1,36 @@
 import logging
 import boto3
+import io
 import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from datamodel.custom_exceptions import DataAccessError
 from boto3.dynamodb.conditions import Key
 from dataaccess import data_model_utils
+from dataaccess.prepared_products_writer import BatchedProductsWriter, PreparedProductsWriter, S3PartStore, FORMAT_CONTENT_ARGS
+from datamodel.custom_enums import ProductsFormat
+from dataaccess.product_processor_publisher import ProductProcessorPublisher
+from dataaccess.s3_body_reader import S3BodyReader
 from utility import utils
 import os
 
 
+# product files larger than this are spooled to /tmp instead of memory
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
+# attempts at reading the keys a batch get leaves unprocessed when throttled
+BATCH_GET_ATTEMPTS = 5
+# most keys a batch get can ask for
+BATCH_GET_MAX_KEYS = 100
+# number of a user's last jobs whose product hashes are kept
+PRODUCT_HASH_JOBS = 20
+# number of product hashes files read at the same time
+PRODUCT_HASH_READERS = 8
+
+
 class DataAccess:
     """ 
     Class for getting data and adding data to database and other sources
@@ -59,7 +81,63 @@ class DataAccess:
         except ClientError as error:
             raise DataAccessError(error)
 
-    
+
+    def get_file_and_job(self, file_id, job_id, user_id):
+        """
+        Gets the file and the job of a job with a single batch get
+
+        Parameters
+        ----------
+        file_id: str, required
+            id of the file the products are generated from
+
+        job_id: str, required
+            id of the job
+
+        user_id: str, required
+            id of the user of the job
+
+        Returns
+        ------
+        file and job: tuple
+            the file object and the job object
+        """
+        file_key = data_model_utils.convert_to_db_file({'id': file_id})
+        job_key = data_model_utils.convert_to_db_job({'id': job_id, 'user_id': user_id})
+        items = self.__batch_get_items([file_key, job_key])
+
+        file_obj = None
+        job_obj = None
+        for item in items:
+            if item['PK'] == file_key['PK'] and item['SK'] == file_key['SK']:
+                file_obj = data_model_utils.extract_file_details(item)
+            elif item['PK'] == job_key['PK'] and item['SK'] == job_key['SK']:
+                job_obj = data_model_utils.extract_job_details(item)
+        if file_obj is None:
+            raise DataAccessError('Response to get file is invalid. Details: file ' + file_id + ' was not found')
+        if job_obj is None:
+            raise DataAccessError('Response to get job is invalid. Details: job ' + job_id + ' was not found')
+        return file_obj, job_obj
+
+
+    def __batch_get_items(self, keys):
+        table_name = self._bulk_manager_table.name
+        request_items = {table_name: {'Keys': keys}}
+        items = []
+        try:
+            for attempt in range(BATCH_GET_ATTEMPTS):
+                response = self._dynamodb.batch_get_item(RequestItems=request_items)
+                items.extend(response['Responses'].get(table_name, []))
+                request_items = response.get('UnprocessedKeys')
+                if not request_items:
+                    return items
+                # back off before asking again for the keys that were throttled
+                time.sleep(0.05 * (2 ** attempt))
+        except ClientError as error:
+            raise DataAccessError(error)
+        raise DataAccessError('Could not get items. Details: keys were left unprocessed ' + str(request_items))
+
+
     def get_product_file (self, file_key):
         try:
             response = self._s3_client.get_object (
@@ -71,7 +149,132 @@ class DataAccess:
             raise DataAccessError(error)
 
 
-    def basic_job_update (self, job):
+    def open_product_file(self, file_key, seekable=False, metrics=None):
+        """
+        Opens an uploaded product file for reading without first reading the whole body
+
+        Parameters
+        ----------
+        file_key: str, required
+            key of the file in the upload bucket
+
+        seekable: bool, optional
+            whether the file has to support seeking, like excel files do. The file
+            is then downloaded into a temporary file that is spooled to /tmp when
+            it gets large. Otherwise the response body is read as it downloads.
+
+        metrics: JobMetrics, optional
+            metrics the download time and size are added to
+
+        Returns
+        ------
+        file: binary file object
+            the product file, which the caller should close
+        """
+        try:
+            if seekable:
+                product_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir='/tmp')
+                try:
+                    start = time.perf_counter()
+                    self._s3_client.download_fileobj(self._upload_bucket, file_key, product_file)
+                    if metrics is not None:
+                        metrics.add_time('download', time.perf_counter() - start)
+                        metrics.add_count('file_bytes', product_file.tell())
+                except Exception:
+                    product_file.close()
+                    raise
+                product_file.seek(0)
+                return product_file
+
+            response = self._s3_client.get_object (
+                Bucket=self._upload_bucket,
+                Key=file_key
+            )
+            return io.BufferedReader(S3BodyReader(response['Body'], metrics), READ_BUFFER_SIZE)
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def download_product_file(self, file_key, metrics=None):
+        """
+        Downloads an uploaded product file into a seekable temporary file, along with its ETag
+
+        The ETag comes from the get_object response, so the file doesn't need
+        a head_object call of its own to be cached under its ETag.
+
+        Parameters
+        ----------
+        file_key: str, required
+            key of the file in the upload bucket
+
+        metrics: JobMetrics, optional
+            metrics the download time and size are added to
+
+        Returns
+        ------
+        file and etag: tuple
+            the product file, which the caller should close, and the ETag of the
+            version of the file that was downloaded
+        """
+        product_file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir='/tmp')
+        try:
+            response = self._s3_client.get_object(
+                Bucket=self._upload_bucket,
+                Key=file_key
+            )
+            with io.BufferedReader(S3BodyReader(response['Body'], metrics), READ_BUFFER_SIZE) as body:
+                shutil.copyfileobj(body, product_file, READ_BUFFER_SIZE)
+            product_file.seek(0)
+            return product_file, response['ETag']
+        except ClientError as error:
+            product_file.close()
+            raise DataAccessError(error)
+        except Exception:
+            product_file.close()
+            raise
+
+
+    def get_file_etag(self, file_key):
+        """
+        Gets the ETag of an uploaded product file, which changes whenever the file does
+
+        Parameters
+        ----------
+        file_key: str, required
+            key of the file in the upload bucket
+
+        Returns
+        ------
+        etag: str
+        """
+        try:
+            response = self._s3_client.head_object(
+                Bucket=self._upload_bucket,
+                Key=file_key
+            )
+            return response['ETag']
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def basic_job_update (self, job, only_existing=False):
+        """
+        Sets the values of job on its record
+
+        Parameters
+        ----------
+        job: dict, required
+            the id and user_id of the job, along with the values to set
+
+        only_existing: bool, optional
+            whether the job is only updated when its record exists, so an update
+            for a job that was never found doesn't create a record for it
+
+        Returns
+        ------
+        updated: bool
+            False when only_existing is set and the job doesn't exist
+        """
         if 'id' not in job or 'user_id' not in job:
             raise KeyError('\'id\' and \'user_id\' value for job cannot be null')
         
@@ -85,17 +288,24 @@ class DataAccess:
         expression_attr_values = utils.get_expression_attr_values(db_job)
         update_expression = utils.get_update_expression(expression_attr_values)
 
+        update_args = {
+            'Key': primary_key,
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeValues': expression_attr_values,
+            'ReturnValues': 'UPDATED_NEW'
+        }
+        if only_existing:
+            update_args['ConditionExpression'] = 'attribute_exists(PK)'
+
         try:
-            response = self._bulk_manager_table.update_item(
-                Key=primary_key,
-                UpdateExpression=update_expression,
-                ExpressionAttributeValues=expression_attr_values,
-                ReturnValues='UPDATED_NEW'
-            )
+            response = self._bulk_manager_table.update_item(**update_args)
 
             logging.info('Updated job successfully: %s', response)
             return True
         except ClientError as error:
+            if only_existing and error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logging.warning('Job %s was not updated since it does not exist', job['id'])
+                return False
             raise DataAccessError(error)
         except Exception as error:
             raise DataAccessError(error)
@@ -179,18 +389,210 @@ class DataAccess:
             raise DataAccessError(error)
 
 
-    def save_prepared_products(self, file_key, file_content):
+    def save_prepared_products(self, file_key, file_content, products_format=ProductsFormat.JSON):
         try:
             response = self._s3_client.put_object (
                 Bucket=self._prepared_products_bucket,
                 Body=file_content,
-                Key=file_key
+                Key=file_key,
+                **FORMAT_CONTENT_ARGS[products_format]
             )
             return True
         except ClientError as error:
             raise DataAccessError(error)
 
 
+    def get_prepared_products_writer(self, file_key, metrics=None, product_hashes=None, products_format=ProductsFormat.JSON):
+        """
+        Returns a writer that uploads prepared products to the file key as they are written
+
+        Parameters
+        ----------
+        file_key: str, required
+            key of the prepared products file in the prepared products bucket
+
+        metrics: JobMetrics, optional
+            metrics the serialize and upload times are added to
+
+        product_hashes: ProductHashes, optional
+            hashes that find the products that haven't changed since the last job
+
+        products_format: ProductsFormat, optional
+            format the products are saved in, a json array by default
+
+        Returns
+        ------
+        writer: PreparedProductsWriter
+        """
+        part_store = S3PartStore(self._s3_client, self._prepared_products_bucket, file_key, FORMAT_CONTENT_ARGS[products_format])
+        return PreparedProductsWriter(part_store, metrics=metrics, product_hashes=product_hashes, products_format=products_format)
+
+
+    def get_batched_products_writer(self, file_key, batch_size, on_first_batch=None, metrics=None, product_hashes=None, on_batch=None, products_format=ProductsFormat.JSON):
+        """
+        Returns a writer that saves prepared products in batches listed in a manifest
+
+        Parameters
+        ----------
+        file_key: str, required
+            key the batch and manifest keys in the prepared products bucket start with
+
+        batch_size: int, required
+            number of products in each batch
+
+        on_first_batch: callable, optional
+            called with the manifest key once the first batch is saved
+
+        metrics: JobMetrics, optional
+            metrics the serialize and upload times are added to
+
+        product_hashes: ProductHashes, optional
+            hashes that find the products that haven't changed since the last job
+
+        on_batch: callable, optional
+            called with the batch number, key and number of products of each batch once it is saved
+
+        products_format: ProductsFormat, optional
+            format the batches are saved in, a json array by default
+
+        Returns
+        ------
+        writer: BatchedProductsWriter
+        """
+        def get_part_store(key, key_format):
+            return S3PartStore(self._s3_client, self._prepared_products_bucket, key, FORMAT_CONTENT_ARGS[key_format])
+        return BatchedProductsWriter(get_part_store, file_key, batch_size, on_first_batch, metrics, product_hashes, on_batch, products_format)
+
+
+    def get_product_hashes(self, user_id, job_count=PRODUCT_HASH_JOBS):
+        """
+        Gets the content hash of each product handle the user's last prepared jobs had
+
+        Each job saves the hashes of its own products, so jobs of the same user
+        that are prepared at the same time don't overwrite each other's hashes.
+
+        Parameters
+        ----------
+        user_id: str, required
+            id of the user
+
+        job_count: int, optional
+            number of the user's last jobs to get the hashes of
+
+        Returns
+        ------
+        job hashes: list
+            a dict with the job_id and the hashes of each job, oldest first, and
+            empty when the user has no prepared jobs yet
+        """
+        keys = self.__list_product_hashes_keys(user_id)[-job_count:]
+        if len(keys) == 0:
+            return []
+        with ThreadPoolExecutor(max_workers=min(len(keys), PRODUCT_HASH_READERS)) as executor:
+            job_hashes = executor.map(self.__get_job_product_hashes, keys)
+            return [job_hash for job_hash in job_hashes if job_hash is not None]
+
+
+    def save_product_hashes(self, user_id, job_id, hashes, job_count=PRODUCT_HASH_JOBS):
+        """
+        Saves the content hash of each product handle of a prepared job
+
+        The hashes of the user's older jobs, beyond the last job_count, are
+        deleted. Their handles are then reported as changed by later jobs.
+
+        Parameters
+        ----------
+        user_id: str, required
+            id of the user
+
+        job_id: str, required
+            id of the job
+
+        hashes: dict
+            the hash of each handle of the job, or None for handles whose hash isn't known
+
+        job_count: int, optional
+            number of the user's last jobs whose hashes are kept
+        """
+        # keys sort in the order the jobs were saved in
+        key = self.__get_product_hashes_prefix(user_id) + str(time.time_ns()).zfill(20) + '_job_id_' + job_id + '.json'
+        try:
+            self._s3_client.put_object(
+                Bucket=self._prepared_products_bucket,
+                Body=json.dumps({'job_id': job_id, 'hashes': hashes}).encode('utf-8'),
+                Key=key
+            )
+            old_keys = self.__list_product_hashes_keys(user_id)[:-job_count]
+            if len(old_keys) > 0:
+                self._s3_client.delete_objects(
+                    Bucket=self._prepared_products_bucket,
+                    Delete={'Objects': [{'Key': old_key} for old_key in old_keys], 'Quiet': True}
+                )
+            return True
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def get_job_statuses(self, user_id, job_ids):
+        """
+        Gets the status of jobs of a user with batch gets
+
+        Parameters
+        ----------
+        user_id: str, required
+            id of the user of the jobs
+
+        job_ids: list, required
+            ids of the jobs
+
+        Returns
+        ------
+        statuses: dict
+            the status of each job that was found
+        """
+        statuses = {}
+        job_ids = list(dict.fromkeys(job_ids))
+        for start in range(0, len(job_ids), BATCH_GET_MAX_KEYS):
+            keys = [data_model_utils.convert_to_db_job({'id': job_id, 'user_id': user_id}) for job_id in job_ids[start:start + BATCH_GET_MAX_KEYS]]
+            for item in self.__batch_get_items(keys):
+                job = data_model_utils.extract_job_details(item)
+                statuses[job['id']] = job.get('status')
+        return statuses
+
+
+    def __get_job_product_hashes(self, key):
+        try:
+            response = self._s3_client.get_object(
+                Bucket=self._prepared_products_bucket,
+                Key=key
+            )
+            return json.loads(response['Body'].read())
+        except ClientError as error:
+            # the file was deleted by a job that saved its hashes since it was listed
+            if error.response.get('Error', {}).get('Code') == 'NoSuchKey':
+                return None
+            raise DataAccessError(error)
+
+
+    def __list_product_hashes_keys(self, user_id):
+        """Lists the keys of the user's product hashes, oldest first"""
+        keys = []
+        request = {'Bucket': self._prepared_products_bucket, 'Prefix': self.__get_product_hashes_prefix(user_id)}
+        try:
+            while True:
+                response = self._s3_client.list_objects_v2(**request)
+                keys.extend(content['Key'] for content in response.get('Contents', []))
+                if not response.get('IsTruncated'):
+                    return sorted(keys)
+                request['ContinuationToken'] = response['NextContinuationToken']
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def __get_product_hashes_prefix(self, user_id):
+        return 'product_hashes/user_id_' + user_id + '/'
+
+
     def publish_to_product_processor(self, message):
         import_topic = os.environ.get('import_topic_arn')
         try:
@@ -207,4 +609,10 @@ class DataAccess:
             if 'MessageId' in response:
                 return True
         except Exception as error:
-            raise Exception('Could not publish message successfully. Error:' + str(error))
\ No newline at end of file
+            raise Exception('Could not publish message successfully. Error:' + str(error))
+
+
+    def publish_batch_to_product_processor(self, messages):
+        """Publishes several messages to the product processor with as few PublishBatch requests as possible"""
+        import_topic = os.environ.get('import_topic_arn')
+        return ProductProcessorPublisher(self._sns_client, import_topic).publish_batch(messages)
\ No newline at end of file
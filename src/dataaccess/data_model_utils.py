@@ -78,8 +78,18 @@ def convert_to_db_job (job):
         db_job['status'] = job['status']
     if 'duration' in job:
         db_job['duration'] = job['duration']
+    if 'metrics' in job:
+        db_job['metrics'] = json.dumps(job['metrics'])
     if 'product_limit_exceeded' in job:
         db_job['product_limit_exceeded'] = job['product_limit_exceeded']
+    if 'unchanged_products' in job:
+        db_job['unchanged_products'] = job['unchanged_products']
+    if 'total_batches' in job:
+        db_job['total_batches'] = job['total_batches']
+    if 'fan_out' in job:
+        db_job['fan_out'] = job['fan_out']
+    if 'products_format' in job:
+        db_job['products_format'] = job['products_format']
 
     return db_job
 
@@ -113,7 +123,17 @@ def extract_job_details(db_job):
         job['status'] = db_job['status']
     if 'duration' in db_job:
         job['duration'] = db_job['duration']
+    if 'metrics' in db_job:
+        job['metrics'] = json.loads(db_job['metrics'])
     if 'product_limit_exceeded' in db_job:
         job['product_limit_exceeded'] = db_job['product_limit_exceeded']
+    if 'unchanged_products' in db_job:
+        job['unchanged_products'] = int(db_job['unchanged_products'])
+    if 'total_batches' in db_job:
+        job['total_batches'] = int(db_job['total_batches'])
+    if 'fan_out' in db_job:
+        job['fan_out'] = db_job['fan_out']
+    if 'products_format' in db_job:
+        job['products_format'] = db_job['products_format']
     
     return job
\ No newline at end of file
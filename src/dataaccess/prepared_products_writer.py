@@ -0,0 +1,467 @@
+import json
+import logging
+import os
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from datamodel.custom_enums import ProductsFormat
+from datamodel.custom_exceptions import DataAccessError
+
+
+# S3 requires every part except the last one to be at least 5 MB
+PART_SIZE = 8 * 1024 * 1024
+MAX_PENDING_PARTS = 2
+# gzip level of NDJSON_GZIP products, lower levels are faster but products compress much less
+COMPRESSION_LEVEL = 6
+
+# file extension and object metadata of each format
+FORMAT_EXTENSIONS = {ProductsFormat.JSON: '.json', ProductsFormat.NDJSON_GZIP: '.ndjson.gz'}
+FORMAT_CONTENT_ARGS = {
+    ProductsFormat.JSON: {},
+    ProductsFormat.NDJSON_GZIP: {'ContentType': 'application/x-ndjson', 'ContentEncoding': 'gzip'}
+}
+
+
+class PreparedProductsWriter:
+    """
+    Class to write prepared products while they are being generated
+
+    Products are serialized one at a time into the same json array that
+    json.dumps(products) would produce, and uploaded in parts as the array
+    grows, so only a few parts are held in memory at once. In the NDJSON_GZIP
+    format each product is a line of json instead, and the lines are gzip
+    compressed as they are written. Parts are uploaded
+    on a background thread while the next part is being serialized. Output
+    that fits in a single part is saved as a whole object.
+
+    When metrics are given, the time spent serializing products, uploading
+    parts and waiting for uploads to finish is added to them. When product
+    hashes are given, products they report as unchanged are left out.
+    """
+
+    def __init__(self, part_store, part_size=PART_SIZE, max_pending_parts=MAX_PENDING_PARTS, metrics=None, product_hashes=None, products_format=ProductsFormat.JSON):
+        self._part_store = part_store
+        self._metrics = metrics
+        self._product_hashes = product_hashes
+        self._part_size = part_size
+        self._max_pending_parts = max_pending_parts
+        self._compressor = None
+        if products_format == ProductsFormat.NDJSON_GZIP:
+            self._compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._buffer = bytearray()
+        else:
+            self._buffer = bytearray(b'[')
+        self._pending_parts = []
+        self._part_count = 0
+        self._product_count = 0
+        self._executor = None
+        self._closed = False
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+    def write(self, product):
+        """
+        Adds a product to the prepared products
+
+        Parameters
+        ----------
+        product: dict, required
+            the product item to write
+        """
+        start = time.perf_counter()
+        content = json.dumps(product).encode('utf-8')
+        if self._product_hashes is not None and not self._product_hashes.is_written(product, content):
+            self.__add_time('serialize', start)
+            return
+        if self._compressor is not None:
+            self._buffer += self._compressor.compress(content + b'\n')
+        else:
+            if self._product_count > 0:
+                self._buffer += b', '
+            self._buffer += content
+        self._product_count += 1
+        self.__add_time('serialize', start)
+        if len(self._buffer) >= self._part_size:
+            self.__flush_part()
+
+
+    def write_all(self, products):
+        """Writes every product of an iterable and returns the number of products written"""
+        for product in products:
+            self.write(product)
+        return self._product_count
+
+
+    def get_product_count(self):
+        return self._product_count
+
+
+    def close(self):
+        """Finishes the array, or the compressed lines, and completes the upload"""
+        if self._closed:
+            return
+        if self._compressor is not None:
+            self._buffer += self._compressor.flush()
+        else:
+            self._buffer += b']'
+        try:
+            if self._part_count == 0:
+                self.__upload(self._part_store.put, bytes(self._buffer))
+            else:
+                self.__flush_part()
+                self.__wait_for_parts(0)
+                self.__upload(self._part_store.complete)
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            self.__shutdown()
+        self._closed = True
+
+
+    def abort(self):
+        """Stops the upload and discards the parts uploaded so far"""
+        if self._closed:
+            return
+        self._closed = True
+        for pending_part in self._pending_parts:
+            pending_part.cancel()
+        self.__shutdown()
+        if self._part_count > 0:
+            try:
+                self._part_store.abort()
+            except Exception as error:
+                logging.exception('Could not abort prepared products upload. Details: %s', error)
+
+
+    def __flush_part(self):
+        if self._executor is None:
+            self._part_store.begin()
+            self._executor = ThreadPoolExecutor(max_workers=self._max_pending_parts)
+
+        # keep at most max_pending_parts parts in memory waiting to be uploaded
+        self.__wait_for_parts(self._max_pending_parts - 1)
+        self._part_count += 1
+        part = bytes(self._buffer)
+        self._buffer = bytearray()
+        self._pending_parts.append(self._executor.submit(self.__upload, self._part_store.upload_part, self._part_count, part))
+
+
+    def __wait_for_parts(self, max_pending_parts):
+        start = time.perf_counter()
+        while len(self._pending_parts) > max_pending_parts:
+            self._pending_parts.pop(0).result()
+        self.__add_time('upload_wait', start)
+
+
+    def __upload(self, upload, *args):
+        start = time.perf_counter()
+        upload(*args)
+        self.__add_time('upload', start)
+
+
+    def __add_time(self, stage, start):
+        if self._metrics is not None:
+            self._metrics.add_time(stage, time.perf_counter() - start)
+
+
+    def __shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class BatchedProductsWriter:
+    """
+    Class to write prepared products as batch files listed in a manifest
+
+    Every batch_size products are written to a json array file of their own,
+    and the manifest is saved again each time a batch is complete, so the
+    product processor can start on the first batches while the next ones are
+    still being generated. on_batch is called with each batch once it is saved,
+    and then on_first_batch with the manifest key once the first batch is
+    saved, or once the manifest is complete when there are no products at all.
+
+    The manifest lists the key and number of products of each batch, the total
+    number of products, and whether the batches are complete or failed. A
+    manifest that failed after the processor started on it is also truncated:
+    its batches are fine, but the products after them are missing.
+    """
+
+    def __init__(self, get_part_store, file_key, batch_size, on_first_batch=None, metrics=None, product_hashes=None, on_batch=None, products_format=ProductsFormat.JSON):
+        """
+        Parameters
+        ----------
+        get_part_store: callable, required
+            returns the part store for a key and the format of its content
+
+        file_key: str, required
+            key the batch and manifest keys start with
+
+        batch_size: int, required
+            number of products in each batch
+
+        on_first_batch: callable, optional
+            called with the manifest key once the processor can start
+
+        metrics: JobMetrics, optional
+            metrics the serialize and upload times are added to
+
+        product_hashes: ProductHashes, optional
+            hashes that find the products that haven't changed since the last job
+
+        on_batch: callable, optional
+            called with the batch number, key and number of products of each batch once it is saved
+
+        products_format: ProductsFormat, optional
+            format of the batches, the manifest is always json
+        """
+        self._get_part_store = get_part_store
+        self._on_batch = on_batch
+        self._products_format = products_format
+        self._file_key = file_key
+        self._batch_size = batch_size
+        self._on_first_batch = on_first_batch
+        self._metrics = metrics
+        self._product_hashes = product_hashes
+        self._writer = None
+        self._batch_key = None
+        self._batches = []
+        self._product_count = 0
+        self._closed = False
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+        return False
+
+
+    def get_manifest_key(self):
+        return self._file_key + '_manifest.json'
+
+
+    def write(self, product):
+        """Adds a product to the current batch, saving the batch once it is full"""
+        if self._writer is None:
+            batch_key = self._file_key + '_batch_' + str(len(self._batches) + 1) + FORMAT_EXTENSIONS[self._products_format]
+            self._writer = PreparedProductsWriter(self._get_part_store(batch_key, self._products_format), metrics=self._metrics, product_hashes=self._product_hashes, products_format=self._products_format)
+            self._batch_key = batch_key
+        self._writer.write(product)
+        if self._writer.get_product_count() == self._batch_size:
+            self.__save_batch()
+
+
+    def write_all(self, products):
+        """Writes every product of an iterable and returns the number of products written"""
+        for product in products:
+            self.write(product)
+        return self._product_count + (0 if self._writer is None else self._writer.get_product_count())
+
+
+    def get_product_count(self):
+        return self._product_count
+
+
+    def get_batch_count(self):
+        return len(self._batches)
+
+
+    def close(self):
+        """Saves the last batch and completes the manifest"""
+        if self._closed:
+            return
+        if self._writer is not None:
+            if self._writer.get_product_count() > 0:
+                self.__save_batch()
+            else:
+                # every product of the last batch was left out
+                self._writer.abort()
+                self._writer = None
+        self.__save_manifest(True, False)
+        self._closed = True
+        if len(self._batches) == 0 and self._on_first_batch is not None:
+            self._on_first_batch(self.get_manifest_key())
+
+
+    def abort(self):
+        """Discards the current batch and marks the manifest as failed once the processor knows of it"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        self.fail()
+
+
+    def fail(self):
+        """Marks the manifest as failed and truncated once the processor knows of it, also after it was completed"""
+        if len(self._batches) == 0:
+            return
+        try:
+            self.__save_manifest(False, True, True)
+        except Exception as error:
+            logging.exception('Could not mark prepared products manifest as failed. Details: %s', error)
+
+
+    def __save_batch(self):
+        writer = self._writer
+        self._writer = None
+        writer.close()
+        self._batches.append({'key': self._batch_key, 'total_products': writer.get_product_count()})
+        self._product_count += writer.get_product_count()
+        self.__save_manifest(False, False)
+        if self._on_batch is not None:
+            self._on_batch(len(self._batches), self._batch_key, writer.get_product_count())
+        if len(self._batches) == 1 and self._on_first_batch is not None:
+            self._on_first_batch(self.get_manifest_key())
+
+
+    def __save_manifest(self, complete, failed, truncated=False):
+        manifest = {
+            'complete': complete,
+            'failed': failed,
+            'truncated': truncated,
+            'format': self._products_format.name,
+            'batch_size': self._batch_size,
+            'total_products': self._product_count,
+            'batches': self._batches
+        }
+        start = time.perf_counter()
+        self._get_part_store(self.get_manifest_key(), ProductsFormat.JSON).put(json.dumps(manifest).encode('utf-8'))
+        if self._metrics is not None:
+            self._metrics.add_time('upload', time.perf_counter() - start)
+
+
+class S3PartStore:
+    """
+    Class to store the parts of a prepared products file as an S3 multipart upload
+
+    content_args are added to the request that creates the object, like its
+    ContentType and ContentEncoding.
+    """
+
+    def __init__(self, s3_client, bucket, key, content_args=None):
+        self._s3_client = s3_client
+        self._bucket = bucket
+        self._key = key
+        self._content_args = content_args or {}
+        self._upload_id = None
+        self._parts = {}
+
+
+    def put(self, data):
+        try:
+            self._s3_client.put_object(Bucket=self._bucket, Body=data, Key=self._key, **self._content_args)
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def begin(self):
+        try:
+            response = self._s3_client.create_multipart_upload(Bucket=self._bucket, Key=self._key, **self._content_args)
+            self._upload_id = response['UploadId']
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def upload_part(self, part_number, data):
+        try:
+            response = self._s3_client.upload_part(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            self._parts[part_number] = response['ETag']
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def complete(self):
+        parts = [{'PartNumber': part_number, 'ETag': self._parts[part_number]} for part_number in sorted(self._parts)]
+        try:
+            self._s3_client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=self._key,
+                UploadId=self._upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+        try:
+            self._s3_client.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+        except ClientError as error:
+            raise DataAccessError(error)
+
+
+class LocalPartStore:
+    """
+    Class to store the parts of a prepared products file on the local file system.
+
+    Stand-in for S3PartStore when running tests or generating products locally.
+    """
+
+    def __init__(self, directory, key):
+        self._path = os.path.join(directory, key)
+        self._part_paths = {}
+
+
+    def put(self, data):
+        self.begin()
+        with open(self._path, 'wb') as file:
+            file.write(data)
+
+
+    def begin(self):
+        directory = os.path.dirname(self._path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+
+
+    def upload_part(self, part_number, data):
+        part_path = self._path + '.part' + str(part_number)
+        with open(part_path, 'wb') as file:
+            file.write(data)
+        self._part_paths[part_number] = part_path
+
+
+    def complete(self):
+        with open(self._path, 'wb') as file:
+            for part_number in sorted(self._part_paths):
+                with open(self._part_paths[part_number], 'rb') as part:
+                    file.write(part.read())
+        self.abort()
+
+
+    def abort(self):
+        for part_path in self._part_paths.values():
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        self._part_paths = {}
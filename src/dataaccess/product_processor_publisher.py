@@ -0,0 +1,150 @@
+import json
+import time
+from botocore.exceptions import ClientError
+from datamodel.custom_exceptions import DataAccessError
+
+
+# SNS takes at most 10 messages in a PublishBatch request
+PUBLISH_BATCH_SIZE = 10
+# attempts at publishing the messages a batch publish reports as failed
+PUBLISH_BATCH_ATTEMPTS = 5
+
+
+class ProductProcessorPublisher:
+    """
+    Class to publish process-product messages to the import topic with PublishBatch
+
+    Messages are published PUBLISH_BATCH_SIZE at a time. Messages SNS reports
+    as failed are published again after a back off, unless the failure was
+    caused by the message itself.
+    """
+
+    def __init__(self, sns_client, topic_arn):
+        self._sns_client = sns_client
+        self._topic_arn = topic_arn
+
+
+    def publish_batch(self, messages):
+        """
+        Publishes messages for the product processor
+
+        Parameters
+        ----------
+        messages: list, required
+            the messages, each of them a dict that is sent as json
+
+        Returns
+        ------
+        published: bool
+        """
+        for start in range(0, len(messages), PUBLISH_BATCH_SIZE):
+            entries = [self.__get_entry(str(start + position), messages[start + position]) for position in range(min(PUBLISH_BATCH_SIZE, len(messages) - start))]
+            self.__publish_entries(entries)
+        return True
+
+
+    def __publish_entries(self, entries):
+        try:
+            for attempt in range(PUBLISH_BATCH_ATTEMPTS):
+                response = self._sns_client.publish_batch(TopicArn=self._topic_arn, PublishBatchRequestEntries=entries)
+                failed = response.get('Failed', [])
+                if len(failed) == 0:
+                    return
+                sender_faults = [entry for entry in failed if entry.get('SenderFault')]
+                if len(sender_faults) > 0:
+                    raise DataAccessError('Could not publish messages. Details: ' + json.dumps(sender_faults))
+                # back off before publishing the messages that failed again
+                failed_ids = set(entry['Id'] for entry in failed)
+                entries = [entry for entry in entries if entry['Id'] in failed_ids]
+                time.sleep(0.05 * (2 ** attempt))
+        except ClientError as error:
+            raise DataAccessError(error)
+        raise DataAccessError('Could not publish messages. Details: messages failed ' + str([entry['Id'] for entry in entries]))
+
+
+    def __get_entry(self, entry_id, message):
+        return {
+            'Id': entry_id,
+            'Message': json.dumps(message),
+            'MessageAttributes': {
+                'process': {
+                    'DataType': 'String',
+                    'StringValue': 'process-product'
+                }
+            }
+        }
+
+
+class MessageQueue:
+    """
+    Class to collect messages and publish them PUBLISH_BATCH_SIZE at a time
+
+    Messages are published as soon as there are enough for a full PublishBatch
+    request, and the rest when the queue is flushed.
+    """
+
+    def __init__(self, publish_batch):
+        """
+        Parameters
+        ----------
+        publish_batch: callable, required
+            publishes a list of messages
+        """
+        self._publish_batch = publish_batch
+        self._messages = []
+        self._published_count = 0
+
+
+    def add(self, message):
+        self._messages.append(message)
+        if len(self._messages) == PUBLISH_BATCH_SIZE:
+            self.flush()
+
+
+    def flush(self):
+        """Publishes the messages that haven't been published yet"""
+        if len(self._messages) == 0:
+            return
+        messages = self._messages
+        self._messages = []
+        self._publish_batch(messages)
+        self._published_count += len(messages)
+
+
+    def get_published_count(self):
+        return self._published_count
+
+
+class LocalSnsClient:
+    """
+    Class that keeps the messages published to it in memory
+
+    Stand-in for the boto3 SNS client when running tests or generating products
+    locally. The ids in fail_ids fail the first time they are published.
+    """
+
+    def __init__(self, fail_ids=()):
+        self.messages = []
+        self.requests = []
+        self._fail_ids = set(fail_ids)
+
+
+    def publish(self, TopicArn, Message, MessageAttributes=None):
+        self.messages.append(json.loads(Message))
+        return {'MessageId': str(len(self.messages))}
+
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        if len(PublishBatchRequestEntries) > PUBLISH_BATCH_SIZE:
+            raise ValueError('Too many entries in batch request')
+        self.requests.append([entry['Id'] for entry in PublishBatchRequestEntries])
+        successful = []
+        failed = []
+        for entry in PublishBatchRequestEntries:
+            if entry['Id'] in self._fail_ids:
+                self._fail_ids.remove(entry['Id'])
+                failed.append({'Id': entry['Id'], 'Code': 'InternalError', 'SenderFault': False})
+            else:
+                self.messages.append(json.loads(entry['Message']))
+                successful.append({'Id': entry['Id'], 'MessageId': str(len(self.messages))})
+        return {'Successful': successful, 'Failed': failed}
@@ -0,0 +1,39 @@
+import io
+import time
+
+
+class S3BodyReader(io.RawIOBase):
+    """
+    Raw binary stream over the body of an S3 get_object response
+
+    Lets the body be wrapped in an io.BufferedReader, so parsers can read it
+    as a regular binary file while it is still downloading. When metrics are
+    given, the time spent waiting for the body is added to their download stage.
+    """
+
+    def __init__(self, body, metrics=None):
+        self._body = body
+        self._metrics = metrics
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        if self._metrics is None:
+            data = self._body.read(len(buffer))
+        else:
+            start = time.perf_counter()
+            data = self._body.read(len(buffer))
+            self._metrics.add_time('download', time.perf_counter() - start)
+            self._metrics.add_count('file_bytes', len(data))
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+
+    def close(self):
+        if not self.closed:
+            self._body.close()
+        super().close()
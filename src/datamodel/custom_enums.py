@@ -29,4 +29,38 @@ class JobStatus(Enum):
     RUNNING = 'RUNNING'
     COMPLETED = 'COMPLETED'
     PARTIAL_COMPLETE = 'PARTIALLY COMPLETED'
-    FAILED = 'FAILED'
\ No newline at end of file
+    FAILED = 'FAILED'
+
+
+class GroupingMode(Enum):
+    """Enum with the ways variant rows are grouped into products"""
+
+    CONTIGUOUS = 'CONTIGUOUS'
+    HASH = 'HASH'
+
+
+class CsvEngine(Enum):
+    """Enum with the parsers csv files can be read with"""
+
+    AUTO = 'AUTO'
+    PANDAS = 'PANDAS'
+    PYARROW = 'PYARROW'
+
+
+class ProductsFormat(Enum):
+    """Enum with the formats prepared products are saved in"""
+
+    JSON = 'JSON'
+    NDJSON_GZIP = 'NDJSON_GZIP'
+
+
+class ValueType(Enum):
+    """Enum with the types that mapped column values are normalized to"""
+
+    RAW = 'RAW'
+    TEXT = 'TEXT'
+    FLOAT = 'FLOAT'
+    INT = 'INT'
+    BOOLEAN = 'BOOLEAN'
+    STATUS = 'STATUS'
+    INVENTORY_POLICY = 'INVENTORY_POLICY'
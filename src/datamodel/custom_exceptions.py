@@ -6,3 +6,8 @@ class DataAccessError(Exception):
 class MissingArgumentError(Exception):
     """Error thrown when a method is missing a required argument"""  
     pass
+
+
+class ShardWorkerError(Exception):
+    """Error thrown when a worker process fails to transform a shard"""
+    pass
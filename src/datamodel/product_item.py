@@ -0,0 +1,126 @@
+OPTION_COUNT = 3
+
+
+class ProductItem:
+    """
+    Product generated from the rows of an excel or csv file
+
+    Products are kept in this compact form while they are generated and only
+    converted to the dict that is written to the prepared products file by
+    to_dict. Fields that are None are left out of the dict.
+    """
+
+    __slots__ = (
+        'errors', 'warnings', 'title', 'handle', 'description_html', 'vendor', 'product_type', 'tags',
+        'published', 'options', 'option_names', 'seo', 'status', 'collections', 'metafields', 'images', 'variants'
+    )
+
+    def __init__(self, title):
+        self.errors = []
+        self.warnings = []
+        self.title = title
+        self.handle = None
+        self.description_html = None
+        self.vendor = None
+        self.product_type = None
+        self.tags = None
+        self.published = None
+        self.options = None
+        # name of each option, None for options without a name
+        self.option_names = [None] * OPTION_COUNT
+        self.seo = None
+        self.status = None
+        self.collections = None
+        self.metafields = None
+        self.images = []
+        self.variants = []
+
+
+    def to_dict(self):
+        """Returns the product in the shape of the prepared products file, keeping its key order"""
+        product = {}
+        product['errors'] = self.errors
+        product['warnings'] = self.warnings
+        product['title'] = self.title
+        if self.handle is not None: product['handle'] = self.handle
+        if self.description_html is not None: product['descriptionHtml'] = self.description_html
+        if self.vendor is not None: product['vendor'] = self.vendor
+        if self.product_type is not None: product['productType'] = self.product_type
+        if self.tags is not None: product['tags'] = self.tags
+        product['published'] = self.published
+        if self.options is not None: product['options'] = self.options
+        for option in range(OPTION_COUNT):
+            if self.option_names[option] is not None:
+                product['option' + str(option + 1) + 'Name'] = self.option_names[option]
+        if self.seo is not None: product['seo'] = self.seo
+        product['status'] = self.status
+        if self.collections is not None: product['collectionsToJoin'] = self.collections
+        if self.metafields is not None: product['metafields'] = self.metafields
+        product['images'] = self.images
+        product['variants'] = [variant.to_dict() for variant in self.variants]
+        return product
+
+
+class ProductVariant:
+    """
+    Variant of a ProductItem, converted to a dict along with its product
+    """
+
+    __slots__ = (
+        'options', 'sku', 'weight', 'weight_unit', 'has_inventory_item', 'tracked', 'cost', 'inventory_quantities',
+        'inventory_policy', 'price', 'compare_at_price', 'requires_shipping', 'taxable', 'barcode', 'tax_code', 'image_src'
+    )
+
+    def __init__(self):
+        self.options = None
+        self.sku = None
+        self.weight = None
+        self.weight_unit = None
+        # whether the file has inventory item columns, even when this variant has no values for them
+        self.has_inventory_item = False
+        self.tracked = None
+        self.cost = None
+        self.inventory_quantities = None
+        self.inventory_policy = None
+        self.price = None
+        self.compare_at_price = None
+        self.requires_shipping = None
+        self.taxable = None
+        self.barcode = None
+        self.tax_code = None
+        self.image_src = None
+
+
+    def is_empty(self):
+        """Returns whether the variant would be converted to an empty dict"""
+        if self.has_inventory_item:
+            return False
+        for field in ProductVariant.__slots__:
+            if field != 'has_inventory_item' and getattr(self, field) is not None:
+                return False
+        return True
+
+
+    def to_dict(self):
+        """Returns the variant in the shape of the prepared products file, keeping its key order"""
+        variant = {}
+        if self.options is not None: variant['options'] = self.options
+        if self.sku is not None: variant['sku'] = self.sku
+        if self.weight is not None:
+            variant['weight'] = self.weight
+            variant['weightUnit'] = self.weight_unit
+        if self.has_inventory_item:
+            inventory_item = {}
+            if self.tracked is not None: inventory_item['tracked'] = self.tracked
+            if self.cost is not None: inventory_item['cost'] = self.cost
+            variant['inventoryItem'] = inventory_item
+        if self.inventory_quantities is not None: variant['inventoryQuantities'] = self.inventory_quantities
+        if self.inventory_policy is not None: variant['inventoryPolicy'] = self.inventory_policy
+        if self.price is not None: variant['price'] = self.price
+        if self.compare_at_price is not None: variant['compareAtPrice'] = self.compare_at_price
+        if self.requires_shipping is not None: variant['requiresShipping'] = self.requires_shipping
+        if self.taxable is not None: variant['taxable'] = self.taxable
+        if self.barcode is not None: variant['barcode'] = self.barcode
+        if self.tax_code is not None: variant['taxCode'] = self.tax_code
+        if self.image_src is not None: variant['imageSrc'] = self.image_src
+        return variant
@@ -0,0 +1,173 @@
+import numpy as np
+import pandas as pd
+from pandas.api import types
+from datamodel.custom_enums import ValueType
+
+
+INVALID = 'INVALID'
+BOOLEAN_VALUES = {'true': True, 'yes': True, 'y': True, 'false': False, 'no': False, 'n': False}
+
+
+def normalize_rows(df, columns):
+    """
+    Converts the mapped columns of a data frame into rows of normalized values
+
+    Each column is converted once with column operations, instead of converting
+    every cell while products are generated. Empty cells become None and cells
+    that could not be converted become 'INVALID', so the row loop only needs
+    to check the value to know which warning to output.
+
+    Parameters
+    ----------
+    df: DataFrame, required
+        the rows read from the excel or csv file
+
+    columns: list, required
+        (column label, ValueType) pairs of the columns to normalize
+
+    Returns
+    ------
+    rows: list
+        a tuple per row with the normalized value of each column, in the order of columns
+    """
+    normalized_columns = [normalize_column(df[label], value_type) for label, value_type in columns]
+    return list(zip(*normalized_columns))
+
+
+def normalize_column(column, value_type):
+    """
+    Converts a column into a list of values of the given ValueType
+
+    The column is factorized first, so each distinct value is converted once
+    and the results are mapped back onto the rows with a lookup table.
+
+    Parameters
+    ----------
+    column: Series, required
+        the column values from the excel or csv file
+
+    value_type: ValueType, required
+        the type the values should be converted to
+
+    Returns
+    ------
+    values: list
+        the converted values, None for empty cells and 'INVALID' for values that could not be converted
+    """
+    codes, uniques = pd.factorize(column)
+    uniques = pd.Series(uniques, dtype=column.dtype)
+    # factorize marks missing values with -1, which takes the last (empty) entry
+    table = np.empty(len(uniques) + 1, dtype=object)
+    table[:-1] = _convert(uniques, value_type)
+    table[-1] = None
+    return table[codes].tolist()
+
+
+def _convert(values, value_type):
+    strings = None
+    blank = np.zeros(len(values), dtype=bool)
+    if not types.is_numeric_dtype(values.dtype):
+        strings = values.astype(str)
+        blank = strings.str.strip().eq('').to_numpy()
+
+    if value_type == ValueType.RAW:
+        converted = values.to_numpy(dtype=object, copy=True)
+    elif value_type == ValueType.TEXT:
+        converted = _get_text(values, strings)
+    elif value_type == ValueType.FLOAT:
+        converted = _get_float(values, blank)
+    elif value_type == ValueType.INT:
+        converted = _apply(values, _to_int)
+    elif value_type == ValueType.BOOLEAN:
+        converted = _apply(_get_cleaned(values, strings), _get_boolean)
+    elif value_type == ValueType.STATUS:
+        converted = _apply(_get_cleaned(values, strings), _get_status)
+    elif value_type == ValueType.INVENTORY_POLICY:
+        converted = _apply(_get_cleaned(values, strings), _get_inventory_policy)
+    else:
+        raise ValueError('Unsupported value type: ' + str(value_type))
+
+    converted[blank] = None
+    return converted
+
+
+def _get_text(values, strings):
+    if strings is not None and (types.is_object_dtype(values.dtype) or types.is_string_dtype(values.dtype)):
+        return strings.to_numpy(dtype=object)
+    if types.is_numeric_dtype(values.dtype) and not types.is_bool_dtype(values.dtype):
+        return values.astype(str).to_numpy(dtype=object)
+    # dates and other types are converted the way str() shows them
+    return _apply(values, str)
+
+
+def _get_cleaned(values, strings):
+    if strings is None:
+        strings = values.astype(str)
+    return strings.str.strip().str.lower()
+
+
+def _get_float(values, blank):
+    if types.is_datetime64_any_dtype(values.dtype) or types.is_timedelta64_dtype(values.dtype) \
+            or not (types.is_numeric_dtype(values.dtype) or types.is_object_dtype(values.dtype)):
+        # to_numeric would turn dates into nanoseconds, float() of a date fails
+        return _apply(values, _to_float)
+    numbers = pd.to_numeric(values, errors='coerce').astype(float)
+    converted = numbers.to_numpy(dtype=object)
+    # values pandas could not parse are checked the same way a single value is
+    unparsed = np.flatnonzero(~blank & numbers.isna().to_numpy())
+    if len(unparsed) > 0:
+        raw_values = values.to_numpy(dtype=object)
+        for position in unparsed:
+            converted[position] = _to_float(raw_values[position])
+    return converted
+
+
+def _apply(values, convert):
+    converted = np.empty(len(values), dtype=object)
+    for position, value in enumerate(values.to_numpy(dtype=object)):
+        converted[position] = convert(value)
+    return converted
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except Exception:
+        return INVALID
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except Exception:
+        pass
+    # csv cells are read as text, where whole numbers can be written with a decimal point
+    if isinstance(value, str):
+        number = _to_float(value)
+        if isinstance(number, float) and number.is_integer():
+            return int(number)
+    return INVALID
+
+
+def _get_boolean(cleaned_value):
+    return BOOLEAN_VALUES.get(cleaned_value, INVALID)
+
+
+def _get_status(cleaned_value):
+    if len(cleaned_value) <= 7 and 'active' in cleaned_value:
+        return 'ACTIVE'
+    elif len(cleaned_value) <= 9 and 'archive' in cleaned_value:
+        return 'ARCHIVED'
+    elif len(cleaned_value) <= 6 and 'draft' in cleaned_value:
+        return 'DRAFT'
+    else:
+        return INVALID
+
+
+def _get_inventory_policy(cleaned_value):
+    if len(cleaned_value) <= 9 and 'continue' in cleaned_value:
+        return 'CONTINUE'
+    elif len(cleaned_value) <= 5 and 'deny' in cleaned_value:
+        return 'DENY'
+    else:
+        return INVALID
@@ -0,0 +1,225 @@
+import importlib.util
+import io
+from datamodel.custom_enums import CsvEngine
+
+
+# pandas is only imported once a file is read, so the handler can check
+# whether a file is read with pyarrow before pandas is imported
+
+# files with fewer rows are read with pandas, whose parser starts faster
+PYARROW_MIN_ROWS = 20000
+# number of bytes pyarrow parses at a time
+PYARROW_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def get_na_values():
+    """Returns the values the installed pandas reads as NaN by default, sorted"""
+    try:
+        from pandas._libs.parsers import STR_NA_VALUES
+    except ImportError:
+        # pandas before 1.0
+        from pandas.io.common import _NA_VALUES as STR_NA_VALUES
+    return sorted(STR_NA_VALUES)
+
+
+def is_pyarrow_wanted(csv_engine, row_count):
+    """
+    Checks whether a csv file is read with pyarrow when it is seekable
+
+    With AUTO, pyarrow is wanted for files of at least PYARROW_MIN_ROWS rows
+    when it is installed, so the handler downloads them into a seekable file
+    instead of parsing them as they download.
+
+    Parameters
+    ----------
+    csv_engine: CsvEngine, required
+        the engine to use, or AUTO to pick one
+
+    row_count: int, required
+        number of rows of the file, 0 when not known
+
+    Returns
+    ------
+    wanted: bool
+    """
+    if csv_engine == CsvEngine.PYARROW:
+        return True
+    return csv_engine == CsvEngine.AUTO and row_count >= PYARROW_MIN_ROWS and importlib.util.find_spec('pyarrow') is not None
+
+
+def get_csv_engine(csv_engine, row_count, probe, seekable):
+    """
+    Gets the engine to read the chunks of a csv file with
+
+    pyarrow only reads rows with as many fields as the header, where pandas
+    fills in missing fields and leaves out extra ones. When it fails on such a
+    row, PyarrowCsvEngine reads the rest of a seekable file again with pandas,
+    so its rows are the same as those of PandasCsvEngine. With AUTO, pyarrow is
+    only used for seekable files that is_pyarrow_wanted, when it can parse the
+    first rows of the file. Files streamed as they download are read with
+    pandas, since they can't be read again.
+
+    Parameters
+    ----------
+    csv_engine: CsvEngine, required
+        the engine to use, or AUTO to pick one
+
+    row_count: int, required
+        number of rows of the file, 0 when not known
+
+    probe: bytes, required
+        the first complete lines of the file
+
+    seekable: bool, required
+        whether the file can be read again from its start
+
+    Returns
+    ------
+    engine: PandasCsvEngine or PyarrowCsvEngine
+    """
+    if csv_engine == CsvEngine.PYARROW:
+        return PyarrowCsvEngine()
+    if seekable and is_pyarrow_wanted(csv_engine, row_count) and PyarrowCsvEngine.can_read(probe):
+        return PyarrowCsvEngine()
+    return PandasCsvEngine()
+
+
+class PandasCsvEngine:
+    """
+    Class to read the chunks of a csv file with the C parser of pandas
+    """
+
+    def read_chunks(self, source, usecols, skipped_rows, chunk_size, column_count):
+        """
+        Reads chunks of the file with the values of some of its columns as text
+
+        Parameters
+        ----------
+        source: binary file object, required
+            the csv file, at its start
+
+        usecols: list, required
+            sorted positions of the columns to read
+
+        skipped_rows: int, required
+            number of rows after the header to skip
+
+        chunk_size: int, required
+            number of rows in each chunk, or None to read the file as a single chunk
+
+        column_count: int, required
+            number of columns in the header of the file
+
+        Returns
+        ------
+        chunks: generator
+            data frames with the columns in the order of usecols, NaN for empty
+            cells and an index that counts the rows after the skipped ones
+        """
+        import pandas as pd
+        chunks = pd.read_csv(source, header=0, dtype=str, usecols=usecols, skiprows=range(1, skipped_rows + 1), chunksize=chunk_size)
+        if chunk_size is None:
+            return iter([chunks])
+        return chunks
+
+
+class PyarrowCsvEngine:
+    """
+    Class to read the chunks of a csv file with the multi-threaded parser of pyarrow
+
+    Chunks have the same values, missing values and row index as the chunks
+    of PandasCsvEngine, but are as large as a block of the file rather than a
+    number of rows. Columns get names by position, since pyarrow selects
+    columns by name and headers can repeat names. pyarrow is imported on first
+    use, since it isn't installed everywhere pandas is.
+
+    pyarrow fails on rows with fewer or more fields than the header. The rows
+    after the ones already read are then read with PandasCsvEngine from the
+    start of the file, when it is seekable.
+    """
+
+    @staticmethod
+    def can_read(probe):
+        """Checks whether pyarrow is installed and can parse the first lines of the file"""
+        try:
+            import pyarrow.csv
+            reader = pyarrow.csv.open_csv(io.BytesIO(probe), parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True))
+            for batch in reader:
+                pass
+            return True
+        except Exception:
+            return False
+
+
+    def read_chunks(self, source, usecols, skipped_rows, chunk_size, column_count):
+        """Reads chunks of the file like PandasCsvEngine.read_chunks, except for their size"""
+        frames = self.__read_frames(source, usecols, skipped_rows, column_count)
+        if not is_seekable(source):
+            return frames
+        return self.__fall_back_to_pandas(frames, source, source.tell(), usecols, skipped_rows, chunk_size, column_count)
+
+
+    def __read_frames(self, source, usecols, skipped_rows, column_count):
+        import numpy as np
+        import pandas as pd
+        import pyarrow
+        import pyarrow.csv
+        column_names = ['column' + str(column) for column in range(column_count)]
+        include_columns = [column_names[column] for column in usecols]
+        reader = pyarrow.csv.open_csv(
+            source,
+            read_options=pyarrow.csv.ReadOptions(
+                column_names=column_names,
+                # skipped after parsing, so the header and skipped rows are counted like pandas counts them
+                skip_rows_after_names=1 + skipped_rows,
+                block_size=PYARROW_BLOCK_SIZE,
+                use_threads=True
+            ),
+            parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types={name: pyarrow.string() for name in include_columns},
+                include_columns=include_columns,
+                null_values=get_na_values(),
+                strings_can_be_null=True
+            )
+        )
+        start = 0
+        try:
+            for batch in reader:
+                columns = {}
+                for name, column in zip(batch.schema.names, batch.columns):
+                    # pyarrow gives None for missing values, where pandas gives NaN
+                    values = column.to_numpy(zero_copy_only=False)
+                    values[column.is_null().to_numpy(zero_copy_only=False)] = np.nan
+                    columns[name] = values
+                frame = pd.DataFrame(columns, index=pd.RangeIndex(start, start + batch.num_rows))
+                start += batch.num_rows
+                yield frame
+        finally:
+            # stops the blocks pyarrow reads ahead from source
+            if hasattr(reader, 'close'):
+                reader.close()
+
+
+    def __fall_back_to_pandas(self, frames, source, position, usecols, skipped_rows, chunk_size, column_count):
+        """Yields the frames of pyarrow, and if it fails on a row, the rows after them read again with pandas"""
+        import pyarrow
+        row_count = 0
+        try:
+            for frame in frames:
+                row_count += len(frame)
+                yield frame
+        except pyarrow.ArrowInvalid:
+            source.seek(position)
+            for chunk in PandasCsvEngine().read_chunks(source, usecols, skipped_rows, chunk_size, column_count):
+                chunk = chunk.iloc[chunk.index.searchsorted(row_count):]
+                if len(chunk) > 0:
+                    yield chunk
+
+
+def is_seekable(source):
+    """Checks whether a binary file object can be read again from its start"""
+    try:
+        return source.seekable()
+    except AttributeError:
+        return hasattr(source, 'seek')
@@ -0,0 +1,95 @@
+import json
+import logging
+import threading
+import time
+
+
+# stages in the order they are reported
+STAGES = ['lookup', 'prefetch', 'download', 'parse', 'normalize', 'transform', 'serialize', 'upload', 'upload_wait', 'update', 'publish']
+
+# the root logger of the Lambda runtime only writes warnings, metrics are written at info
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class JobMetrics:
+    """
+    Class to collect the time spent in each stage of preparing a job and the number of items it handled
+
+    Stages that run interleaved, like parsing chunks and generating products
+    from them, add up the time of each of their steps. Stages can be timed from
+    several threads, like the upload of parts in the background, in which case
+    their time can add up to more than the duration of the job.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self._seconds = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+
+    def add_time(self, stage, seconds):
+        with self._lock:
+            self._seconds[stage] = self._seconds.get(stage, 0.0) + seconds
+
+
+    def add_count(self, name, count=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + count
+
+
+    def get_time(self, stage):
+        return self._seconds.get(stage, 0.0)
+
+
+    def timer(self, stage):
+        """Returns a context manager that adds the time spent in it to stage"""
+        return _StageTimer(self, stage)
+
+
+    def to_dict(self):
+        """
+        Returns the metrics as a dict of plain values
+
+        Returns
+        ------
+        metrics: dict
+            total_ms with the time since the metrics were created, stages_ms with
+            the time of each stage in milliseconds and counts with the number of items
+        """
+        with self._lock:
+            seconds = dict(self._seconds)
+            counts = dict(self._counts)
+        stage_names = [stage for stage in STAGES if stage in seconds] + sorted(stage for stage in seconds if stage not in STAGES)
+        return {
+            'total_ms': round((time.perf_counter() - self._start) * 1000, 1),
+            'stages_ms': {stage: round(seconds[stage] * 1000, 1) for stage in stage_names},
+            'counts': counts
+        }
+
+
+    def log(self, details):
+        """Logs the metrics with the given details as a single json line"""
+        metrics = dict(details)
+        metrics.update(self.to_dict())
+        logger.info('JOB_METRICS %s', json.dumps(metrics))
+        return metrics
+
+
+class _StageTimer:
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+        self._start = None
+
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.add_time(self._stage, time.perf_counter() - self._start)
+        return False
@@ -1,11 +1,28 @@
+import functools
+import itertools
 import re
-import pandas as pd
-import io
+import time
+from datamodel.custom_enums import CsvEngine, GroupingMode
 from datamodel.custom_exceptions import MissingArgumentError
-from datamodel.custom_enums import FileType
+from datamodel.product_item import ProductItem, ProductVariant
+from utility.sheet_reader import SheetReader
+from utility.row_plan import get_row_plan
+from utility.column_normalizer import normalize_rows, INVALID
+from utility.job_metrics import JobMetrics
+from utility.shard_pool import ShardPool
 import logging
 
 
+# number of rows normalized at a time
+ROW_BATCH_SIZE = 5000
+
+# number of rows, rounded up to whole products, transformed at a time by a worker process
+SHARD_SIZE = 2000
+
+# files with fewer rows are transformed without worker processes
+PARALLEL_MIN_ROWS = 10000
+
+
 class ProductGenerator:
     """
     Class to read excel or csv file and generate products from it
@@ -18,103 +35,381 @@ class ProductGenerator:
             self._job_type = info.get('job_type')
             self._options = info.get('options')
             self._field_details = self._file_obj['field_details']
+            self._chunk_size = info.get('chunk_size')
+            self._cached_sheet = info.get('cached_sheet')
+            self._csv_engine = info.get('csv_engine') or CsvEngine.AUTO
+            self._stream_excel = info.get('stream_excel', False)
+            self._product_limit = info.get('product_limit')
+            self._product_limit_exceeded = False
+            self._processes = info.get('processes') or 1
+            self._row_plan = get_row_plan(self._field_details)
+            self._grouping_mode = GroupingMode[self._options.get('variantGrouping', GroupingMode.CONTIGUOUS.name)]
+            self._metrics = info.get('metrics') or JobMetrics()
+            # time spent reading rows while the products are generated
+            self._read_seconds = 0.0
         else:
             raise MissingArgumentError('Missing argument for ProductGenerator class')
 
-    
+
 
     def get_products(self):
         """
         Method to read excel or csv file and generate products from it
         """
+        return list(self.iter_products())
 
-        # RELATIONSHIPS TO TAKE NOTICE
-        # LINE = INDEX + 2
-        # START_INDEX = HEADER
-        # TITLE_INDEX = HEADER - 1
-        df = None
-        header_row = int(self._file_obj['header_row'])
-        start_index_number = header_row
-        file_bytes = io.BytesIO(self._file_content)
-        file_type = FileType[self._file_obj['file_type']]
-        
-        if file_type == FileType.EXCEL:
-            df = pd.read_excel(file_bytes, header=0)
-        elif file_type == FileType.CSV:
-            df = pd.read_csv(file_bytes, header=0)
-        else:
-            raise MissingArgumentError('Couldn\'t process file. File Type must be either CSV or EXCEL file.')
 
-        if 'title' not in self._field_details:
+    def iter_products(self):
+        """
+        Generates products from the excel or csv file one at a time
+
+        By default a row is a variant of the product above it when it has the
+        same title or handle as the row above. A product is yielded once the row
+        after its last variant has been read, so when the file is read in chunks
+        a product whose variant rows cross a chunk boundary is carried over to
+        the next chunk.
+
+        With the HASH variantGrouping option, a row is a variant of the first
+        product with the same handle (or the same title, for rows without a
+        handle) wherever it is in the file. Products are then yielded in the
+        order they first appear once the whole file has been read.
+
+        When a product limit is set, no products past the limit are generated.
+
+        With more than one process, the rows of each product are grouped in
+        this process and shards of them are transformed into products by worker
+        processes, while the next rows are read. The products, including their
+        row numbered errors and warnings, are the same as with a single process.
+        Files with fewer than PARALLEL_MIN_ROWS rows are transformed in this process.
+
+        The time spent parsing the file, normalizing rows and building products
+        from them is added to the parse, normalize and transform stages of the
+        job metrics, along with the number of rows, products and variants.
+
+        Returns
+        ------
+        products: generator
+            the product items, in file order
+        """
+        if self._row_plan.title is None:
             raise MissingArgumentError('File is missing title column.')
-        
-        df = df.dropna(axis=1, how='all').dropna(axis=0, how='all')
-        row_values = df.values.tolist()
-        index_values = df.index.values.tolist()
-        row_values_start_position = self.__get_first_product_position(index_values, start_index_number)
-        
-        #if we do not find the position of the first items, it means something is wrong
-        if row_values_start_position is None:
-            raise Exception('Invalid file. Could not find values start postion. Details... FileId: ' + self._file_obj['id'])
-        
-        #Get actual row and index values
-        row_values = row_values[row_values_start_position:]
-        index_values = index_values[row_values_start_position:]
-
-        #if actual row count is not equal to number of row values then something is wrong
-        if len(row_values) != len(index_values) and len(row_values) != int(self._file_obj['actual_row_count']):
-            raise Exception('Invalid file. Number of row values not equal to actual row count')
-        
-        products = []
 
-        for current_row in range(len(row_values)):
-            # Check if there is a previous row
-            product_item = {}
-            has_previous_row = False
-            if len(products) > 0 and current_row > 0:
-                has_previous_row = True
-
-            row_number = index_values[current_row] + 2
-            current_row_values = row_values[current_row]
-            product_title = self.__get_title(current_row_values)
-            product_title = (product_title, 'Invalid Title')[product_title is None]
-            prev_product_title = None
-            
-            if has_previous_row:
-                prev_product_title = self.__get_title(row_values[current_row - 1])
+        self._product_limit_exceeded = False
+        if self._processes > 1:
+            return self.__measure_products(self.__iter_parallel_products())
+        if self._grouping_mode == GroupingMode.HASH:
+            return self.__measure_products(self.__iter_grouped_products())
+        return self.__measure_products(self.__iter_contiguous_products())
+
 
+    def __measure_products(self, products):
+        """Yields the products, adding the time spent generating them and their counts to the metrics"""
+        self._read_seconds = 0.0
+        generate_seconds = 0.0
+        product_count = 0
+        variant_count = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                product = next(products, None)
+                generate_seconds += time.perf_counter() - start
+                if product is None:
+                    return
+                product_count += 1
+                variant_count += len(product['variants'])
+                yield product
+        finally:
+            products.close()
+            self._metrics.add_time('transform', generate_seconds - self._read_seconds)
+            self._metrics.add_count('products', product_count)
+            self._metrics.add_count('variants', variant_count)
+
+
+    def __iter_contiguous_products(self):
+        plan = self._row_plan
+        product_count = 0
+        product_item = None
+        # titles of the variants of the current product, to find duplicates
+        variant_titles = set()
+        prev_product_title = None
+        prev_handle = None
+        for row_number, current_row_values in self.__read_rows():
+            product_title = current_row_values[plan.title]
             handle = None
-            prev_handle = None
+            if plan.handle is not None:
+                handle = current_row_values[plan.handle]
 
-            if 'handle' in self._field_details:
-                handle = self.__get_handle(current_row_values)
+            if self.__is_same_product(product_item is not None, prev_product_title, prev_handle, product_title, handle):
+                product_variant = self.__get_product_variant(current_row_values, product_item, row_number, variant_titles)
+                if not product_variant.is_empty(): product_item.variants.append(product_variant)
+            else:
+                if product_item is not None:
+                    yield product_item.to_dict()
+                    product_count += 1
+
+                if self._product_limit is not None and product_count == self._product_limit:
+                    self._product_limit_exceeded = True
+                    return
+
+                variant_titles = set()
+                product_item = self.__get_new_product(current_row_values, row_number, variant_titles)
+            prev_product_title = product_title
+            prev_handle = handle
+
+        if product_item is not None:
+            yield product_item.to_dict()
+
+
+    def __iter_grouped_products(self):
+        plan = self._row_plan
+        # product item and variant titles of each product key, in the order the products first appear
+        products = {}
+        for row_number, current_row_values in self.__read_rows():
+            product_key = self.__get_product_key(current_row_values, row_number)
+            if product_key in products:
+                product_item, variant_titles = products[product_key]
+                product_variant = self.__get_product_variant(current_row_values, product_item, row_number, variant_titles)
+                if not product_variant.is_empty(): product_item.variants.append(product_variant)
+            elif self._product_limit is not None and len(products) == self._product_limit:
+                # rows of products past the limit are skipped, variants of earlier products are still read
+                self._product_limit_exceeded = True
+            else:
+                variant_titles = set()
+                products[product_key] = (self.__get_new_product(current_row_values, row_number, variant_titles), variant_titles)
+
+        for product_item, variant_titles in products.values():
+            yield product_item.to_dict()
+
+
+    def __iter_parallel_products(self):
+        shards = self.__iter_shards()
+        buffered_shards = []
+        buffered_rows = 0
+        for shard, row_count in shards:
+            buffered_shards.append(shard)
+            buffered_rows += row_count
+            if buffered_rows >= PARALLEL_MIN_ROWS:
+                break
+
+        if buffered_rows < PARALLEL_MIN_ROWS:
+            # the whole file has been read, it is too small to be worth the workers
+            for shard in buffered_shards:
+                yield from self.get_shard_products(shard)
+            return
+
+        # workers build a generator of their own from the file object and options, without the file content
+        worker_info = {'file_object': self._file_obj, 'job_type': self._job_type, 'options': self._options}
+        shard_pool = ShardPool(functools.partial(_get_worker_shard_products, worker_info), self._processes, [__name__])
+        for products in shard_pool.map(itertools.chain(buffered_shards, (shard for shard, row_count in shards))):
+            yield from products
+
+
+    def __iter_shards(self):
+        """Yields (shard, row count) for shards of whole products of about SHARD_SIZE rows"""
+        shard = []
+        row_count = 0
+        for product_rows in self.__iter_product_rows():
+            shard.append(product_rows)
+            row_count += len(product_rows)
+            if row_count >= SHARD_SIZE:
+                yield shard, row_count
+                shard = []
+                row_count = 0
+        if len(shard) > 0:
+            yield shard, row_count
+
+
+    def __iter_product_rows(self):
+        """
+        Groups the rows of the file by product, the same way the products are generated
 
-                if has_previous_row:
-                    prev_handle = self.__get_handle(row_values[current_row - 1])
+        Returns
+        ------
+        product rows: generator
+            a list of (row number, row values) with the rows of each product, in the order products are generated
+        """
+        plan = self._row_plan
+        if self._grouping_mode == GroupingMode.HASH:
+            products = {}
+            for row_number, current_row_values in self.__read_rows():
+                product_key = self.__get_product_key(current_row_values, row_number)
+                if product_key in products:
+                    products[product_key].append((row_number, current_row_values))
+                elif self._product_limit is not None and len(products) == self._product_limit:
+                    self._product_limit_exceeded = True
+                else:
+                    products[product_key] = [(row_number, current_row_values)]
+            yield from products.values()
+            return
+
+        product_count = 0
+        product_rows = None
+        prev_product_title = None
+        prev_handle = None
+        for row_number, current_row_values in self.__read_rows():
+            product_title = current_row_values[plan.title]
+            handle = None
+            if plan.handle is not None:
+                handle = current_row_values[plan.handle]
 
-            if has_previous_row and (prev_product_title is not None and prev_product_title == product_title) or (prev_handle is not None and prev_handle == handle):
-                product_item = products[- 1]
-                product_variant = self.__get_product_variant(current_row_values, product_item, row_number)
-                if bool(product_variant): product_item['variants'].append(product_variant)
+            if self.__is_same_product(product_rows is not None, prev_product_title, prev_handle, product_title, handle):
+                product_rows.append((row_number, current_row_values))
             else:
-                product_item['errors'] = []
-                product_item['warnings'] = []
-                product_item['title'] = product_title
-                if handle is not None: product_item['handle'] = handle
-                if product_title == 'Invalid Title':
-                    error_message = 'Row ' + str(row_number) + ': Product Title is empty'
-                    product_item['errors'].append(error_message)
-
-                product_item = self.__get_product_details(current_row_values, product_item, row_number)
-                product_item['images'] = []
-                product_item['variants'] = []
-                product_item['variantTitles'] = list()
-                product_variant = self.__get_product_variant(current_row_values, product_item, row_number)
-                if bool(product_variant): product_item['variants'].append(product_variant)
-                products.append(product_item)
+                if product_rows is not None:
+                    yield product_rows
+                    product_count += 1
+
+                if self._product_limit is not None and product_count == self._product_limit:
+                    self._product_limit_exceeded = True
+                    return
+
+                product_rows = [(row_number, current_row_values)]
+            prev_product_title = product_title
+            prev_handle = handle
+
+        if product_rows is not None:
+            yield product_rows
+
+
+    def get_shard_products(self, shard):
+        """
+        Transforms the rows of each product of a shard into a product, and returns them as dicts
+
+        Parameters
+        ----------
+        shard: list, required
+            a list of (row number, row values) with the rows of each product
+
+        Returns
+        ------
+        products: list
+            the product items as dicts
+        """
+        products = []
+        for product_rows in shard:
+            row_number, row_values = product_rows[0]
+            variant_titles = set()
+            product_item = self.__get_new_product(row_values, row_number, variant_titles)
+            for row_number, row_values in product_rows[1:]:
+                product_variant = self.__get_product_variant(row_values, product_item, row_number, variant_titles)
+                if not product_variant.is_empty(): product_item.variants.append(product_variant)
+            products.append(product_item.to_dict())
         return products
 
 
+    def __is_same_product(self, has_previous_row, prev_product_title, prev_handle, product_title, handle):
+        """Checks whether a row is a variant of the product of the row above it"""
+        return has_previous_row and (prev_product_title is not None and prev_product_title == (product_title, 'Invalid Title')[product_title is None]) or (prev_handle is not None and prev_handle == handle)
+
+
+    def __get_product_key(self, row_values, row_number):
+        """Gets the key that groups the rows of a product in HASH variantGrouping"""
+        plan = self._row_plan
+        if plan.handle is not None and row_values[plan.handle] is not None:
+            return ('handle', row_values[plan.handle])
+        if row_values[plan.title] is not None:
+            return ('title', row_values[plan.title])
+        # a row without a title or handle is a product of its own
+        return ('row', row_number)
+
+
+    def __get_new_product(self, row_values, row_number, variant_titles):
+        """
+        Gets a product item for the row of its first variant
+
+        Parameters
+        ----------
+        row_values: list, required
+            values from the first row of the product in the excel or csv file
+
+        row_number: integer, required
+            the current row number within the excel or csv file
+
+        variant_titles: set, required
+            an empty set for the titles of the variants of the product
+
+        Returns
+        ------
+        product: ProductItem
+            the product item with its first variant
+        """
+        plan = self._row_plan
+        product_title = row_values[plan.title]
+        product_title = (product_title, 'Invalid Title')[product_title is None]
+        handle = None
+        if plan.handle is not None:
+            handle = row_values[plan.handle]
+
+        product_item = ProductItem(product_title)
+        product_item.handle = handle
+        if product_title == 'Invalid Title':
+            error_message = 'Row ' + str(row_number) + ': Product Title is empty'
+            product_item.errors.append(error_message)
+
+        product_item = self.__get_product_details(row_values, product_item, row_number)
+        product_variant = self.__get_product_variant(row_values, product_item, row_number, variant_titles)
+        if not product_variant.is_empty(): product_item.variants.append(product_variant)
+        return product_item
+
+
+    def is_product_limit_exceeded(self):
+        """
+        Returns whether the file has more products than the product limit.
+
+        Only known once the products have been generated.
+        """
+        return self._product_limit_exceeded
+
+
+    def __read_rows(self):
+        """
+        Reads the rows of the excel or csv file
+
+        Rows are normalized ROW_BATCH_SIZE at a time rather than a whole sheet at
+        once, so that no more rows are converted than the products generated need.
+
+        The time spent waiting for the file to download while it is parsed is
+        part of the download stage rather than the parse stage.
+
+        Returns
+        ------
+        rows: generator
+            (row number, normalized row values) for each row, in file order
+        """
+        plan = self._row_plan
+        metrics = self._metrics
+        sheet_reader = SheetReader(self._file_obj, self._file_content, self._chunk_size, self._cached_sheet, self._csv_engine, self._stream_excel)
+        frames = None
+        row_count = 0
+        try:
+            while True:
+                download_seconds = metrics.get_time('download')
+                start = time.perf_counter()
+                if frames is None:
+                    # the first bytes of the file are read to find its columns
+                    frames = sheet_reader.read(plan.column_indexes)
+                df = next(frames, None)
+                read_seconds = time.perf_counter() - start
+                self._read_seconds += read_seconds
+                metrics.add_time('parse', read_seconds - (metrics.get_time('download') - download_seconds))
+                if df is None:
+                    return
+
+                for batch_start in range(0, len(df), ROW_BATCH_SIZE):
+                    start = time.perf_counter()
+                    batch = df.iloc[batch_start:batch_start + ROW_BATCH_SIZE]
+                    index_values = batch.index.values.tolist()
+                    row_values = normalize_rows(batch, plan.columns)
+                    normalize_seconds = time.perf_counter() - start
+                    self._read_seconds += normalize_seconds
+                    metrics.add_time('normalize', normalize_seconds)
+                    row_count += len(row_values)
+                    for position in range(len(row_values)):
+                        yield index_values[position] + 2, row_values[position]
+        finally:
+            metrics.add_count('rows', row_count)
+
+
     def __get_product_details(self, row_values, product_item, row_number):
         """
         Gets and returns product details object with values from the excel or csv file
@@ -124,7 +419,7 @@ class ProductGenerator:
         row_values: list, required
             values from a particular row in the excel or csv file
 
-        product_item: dict, required
+        product_item: ProductItem, required
             the product item object
 
         row_number: integer, required
@@ -132,151 +427,110 @@ class ProductGenerator:
 
         Returns
         ------
-        variant: dict
+        product: ProductItem
             An object with the product details
         """
 
+        plan = self._row_plan
         base_output_msg = 'Row ' + str(row_number) + ': '
 
-        if 'descriptionHtml' in self._field_details:
+        if len(plan.description) > 0:
             descriptionHtml = self.__get_description(row_values)
             if len(descriptionHtml) > 0:
-                product_item['descriptionHtml'] = descriptionHtml
-
-        if 'vendor' in self._field_details:
-            vendor = self.__get_vendor(row_values)
-            if vendor is not None:
-                product_item['vendor'] = vendor
-
-        if 'productType' in self._field_details:
-            product_type = self.__get_product_type(row_values)
-            if product_type is not None:
-                product_item['productType'] = product_type
-
-        if 'tags' in self._field_details:
-            tags = self.__get_tags(row_values)
-            if tags is not None:
-                product_item['tags'] = tags
-
-        if len(self._options['addedTags']) > 0:
-            if 'tags' in product_item:
-                product_item['tags'].extend(self._options['addedTags'])
+                product_item.description_html = descriptionHtml
+
+        if plan.vendor is not None:
+            product_item.vendor = row_values[plan.vendor]
+
+        if plan.product_type is not None:
+            product_item.product_type = row_values[plan.product_type]
+
+        if plan.tags is not None:
+            product_item.tags = self.__get_list(row_values, plan.tags)
+
+        added_tags = self._options['addedTags']
+        if len(added_tags) > 0:
+            if product_item.tags is not None:
+                product_item.tags.extend(added_tags)
             else:
-                product_item['tags'] = self._options['addedTags']
+                product_item.tags = added_tags
 
-        if 'published' in self._field_details:
-            published = self.__get_published(row_values)
-            default = self._options['defaultPublishedStatus']
+        default = self._options['defaultPublishedStatus']
+        if plan.published is not None:
+            published = row_values[plan.published]
             if published is None:
-                product_item['published'] = default
+                product_item.published = default
             else:
                 if not isinstance(published, bool):
                     warning_message = base_output_msg + 'Invalid published Value. Valid values are: [TRUE, YES, Y] for True, and [FALSE, NO, N] for False. Replacing with default published value.'
-                    product_item['warnings'].append(warning_message) 
-                    product_item['published'] = default 
+                    product_item.warnings.append(warning_message)
+                    product_item.published = default
                 else:
-                    product_item['published'] = published
-        elif 'published' not in self._field_details:
-            default = self._options['defaultPublishedStatus']
-            product_item['published'] = default
-
-        if 'option1Value' in self._field_details or 'option2Value' in self._field_details or 'option3Value' in self._field_details:
-            product_item['options'] = []
-
-        if 'option1Name' in self._field_details:
-            option1_name = self.__get_option1_name(row_values)
-            if option1_name is not None:
-                product_item['option1Name'] = option1_name
-                product_item['options'].append(option1_name)
-            else:
-                if 'option1Value' in self._field_details:
-                    error_message = base_output_msg + 'Value for option1 Name is invalid. Please ensure value is not empty.'
-                    product_item['errors'].append(error_message)
-
-        if 'option1Name' not in self._field_details and 'option1Value' in self._field_details:
-            option1_name = self.__get_option1_name_from_option_value()
-            if option1_name is not None:
-                product_item['option1Name'] = option1_name
-                product_item['options'].append(option1_name)
-
-        if 'option2Name' in self._field_details:
-            option2_name = self.__get_option2_name(row_values)
-            if option2_name is not None:
-                product_item['option2Name'] = option2_name
-                product_item['options'].append(option2_name)
-            else:
-                if 'option2Value' in self._field_details:
-                    error_message = base_output_msg + 'Value for option2 Name is invalid. Please ensure value is not empty.'
-                    product_item['errors'].append(error_message)
-
-        if 'option2Name' not in self._field_details and 'option2Value' in self._field_details:
-            option2_name = self.__get_option2_name_from_option_value()
-            if option2_name is not None:
-                product_item['option2Name'] = option2_name
-                product_item['options'].append(option2_name)
-
-        if 'option3Name' in self._field_details:
-            option3_name = self.__get_option3_name(row_values)
-            if option3_name is not None:
-                product_item['option3Name'] = option3_name
-                product_item['options'].append(option3_name)
-            else:
-                if 'option3Value' in self._field_details:
-                    error_message = base_output_msg + 'Value for option3 Name is invalid. Please ensure value is not empty.'
-                    product_item['errors'].append(error_message)
-
-        if 'option3Name' not in self._field_details and 'option3Value' in self._field_details:
-            option3_name = self.__get_option3_name_from_option_value()
-            if option3_name is not None:
-                product_item['option3Name'] = option3_name
-                product_item['options'].append(option3_name)
-
-        if 'seoTitle' in self._field_details or 'seoDescription' in self._field_details:
+                    product_item.published = published
+        else:
+            product_item.published = default
+
+        if plan.has_option_values:
+            product_item.options = []
+
+        for option in range(len(plan.option_names)):
+            option_label = 'option' + str(option + 1)
+            if plan.option_names[option] is not None:
+                option_name = row_values[plan.option_names[option]]
+                if option_name is not None:
+                    product_item.option_names[option] = option_name
+                    product_item.options.append(option_name)
+                else:
+                    if plan.option_values[option] is not None:
+                        error_message = base_output_msg + 'Value for ' + option_label + ' Name is invalid. Please ensure value is not empty.'
+                        product_item.errors.append(error_message)
+            elif plan.default_option_names[option] is not None:
+                option_name = plan.default_option_names[option]
+                product_item.option_names[option] = option_name
+                product_item.options.append(option_name)
+
+        if plan.has_seo:
             seo = {}
 
-        if 'seoTitle' in self._field_details:
-            seo_title = self.__get_seo_title(row_values)
-            if seo_title is not None:
-                seo['title'] = seo_title
+            if plan.seo_title is not None:
+                seo_title = row_values[plan.seo_title]
+                if seo_title is not None:
+                    seo['title'] = seo_title
 
-        if 'seoDescription' in self._field_details:
-            seo_description = self.__get_seo_description(row_values)
-            if seo_description is not None:
-                seo['description'] = seo_description
+            if plan.seo_description is not None:
+                seo_description = row_values[plan.seo_description]
+                if seo_description is not None:
+                    seo['description'] = seo_description
 
-        if 'seoTitle' in self._field_details or 'seoDescription' in self._field_details:
-            product_item['seo'] = seo
+            product_item.seo = seo
 
-        if 'status' in self._field_details:
-            status = self.__get_status(row_values)
-            default = self._options['defaultStatus']
+        default = self._options['defaultStatus']
+        if plan.status is not None:
+            status = row_values[plan.status]
             if status is None:
-                product_item['status'] = default
+                product_item.status = default
             else:
-                if status == 'INVALID':
+                if status == INVALID:
                     warning_message = base_output_msg + 'Invalid status Value. Valid values are: ACTIVE, DRAFT, ARCHIVED. Replacing with default status value.'
-                    product_item['warnings'].append(warning_message) 
-                    product_item['status'] = default
+                    product_item.warnings.append(warning_message)
+                    product_item.status = default
                 else:
-                    product_item['status'] = status
-        elif 'status' not in self._field_details:
-            default = self._options['defaultStatus']
-            product_item['status'] = default
+                    product_item.status = status
+        else:
+            product_item.status = default
 
-        if 'customCollections' in self._field_details:
-            collections = self.__get_collections(row_values)
-            if collections is not None:
-                product_item['collectionsToJoin'] = collections
+        if plan.collections is not None:
+            product_item.collections = self.__get_list(row_values, plan.collections)
 
-        if 'metafields' in self._field_details:
+        if len(plan.metafields) > 0:
             metafields = self.__get_metafields(row_values)
-            if metafields is not None and len(metafields) > 0:
-                product_item['metafields'] = metafields
-        
+            if len(metafields) > 0:
+                product_item.metafields = metafields
+
         return product_item
 
 
-    def __get_product_variant(self, row_values, product_item, row_number):
+    def __get_product_variant(self, row_values, product_item, row_number, variant_titles):
         """
         Gets and returns product variant details object with values from the excel or csv file
 
@@ -285,589 +539,218 @@ class ProductGenerator:
         row_values: list, required
             values from a particular row in the excel or csv file
 
-        product_item: dict, required
+        product_item: ProductItem, required
             the product item object
 
         row_number: integer, required
             the current row number within the excel or csv file
 
+        variant_titles: set, required
+            titles of the variants of the product read so far, which the title of this variant is added to
+
         Returns
         ------
-        variant: dict
+        variant: ProductVariant
             An object with the product vairiant details
         """
-        variant = {}
+        plan = self._row_plan
+        variant = ProductVariant()
         variant_title = ''
         base_output_msg = 'Row ' + str(row_number) + ': '
 
-        if 'option1Value' in self._field_details or 'option2Value' in self._field_details or 'option3Value' in self._field_details:
-            variant['options'] = []
-        
-        if 'option1Value' in self._field_details:
-            if 'option1Name' in product_item:
-                option1_value = self.__get_option1_value(row_values)
-                if option1_value is not None:
-                    variant['options'].append(option1_value)
-                    variant_title += option1_value
-            else:
-                error_message = base_output_msg + 'There is no Option1 Name associated with the Option1 value.'
-                product_item['errors'].append(error_message)
-
-        if 'option2Value' in self._field_details:
-            if 'option2Name' in product_item:
-                option2_value = self.__get_option2_value(row_values)
-                if option2_value is not None:
-                    variant['options'].append(option2_value)
-                    variant_title += '/'
-                    variant_title += option2_value
-            else:
-                error_message = base_output_msg + 'There is no Option2 Name associated with the Option2 value.'
-                product_item['errors'].append(error_message)
-
-
-        if 'option3Value' in self._field_details:
-            if 'option3Name' in product_item:
-                option3_value = self.__get_option3_value(row_values)
-                if option3_value is not None:
-                    variant['options'].append(option3_value)
-                    variant_title += '/'
-                    variant_title += option3_value
+        if plan.has_option_values:
+            variant.options = []
+
+        for option in range(len(plan.option_values)):
+            if plan.option_values[option] is None:
+                continue
+            option_label = 'option' + str(option + 1)
+            if product_item.option_names[option] is not None:
+                option_value = row_values[plan.option_values[option]]
+                if option_value is not None:
+                    variant.options.append(option_value)
+                    if option > 0: variant_title += '/'
+                    variant_title += option_value
             else:
-                error_message = base_output_msg + 'There is no Option3 Name associated with the Option3 value.'
-                product_item['errors'].append(error_message)
+                error_message = base_output_msg + 'There is no Option' + str(option + 1) + ' Name associated with the Option' + str(option + 1) + ' value.'
+                product_item.errors.append(error_message)
 
         if variant_title == '': variant_title = 'Default Title'
-        if variant_title in product_item['variantTitles']:
+        if variant_title in variant_titles:
             error_message = base_output_msg + 'Variant title ' + variant_title + ', already exist'
-            product_item['errors'].append(error_message)
+            product_item.errors.append(error_message)
         else:
-            product_item['variantTitles'].append(variant_title)
+            variant_titles.add(variant_title)
 
-        if 'variantSku' in self._field_details:
-            sku = self.__get_variant_sku(row_values)
-            if sku is not None:
-                variant['sku'] = sku
+        if plan.variant_sku is not None:
+            variant.sku = row_values[plan.variant_sku]
 
-        if 'variantWeight' in self._field_details:
-            weight = self.__get_variant_weight(row_values)
+        if plan.variant_weight is not None:
+            weight = row_values[plan.variant_weight]
             if weight is not None:
-                weightValue = weight['weight']
-                if not isinstance(weightValue, float):
+                if not isinstance(weight, float):
                     warning_message = base_output_msg + 'Invalid variant weight value. Value should be a number.'
-                    product_item['warnings'].append(warning_message)
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['weight'] = weight['weight']
-                    variant['weightUnit'] = weight['weight_unit']
+                    variant.weight = weight
+                    variant.weight_unit = plan.weight_unit
 
-        if 'variantTracked' in self._field_details or 'variantCost' in self._field_details:
-            variant['inventoryItem'] = {}
+        if plan.has_inventory_item:
+            variant.has_inventory_item = True
 
-        if 'variantTracked' in self._field_details:
-            tracked = self.__get_variant_tracked(row_values)
+        if plan.variant_tracked is not None:
+            tracked = row_values[plan.variant_tracked]
             if tracked is not None:
                 if not isinstance(tracked, bool):
                     warning_message = base_output_msg + 'Invalid variant tracked Value. Valid values are: [TRUE, YES, Y] for True, and [FALSE, NO, N] for False.'
-                    product_item['warnings'].append(warning_message) 
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['inventoryItem']['tracked'] = tracked
+                    variant.tracked = tracked
 
-        if 'variantCost' in self._field_details:
-            cost = self.__get_variant_cost(row_values)
+        if plan.variant_cost is not None:
+            cost = row_values[plan.variant_cost]
             if cost is not None:
                 if not isinstance(cost, float):
                     warning_message = base_output_msg + 'Invalid variant cost Value. Value should be a number.'
-                    product_item['warnings'].append(warning_message)
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['inventoryItem']['cost'] = cost
+                    variant.cost = cost
 
-        if 'variantQuantity' in self._field_details:
+        if len(plan.variant_quantities) > 0:
             variant_quantity = self.__get_inventory_quantity(row_values)
             if len(variant_quantity) > 0:
-                variant['inventoryQuantities'] = variant_quantity
+                variant.inventory_quantities = variant_quantity
 
-        if 'variantInventoryPolicy' in self._field_details:
-            policy = self.__get_inventory_policy(row_values)
+        if plan.inventory_policy is not None:
+            policy = row_values[plan.inventory_policy]
             if policy is not None:
-                if policy == 'INVALID':
+                if policy == INVALID:
                     warning_message = base_output_msg + 'Invalid variant policy Value. Valid values are CONTINUE, DENY.'
-                    product_item['warnings'].append(warning_message)
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['inventoryPolicy'] = policy
+                    variant.inventory_policy = policy
 
-        if 'variantPrice' in self._field_details:
-            price = self.__get_variant_price(row_values)
+        if plan.variant_price is not None:
+            price = row_values[plan.variant_price]
             if price is not None:
                 if not isinstance(price, float):
                     warning_message = base_output_msg + 'Invalid variant price Value. Value should be a number.'
-                    product_item['warnings'].append(warning_message)
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['price'] = price
+                    variant.price = price
 
-        if 'variantCompareAtPrice' in self._field_details:
-            compare_price = self.__get_compare_price(row_values)
+        if plan.compare_price is not None:
+            compare_price = row_values[plan.compare_price]
             if compare_price is not None:
                 if not isinstance(compare_price, float):
                     warning_message = base_output_msg + 'Invalid variant compate at price Value. Value should be a number.'
-                    product_item['warnings'].append(warning_message)
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['compareAtPrice'] = compare_price
+                    variant.compare_at_price = compare_price
 
-        if 'variantRequireShipping' in self._field_details:
-            require_shipping = self.__get_require_shipping(row_values)
+        if plan.require_shipping is not None:
+            require_shipping = row_values[plan.require_shipping]
             if require_shipping is not None:
                 if not isinstance(require_shipping, bool):
                     warning_message = base_output_msg + 'Invalid require shipping Value. Valid values are: [TRUE, YES, Y] for True, and [FALSE, NO, N] for False.'
-                    product_item['warnings'].append(warning_message) 
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['requiresShipping'] = require_shipping
+                    variant.requires_shipping = require_shipping
 
-        if 'variantTaxable' in self._field_details:
-            taxable = self.__get_variant_taxable(row_values)
+        if plan.variant_taxable is not None:
+            taxable = row_values[plan.variant_taxable]
             if taxable is not None:
-                if not isinstance(require_shipping, bool):
+                if not isinstance(taxable, bool):
                     warning_message = base_output_msg + 'Invalid variant taxable Value. Valid values are: [TRUE, YES, Y] for True, and [FALSE, NO, N] for False.'
-                    product_item['warnings'].append(warning_message) 
+                    product_item.warnings.append(warning_message)
                 else:
-                    variant['taxable'] = taxable
+                    variant.taxable = taxable
 
-        if 'variantBarcode' in self._field_details:
-            barcode = self.__get_barcode(row_values)
-            if barcode is not None:
-                variant['barcode'] = barcode
+        if plan.variant_barcode is not None:
+            variant.barcode = row_values[plan.variant_barcode]
 
-        if 'variantTaxcode' in self._field_details:
-            taxcode = self.__get_taxcode(row_values)
-            if taxcode is not None:
-                variant['taxCode'] = taxcode
+        if plan.variant_taxcode is not None:
+            variant.tax_code = row_values[plan.variant_taxcode]
 
-        if 'imageSrc' in self._field_details:
+        if len(plan.images) > 0:
             images = self.__get_images(row_values)
             if len(images) > 0:
-                product_item['images'].extend(images)
+                product_item.images.extend(images)
 
-        if 'variantImage' in self._field_details:
-            image = self.__get_variant_image(row_values)
+        if plan.variant_image is not None:
+            image = row_values[plan.variant_image]
             if image is not None:
-                variant['imageSrc'] = image
-                product_item['images'].append({'src': image})
- 
-        return variant
-        
-        
-    def __is_invalid(self, value):
-        if pd.notnull(value) and str(value).strip() is not None and str(value).strip() != '' and value is not None:
-            return False
-        return True
-
-
-    def __get_boolean(self, value):
-        if self.__is_invalid(value):
-            return None
-        
-        cleaned_value = value.strip().lower()
-        if cleaned_value == 'true' or cleaned_value == 'yes' or cleaned_value == 'y':
-            return True
-        elif cleaned_value == 'false' or cleaned_value == 'no' or cleaned_value == 'n':
-            return False
-        else:
-            return 'INVALID'
+                variant.image_src = image
+                product_item.images.append({'src': image})
 
+        return variant
 
-    def __get_float(self, value):
-        if self.__is_invalid(value):
-            return None
-        try:
-            float_value = float(value)
-            return float_value
-        except Exception:
-            return 'INVALID'
 
+    #----------------------------Methods for getting row values---------------------------
 
-    def __get_int(self, value):
-        if self.__is_invalid(value):
+    def __get_list(self, row_values, index):
+        """Returns a List of values separated by ';' or ','"""
+        list_str = row_values[index]
+        if list_str is None:
             return None
-        try:
-            int_value = int(value)
-            return int_value
-        except Exception:
-            return 'INVALID'
-
-
-
-    def __get_status_value(self, value):
-        if self.__is_invalid(value): return None
-        cleaned_value = value.strip().lower()
-        if len(cleaned_value) <= 7 and 'active' in cleaned_value:
-            return 'ACTIVE'
-        elif len(cleaned_value) <= 9 and 'archive' in cleaned_value: 
-            return 'ARCHIVED'
-        elif len(cleaned_value) <= 6 and 'draft' in cleaned_value:
-            return 'DRAFT'
-        else:
-            return 'INVALID'
-
-
-    def __get_inventory_policy_value(self, value):
-        if self.__is_invalid(value): return None
-        cleaned_value = value.strip().lower()
-        if len(cleaned_value) <= 9 and 'continue' in cleaned_value:
-            return 'CONTINUE'
-        elif len(cleaned_value) <= 5 and 'deny' in cleaned_value: 
-            return 'DENY'
         else:
-            return 'INVALID'
-
-
-
-    def __get_first_product_position(self, index_list, start_index_number):
-        """Gets the row position that we should start reading products from in the spreadsheet
-
-        Parameters
-        ----------
-        index_list: list, required
-            The list of row indexes from pandas or excel sheet
+            return re.split(';|,', list_str)
 
-        start_index_number: int, required
-            this is the line indicated from the spreadsheet as the first row to read from
-
-        Returns
-        ------
-        first row to read: int
-        """
-        for i in range(len(index_list)):
-            if index_list[i] == start_index_number:
-                return i
-        return None
-
-    #----------------------------Methods for getting product details---------------------------
-
-    def __get_title(self, row_values):
-        title_index = int(self._field_details['title'][0]['index'])
-        product_title = row_values[title_index]
-        if self.__is_invalid(product_title):
-            return None
-        else: 
-            return str(product_title)
-
-
-    def __get_handle(self, row_values):
-        handle_index = int(self._field_details['handle'][0]['index'])
-        handle = row_values[handle_index]
-        if self.__is_invalid(handle):
-            return None
-        else:
-            return str(handle)
 
     def __get_description(self, row_values):
         descriptionHtml = ''
 
-        description_indexes = self._field_details['descriptionHtml']
+        description_indexes = self._row_plan.description
         for index in range(len(description_indexes)):
-            description_index = int(description_indexes[index]['index'])
-            description = row_values[description_index]
-            if not self.__is_invalid(description): descriptionHtml += description
-            if index < len(description_indexes) - 1: 
+            description = row_values[description_indexes[index]]
+            if description is not None: descriptionHtml += description
+            if index < len(description_indexes) - 1:
                 descriptionHtml += '<br>'
         return descriptionHtml
 
-    
-    def __get_vendor(self, row_values):
-        vendor_index = int(self._field_details['vendor'][0]['index'])
-        vendor = row_values[vendor_index]
-        if self.__is_invalid(vendor):
-            return None
-        else:
-            return str(vendor)
-
-
-    def __get_product_type(self, row_values):
-        product_type_index = int(self._field_details['productType'][0]['index'])
-        product_type = row_values[product_type_index]
-        if self.__is_invalid(product_type):
-            return None
-        else:
-            return str(product_type)
-
-    
-    def __get_tags(self, row_values):
-        """Returns a List of tags"""
-        tag_index = int(self._field_details['tags'][0]['index'])
-        tags_str = row_values[tag_index]
-        if self.__is_invalid(tags_str):
-            return None
-        else:
-            tags_list = re.split(';|,', tags_str)
-            return tags_list
-
-
-    def __get_published(self, row_values):
-        published_index = int(self._field_details['published'][0]['index'])
-        published_value = row_values[published_index]
-        published = self.__get_boolean(published_value)
-        return published
-
-
-    def __get_option1_name(self, row_values):
-        option_index = int(self._field_details['option1Name'][0]['index'])
-        option = row_values[option_index]
-        if self.__is_invalid(option):
-            return None
-        else:
-            return str(option)
-
-
-    def __get_option1_name_from_option_value(self):
-        option_name = self._field_details['option1Value'][0]['defaultOptionName']
-        if option_name is None:
-            return None
-        else:
-            return str(option_name)
-
-    def __get_option2_name(self, row_values):
-        option_index = int(self._field_details['option2Name'][0]['index'])
-        option = row_values[option_index]
-        if self.__is_invalid(option):
-            return None
-        else:
-            return str(option)
-
-
-    def __get_option2_name_from_option_value(self):
-        option_name = self._field_details['option2Value'][0]['defaultOptionName']
-        if option_name is None:
-            return None
-        else:
-            return str(option_name)
-
-
-    def __get_option3_name(self, row_values):
-        option_index = int(self._field_details['option3Name'][0]['index'])
-        option = row_values[option_index]
-        if self.__is_invalid(option):
-            return None
-        else:
-            return str(option)
-
-
-    def __get_option3_name_from_option_value(self):
-        option_name = self._field_details['option3Value'][0]['defaultOptionName']
-        if option_name is None:
-            return None
-        else:
-            return str(option_name)
 
     def __get_images(self, row_values):
         images = []
-        image_indices = self._field_details['imageSrc']
-        for index in range(len(image_indices)):
-            image_index = int(image_indices[index]['index'])
+        for image_index in self._row_plan.images:
             image_sources = row_values[image_index]
-            if not self.__is_invalid(image_sources): 
+            if image_sources is not None:
                 image_list = re.split(';|,', image_sources)
                 for image in image_list:
                     images.append({'src': image})
         return images
 
 
-    def __get_seo_title(self, row_values):
-        seo_title_index = int(self._field_details['seoTitle'][0]['index'])
-        seo_title = row_values[seo_title_index]
-        if self.__is_invalid(seo_title):
-            return None
-        else:
-            return str(seo_title)
-
-
-    def __get_seo_description(self, row_values):
-        seo_description_index = int(self._field_details['seoDescription'][0]['index'])
-        seo_description = row_values[seo_description_index]
-        if self.__is_invalid(seo_description):
-            return None
-        else:
-            return str(seo_description)
-
-
-    def __get_status(self, row_values):
-        status_index = int(self._field_details['status'][0]['index'])
-        status_value = row_values[status_index]
-        status = self.__get_status_value(status_value)
-        return status 
-
-
-    def __get_collections(self, row_values):
-        collection_index = int(self._field_details['customCollections'][0]['index'])
-        collection_str = row_values[collection_index]
-        if self.__is_invalid(collection_str):
-            return None
-        else:
-            collection_list = re.split(';|,', collection_str)
-            return collection_list
-
-
     def __get_metafields(self, row_values):
         metafields = []
-        metafield_indices = self._field_details['metafields']
-        for index in range(len(metafield_indices)):
-            metafield_index = int(metafield_indices[index]['index'])
+        for metafield_index, metafield_name in self._row_plan.metafields:
             metafield_value = row_values[metafield_index]
-            if not self.__is_invalid(metafield_value):
-                metafield_name = metafield_indices[index]['name']
+            if metafield_value is not None:
                 if metafield_name.strip() == '' or metafield_name == None:
                     logging.warning('Missing metafield name in file with id: ' + self._file_obj['id'])
                 metafield = {'key': metafield_name, 'value': metafield_value, 'namespace': 'global', 'valueType': 'STRING'}
                 metafields.append(metafield)
         return metafields
 
-    #----------------------------Methods for getting variant details---------------------------
-
-    def __get_option1_value(self, row_values):
-        option_index = int(self._field_details['option1Value'][0]['index'])
-        option = row_values[option_index]
-        if self.__is_invalid(option):
-            return None
-        else:
-            return str(option)
-
-
-    def __get_option2_value(self, row_values):
-        option_index = int(self._field_details['option2Value'][0]['index'])
-        option = row_values[option_index]
-        if self.__is_invalid(option):
-            return None
-        else:
-            return str(option)
-
-
-    def __get_option3_value(self, row_values):
-        option_index = int(self._field_details['option3Value'][0]['index'])
-        option = row_values[option_index]
-        if self.__is_invalid(option):
-            return None
-        else:
-            return str(option)
-
-    
-    def __get_variant_sku(self, row_values):
-        sku_index = int(self._field_details['variantSku'][0]['index'])
-        sku = row_values[sku_index]
-        if self.__is_invalid(sku):
-            return None
-        else:
-            return str(sku)
-
-    
-    def __get_variant_weight(self, row_values):
-        weight_index = int(self._field_details['variantWeight'][0]['index'])
-        weight_value = row_values[weight_index]
-        weight = self.__get_float(weight_value)
-        if weight is not None:
-            weight_unit = self._field_details['variantWeight'][0]['weightUnit']
-            return {'weight': weight, 'weight_unit': weight_unit}
-        else:
-            return None
-
-
-    def __get_variant_tracked(self, row_values):
-        tracked_index = int(self._field_details['variantTracked'][0]['index'])
-        tracked_value = row_values[tracked_index]
-        tracked = self.__get_boolean(tracked_value)
-        return tracked 
 
     def __get_inventory_quantity(self, row_values):
         inventory = []
-        quantity_indices = self._field_details['variantQuantity']
-        for index in range(len(quantity_indices)):
-            inventory_index = int(quantity_indices[index]['index'])
-            quantity_value = row_values[inventory_index]
-            quantity = self.__get_int(quantity_value)
+        for inventory_index, location in self._row_plan.variant_quantities:
+            quantity = row_values[inventory_index]
             if quantity is not None and isinstance(quantity, int):
-                location = self._field_details['variantQuantity'][0]['location']
-                if location is None or location == '': 
+                if location is None or location == '':
                     logging.warning('Missing Location for variant Quantity from file with id: ' + self._file_obj['id'])
                 quantity = {'availableQuantity': quantity, 'locationId': location}
                 inventory.append(quantity)
         return inventory
 
-    
-    def __get_inventory_policy(self, row_values):
-        policy_index = int(self._field_details['variantInventoryPolicy'][0]['index'])
-        policy_value = row_values[policy_index]
-        policy = self.__get_inventory_policy_value(policy_value)
-        return policy
-
-    
-    def __get_variant_price(self, row_values):
-        price_index = int(self._field_details['variantPrice'][0]['index'])
-        price_value = row_values[price_index]
-        price = self.__get_float(price_value)
-        return price
-
-
-    def __get_compare_price(self, row_values):
-        compare_price_index = int(self._field_details['variantCompareAtPrice'][0]['index'])
-        compare_price_value = row_values[compare_price_index]
-        compare_price = self.__get_float(compare_price_value)
-        return compare_price
-
-
-    def __get_require_shipping(self, row_values):
-        require_shipping_index = int(self._field_details['variantRequireShipping'][0]['index'])
-        require_shipping_value = row_values[require_shipping_index]
-        require_shipping = self.__get_boolean(require_shipping_value)
-        return require_shipping
-
-    
-    def __get_variant_taxable(self, row_values):
-        taxable_index = int(self._field_details['variantTaxable'][0]['index'])
-        taxable_value = row_values[taxable_index]
-        taxable = self.__get_boolean(taxable_value)
-        return taxable
-
-
-    def __get_barcode(self, row_values):
-        barcode_index = int(self._field_details['variantBarcode'][0]['index'])
-        barcode = row_values[barcode_index]
-        if self.__is_invalid(barcode):
-            return None
-        else:
-            return str(barcode)
-
-
-    def __get_taxcode(self, row_values):
-        taxcode_index = int(self._field_details['variantTaxcode'][0]['index'])
-        taxcode = row_values[taxcode_index]
-        if self.__is_invalid(taxcode):
-            return None
-        else:
-            return str(taxcode)
-
-
-    def __get_variant_image(self, row_values):
-        image_index = int(self._field_details['variantImage'][0]['index'])
-        image = row_values[image_index]
-        if self.__is_invalid(image):
-            return None
-        else:
-            return str(image)
-
-
-    def __get_variant_cost(self, row_values):
-        cost_index = int(self._field_details['variantCost'][0]['index'])
-        cost_value = row_values[cost_index]
-        cost = self.__get_float(cost_value)
-        return cost
-
-
-
-
-
-
-    
-          
-
-    
-
-
 
+# generator of a worker process, built from the info sent to the worker when it started
+_worker_generator = None
 
 
+def _get_worker_shard_products(worker_info, shard):
+    """Transforms a shard in a worker process of ShardPool, building the generator of the process on the first shard"""
+    global _worker_generator
+    if _worker_generator is None:
+        _worker_generator = ProductGenerator(worker_info)
+    return _worker_generator.get_shard_products(shard)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import re
+from datamodel.custom_enums import JobStatus
+
+
+# the row number warnings start with
+ROW_NUMBER = re.compile(r'^Row \d+: ')
+
+
+class ProductHashes:
+    """
+    Class to find the products whose content changed since they were last prepared
+
+    The content of a product is hashed from the json it is written as, and
+    compared with the hash the product with the same handle had in the last
+    completed job. A product can only be matched by its handle, so products
+    without one, products with errors and handles that appear more than once in
+    a file are always reported as changed, and their hashes aren't kept.
+    The row numbers of warnings aren't hashed, so a product doesn't change
+    when rows above it are added or removed.
+    """
+
+    def __init__(self, previous_hashes, skip_unchanged):
+        """
+        Parameters
+        ----------
+        previous_hashes: dict, required
+            the hash of each handle from the last completed jobs
+
+        skip_unchanged: bool, required
+            whether products that haven't changed are left out of the prepared products
+        """
+        self._previous_hashes = previous_hashes
+        self._skip_unchanged = skip_unchanged
+        # hash of each handle in this job, or None for handles that appear more than once
+        self._hashes = {}
+        self._unchanged_count = 0
+
+
+    def is_written(self, product, content):
+        """
+        Records the hash of a product and returns whether it should be written
+
+        Parameters
+        ----------
+        product: dict, required
+            the product item
+
+        content: bytes, required
+            the product serialized as json
+
+        Returns
+        ------
+        written: bool
+            False when the product is unchanged and unchanged products are skipped
+        """
+        handle = product.get('handle')
+        if handle is None or len(product['errors']) > 0:
+            return True
+        if handle in self._hashes:
+            self._hashes[handle] = None
+            return True
+
+        if len(product.get('warnings', [])) > 0:
+            warnings = [ROW_NUMBER.sub('', warning) for warning in product['warnings']]
+            content = json.dumps(dict(product, warnings=warnings)).encode('utf-8')
+        content_hash = hashlib.blake2b(content, digest_size=16).hexdigest()
+        self._hashes[handle] = content_hash
+        if self._previous_hashes.get(handle) != content_hash:
+            return True
+        self._unchanged_count += 1
+        return not self._skip_unchanged
+
+
+    def get_unchanged_count(self):
+        """Returns the number of products that haven't changed since the last prepared job"""
+        return self._unchanged_count
+
+
+    def get_hashes(self):
+        """Returns the hash of each handle of this job, None for handles that appear more than once"""
+        return dict(self._hashes)
+
+
+def merge_job_hashes(job_hashes, job_statuses):
+    """
+    Merges the hashes saved by a user's jobs into the hash each handle was last processed with
+
+    Hashes are saved when a job is handed to the product processor, before
+    its products are applied. Only the hashes of completed jobs are known to
+    be applied. The handles of jobs that are still running or that failed in
+    part are left out, so they are reported as changed.
+
+    Parameters
+    ----------
+    job_hashes: list
+        a dict with the job_id and the hashes of each job, oldest first
+
+    job_statuses: dict
+        the status of each job
+
+    Returns
+    ------
+    hashes: dict
+        the hash of each handle
+    """
+    hashes = {}
+    for job in job_hashes:
+        is_completed = job_statuses.get(job['job_id']) == JobStatus.COMPLETED.name
+        for handle, content_hash in job['hashes'].items():
+            if is_completed and content_hash is not None:
+                hashes[handle] = content_hash
+            else:
+                hashes.pop(handle, None)
+    return hashes
@@ -0,0 +1,132 @@
+import functools
+import json
+from datamodel.custom_enums import ValueType
+from datamodel.product_item import OPTION_COUNT
+
+
+class RowPlan:
+    """
+    Column positions and active branches resolved once from a file's field_details.
+
+    Every mapped column is registered in columns together with the ValueType it
+    is normalized to. The attributes for each field hold the position of that
+    column in a normalized row, so generating a product from a row only needs
+    to read positions off the plan instead of parsing field_details and testing
+    for mapped fields on every cell. Fields that are not mapped in the file are
+    None (or empty for fields that can span several columns).
+    """
+
+    def __init__(self, field_details):
+        self.columns = []
+        self.__positions = {}
+
+        self.title = self.__column(field_details, 'title', ValueType.TEXT)
+        self.handle = self.__column(field_details, 'handle', ValueType.TEXT)
+
+        # product details
+        self.description = self.__columns(field_details, 'descriptionHtml', ValueType.TEXT)
+        self.vendor = self.__column(field_details, 'vendor', ValueType.TEXT)
+        self.product_type = self.__column(field_details, 'productType', ValueType.TEXT)
+        self.tags = self.__column(field_details, 'tags', ValueType.TEXT)
+        self.published = self.__column(field_details, 'published', ValueType.BOOLEAN)
+        self.seo_title = self.__column(field_details, 'seoTitle', ValueType.TEXT)
+        self.seo_description = self.__column(field_details, 'seoDescription', ValueType.TEXT)
+        self.status = self.__column(field_details, 'status', ValueType.STATUS)
+        self.collections = self.__column(field_details, 'customCollections', ValueType.TEXT)
+        # metafield values are passed on as they were read from the file
+        self.metafields = [
+            (self.__position(int(metafield['index']), ValueType.RAW), metafield['name'])
+            for metafield in field_details.get('metafields', [])
+        ]
+
+        # options, stored per option number (option1 is at position 0)
+        self.option_names = []
+        self.option_values = []
+        self.default_option_names = []
+        for option_number in range(1, OPTION_COUNT + 1):
+            name_field = 'option' + str(option_number) + 'Name'
+            value_field = 'option' + str(option_number) + 'Value'
+            self.option_names.append(self.__column(field_details, name_field, ValueType.TEXT))
+            self.option_values.append(self.__column(field_details, value_field, ValueType.TEXT))
+            default_name = None
+            if name_field not in field_details and value_field in field_details:
+                default_name = field_details[value_field][0]['defaultOptionName']
+                if default_name is not None: default_name = str(default_name)
+            self.default_option_names.append(default_name)
+
+        # variant details
+        self.variant_sku = self.__column(field_details, 'variantSku', ValueType.TEXT)
+        self.variant_weight = self.__column(field_details, 'variantWeight', ValueType.FLOAT)
+        self.weight_unit = None
+        if self.variant_weight is not None:
+            self.weight_unit = field_details['variantWeight'][0]['weightUnit']
+        self.variant_tracked = self.__column(field_details, 'variantTracked', ValueType.BOOLEAN)
+        self.variant_cost = self.__column(field_details, 'variantCost', ValueType.FLOAT)
+        # every quantity column is stored against the location of the first one
+        self.variant_quantities = []
+        if 'variantQuantity' in field_details:
+            location = field_details['variantQuantity'][0]['location']
+            self.variant_quantities = [
+                (self.__position(int(quantity['index']), ValueType.INT), location)
+                for quantity in field_details['variantQuantity']
+            ]
+        self.inventory_policy = self.__column(field_details, 'variantInventoryPolicy', ValueType.INVENTORY_POLICY)
+        self.variant_price = self.__column(field_details, 'variantPrice', ValueType.FLOAT)
+        self.compare_price = self.__column(field_details, 'variantCompareAtPrice', ValueType.FLOAT)
+        self.require_shipping = self.__column(field_details, 'variantRequireShipping', ValueType.BOOLEAN)
+        self.variant_taxable = self.__column(field_details, 'variantTaxable', ValueType.BOOLEAN)
+        self.variant_barcode = self.__column(field_details, 'variantBarcode', ValueType.TEXT)
+        self.variant_taxcode = self.__column(field_details, 'variantTaxcode', ValueType.TEXT)
+        self.images = self.__columns(field_details, 'imageSrc', ValueType.TEXT)
+        self.variant_image = self.__column(field_details, 'variantImage', ValueType.TEXT)
+
+        # field_details indexes of the columns to read from the file
+        self.column_indexes = sorted(set(index for index, value_type in self.columns))
+
+        # branches that depend on more than one field
+        self.has_option_values = any(position is not None for position in self.option_values)
+        self.has_seo = self.seo_title is not None or self.seo_description is not None
+        self.has_inventory_item = self.variant_tracked is not None or self.variant_cost is not None
+
+
+    def __column(self, field_details, field, value_type):
+        if field not in field_details:
+            return None
+        return self.__position(int(field_details[field][0]['index']), value_type)
+
+
+    def __columns(self, field_details, field, value_type):
+        return [self.__position(int(column['index']), value_type) for column in field_details.get(field, [])]
+
+
+    def __position(self, index, value_type):
+        """Registers a file column to be normalized to value_type and returns its position in a normalized row"""
+        key = (index, value_type)
+        if key not in self.__positions:
+            self.__positions[key] = len(self.columns)
+            self.columns.append(key)
+        return self.__positions[key]
+
+
+def get_row_plan(field_details):
+    """
+    Returns the row plan for the given field_details.
+
+    Plans are cached per container, so repeated jobs against the same file
+    (or files mapped the same way) reuse the compiled plan.
+
+    Parameters
+    ----------
+    field_details: dict, required
+        the field_details of the file object
+
+    Returns
+    ------
+    plan: RowPlan
+    """
+    return _compile_row_plan(json.dumps(field_details, sort_keys=True))
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_row_plan(field_details_json):
+    return RowPlan(json.loads(field_details_json))
@@ -0,0 +1,140 @@
+import marshal
+import multiprocessing
+import traceback
+from collections import deque
+from datamodel.custom_exceptions import ShardWorkerError
+
+
+class ShardPool:
+    """
+    Class to run a function over shards of work in worker processes and get the results in order
+
+    Workers are processes connected by pipes, since Lambda has no /dev/shm for
+    the queues and semaphores of multiprocessing.Pool. They are forked by a fork
+    server rather than by this process, whose other threads, like the uploads of
+    prepared products and the other jobs of an event, could hold a lock that a
+    forked copy would never see released. The fork server has already imported
+    preload_modules, so workers start without importing them again.
+
+    The function is pickled and sent to each worker when it starts, so it has to
+    be a module level function, or a functools.partial of one with arguments
+    that can be pickled. Shards and their results are sent with marshal rather
+    than pickle, since loading the results is most of the work left to this
+    process. They can therefore only be made of built-in types like dicts,
+    lists, strings, numbers and None.
+
+    A worker has at most one shard at a time, so neither end of a pipe waits
+    on the other to read while it sends.
+    """
+
+    def __init__(self, function, processes, preload_modules=None):
+        """
+        Parameters
+        ----------
+        function: callable, required
+            function that takes a shard and returns its result, which can be pickled
+
+        processes: int, required
+            number of worker processes
+
+        preload_modules: list, optional
+            names of the modules the fork server imports when it starts, like
+            the module of function
+        """
+        self._function = function
+        self._processes = processes
+        self._preload_modules = preload_modules or []
+        self._workers = []
+
+
+    def map(self, shards):
+        """
+        Runs the function over the shards on the worker processes
+
+        The next shards are read while the workers run, and the workers are
+        stopped once the results have been read or the generator is closed.
+
+        Parameters
+        ----------
+        shards: iterable, required
+            the shards of work
+
+        Returns
+        ------
+        results: generator
+            the result of each shard, in the order of the shards
+        """
+        shards = iter(shards)
+        pending_workers = deque()
+        idle_workers = []
+        has_shards = True
+        try:
+            while True:
+                while has_shards and (len(idle_workers) > 0 or len(self._workers) < self._processes):
+                    shard = next(shards, None)
+                    if shard is None:
+                        has_shards = False
+                        break
+                    worker = idle_workers.pop(0) if len(idle_workers) > 0 else self.__start_worker()
+                    worker[1].send_bytes(marshal.dumps(shard))
+                    pending_workers.append(worker)
+
+                if len(pending_workers) == 0:
+                    return
+                worker = pending_workers.popleft()
+                try:
+                    status, result = marshal.loads(worker[1].recv_bytes())
+                except EOFError:
+                    raise ShardWorkerError('Worker process ' + str(worker[0].pid) + ' exited with code ' + str(worker[0].exitcode))
+                if status == 'error':
+                    raise ShardWorkerError('Worker process failed to transform shard. Details: ' + result)
+                idle_workers.append(worker)
+                yield result
+        finally:
+            self.__stop_workers(pending_workers)
+
+
+    def __start_worker(self):
+        context = multiprocessing.get_context('forkserver')
+        # only used by the first pool of the process, which starts the fork server.
+        # The fork server imports them from the current directory, the task root on Lambda,
+        # and leaves them to the workers when they can't be found.
+        context.set_forkserver_preload(self._preload_modules)
+        connection, worker_connection = context.Pipe()
+        process = context.Process(target=_run_worker, args=(self._function, worker_connection), daemon=True)
+        process.start()
+        worker_connection.close()
+        worker = (process, connection)
+        self._workers.append(worker)
+        return worker
+
+
+    def __stop_workers(self, pending_workers):
+        for process, connection in self._workers:
+            if (process, connection) in pending_workers:
+                # a worker that is still sending a result would not read the stop message
+                process.terminate()
+            else:
+                try:
+                    connection.send_bytes(marshal.dumps(None))
+                except (BrokenPipeError, OSError):
+                    pass
+        for process, connection in self._workers:
+            process.join()
+            connection.close()
+        self._workers = []
+
+
+def _run_worker(function, connection):
+    while True:
+        try:
+            shard = marshal.loads(connection.recv_bytes())
+        except EOFError:
+            return
+        if shard is None:
+            return
+        try:
+            result = marshal.dumps(('result', function(shard)))
+        except Exception:
+            result = marshal.dumps(('error', traceback.format_exc()))
+        connection.send_bytes(result)
@@ -0,0 +1,188 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_MEMORY_LIMIT_MB = 256
+DEFAULT_DISK_LIMIT_MB = 256
+DEFAULT_DIRECTORY = '/tmp/sheet_cache'
+
+
+class SheetCache:
+    """
+    Class to keep the parsed sheets of excel files between the jobs of a warm container
+
+    Sheets are kept in memory and in a directory under /tmp, each of them
+    bounded by a number of bytes, and the least recently used sheets are evicted
+    first. A sheet evicted from memory can still be loaded from its file, which
+    is much faster than downloading and parsing the excel file again.
+
+    Sheets are saved as pickled data frames, which keep the column blocks and
+    dtypes of the frame without depending on pyarrow.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, memory_limit=DEFAULT_MEMORY_LIMIT_MB * 1024 * 1024, disk_limit=DEFAULT_DISK_LIMIT_MB * 1024 * 1024):
+        """
+        Parameters
+        ----------
+        directory: str, optional
+            directory the sheet files are saved in, whose content is replaced
+
+        memory_limit: int, optional
+            number of bytes of sheets kept in memory, 0 to keep none
+
+        disk_limit: int, optional
+            number of bytes of sheet files kept in directory, 0 to keep none
+        """
+        self._directory = directory
+        self._memory_limit = memory_limit
+        self._disk_limit = disk_limit
+        # (frame, size) and (path, size) of each key, least recently used first
+        self._memory_sheets = OrderedDict()
+        self._disk_sheets = OrderedDict()
+        self._memory_size = 0
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if disk_limit > 0:
+            # files left by an earlier cache aren't counted, so they are removed
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory, exist_ok=True)
+
+
+    def get_sheet(self, key):
+        """
+        Gets the cached sheet of an excel file
+
+        Parameters
+        ----------
+        key: str, required
+            identity of the file, like its s3 key and ETag
+
+        Returns
+        ------
+        sheet: CachedSheet
+            the sheet, whose frame is None when it isn't cached
+        """
+        return CachedSheet(self, key, self.get(key))
+
+
+    def has_file(self, file_key):
+        """
+        Checks whether a sheet of any version of a file is cached
+
+        Parameters
+        ----------
+        file_key: str, required
+            the part of the keys before '#', like the s3 key of the file
+
+        Returns
+        ------
+        has file: bool
+        """
+        prefix = file_key + '#'
+        with self._lock:
+            return any(key.startswith(prefix) for key in self._memory_sheets) or any(key.startswith(prefix) for key in self._disk_sheets)
+
+
+    def get(self, key):
+        """Returns the frame cached for key, or None"""
+        with self._lock:
+            if key in self._memory_sheets:
+                self._memory_sheets.move_to_end(key)
+                return self._memory_sheets[key][0]
+            if key not in self._disk_sheets:
+                return None
+            self._disk_sheets.move_to_end(key)
+            path = self._disk_sheets[key][0]
+
+        try:
+            with open(path, 'rb') as sheet_file:
+                frame = pickle.load(sheet_file)
+        except Exception as error:
+            logging.warning('Could not load cached sheet %s. Details: %s', key, error)
+            with self._lock:
+                self.__remove_file(key)
+            return None
+
+        with self._lock:
+            self.__add_to_memory(key, frame)
+        return frame
+
+
+    def put(self, key, frame):
+        """Caches the frame of a sheet under key"""
+        with self._lock:
+            self.__add_to_memory(key, frame)
+        if self._disk_limit <= 0:
+            return
+
+        path = os.path.join(self._directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl')
+        temporary_path = path + '.' + str(threading.get_ident())
+        try:
+            with open(temporary_path, 'wb') as sheet_file:
+                pickle.dump(frame, sheet_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, path)
+        except Exception as error:
+            # a full /tmp only means the sheet isn't cached on disk
+            logging.warning('Could not save cached sheet %s. Details: %s', key, error)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+
+        with self._lock:
+            self.__remove_file(key, delete=False)
+            size = os.path.getsize(path)
+            if size > self._disk_limit:
+                os.remove(path)
+                return
+            self._disk_sheets[key] = (path, size)
+            self._disk_size += size
+            while self._disk_size > self._disk_limit:
+                self.__remove_file(next(iter(self._disk_sheets)))
+
+
+    def __add_to_memory(self, key, frame):
+        if key in self._memory_sheets:
+            self._memory_sheets.move_to_end(key)
+            return
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        if size > self._memory_limit:
+            return
+        self._memory_sheets[key] = (frame, size)
+        self._memory_size += size
+        while self._memory_size > self._memory_limit:
+            evicted_key, (evicted_frame, evicted_size) = self._memory_sheets.popitem(last=False)
+            self._memory_size -= evicted_size
+
+
+    def __remove_file(self, key, delete=True):
+        if key not in self._disk_sheets:
+            return
+        path, size = self._disk_sheets.pop(key)
+        self._disk_size -= size
+        if delete and os.path.exists(path):
+            os.remove(path)
+
+
+class CachedSheet:
+    """
+    The sheet of an excel file in a SheetCache
+
+    Holds on to the frame that was cached when it was looked up, so it can't be
+    evicted before it is read.
+    """
+
+    def __init__(self, sheet_cache, key, frame):
+        self._sheet_cache = sheet_cache
+        self.key = key
+        self.frame = frame
+
+
+    def save(self, frame):
+        """Caches the frame parsed from the excel file"""
+        self.frame = frame
+        self._sheet_cache.put(self.key, frame)
@@ -0,0 +1,480 @@
+import io
+import itertools
+import shutil
+import tempfile
+import pandas as pd
+from pandas.errors import ParserError
+from datamodel.custom_exceptions import MissingArgumentError
+from datamodel.custom_enums import FileType, CsvEngine
+from utility.csv_engines import get_csv_engine, is_seekable
+from utility.xlsx_sheet import XlsxSheet, is_xlsx_file
+
+
+# number of bytes from the start of a csv file used to find its non empty columns
+PROBE_SIZE = 1024 * 1024
+# number of rows from the start of a streamed xlsx sheet used to find its non empty columns
+PROBE_ROWS = 1000
+# number of rows to read at a time from streamed xlsx sheets without a chunk_size
+EXCEL_CHUNK_SIZE = 5000
+# number of csv chunks held back while the empty columns of the file aren't known
+MAX_PENDING_CHUNKS = 4
+# csv files that are read again are copied to /tmp instead of memory when they get larger
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+class SheetReader:
+    """
+    Class to read the rows that products are generated from out of an excel or csv file
+
+    Rows are returned as data frames that keep the pandas index of the file
+    (LINE = INDEX + 2), start at the header_row of the file and leave out rows
+    that are completely empty. Columns are labelled with the index field_details
+    uses for them, which does not count columns that are completely empty.
+    """
+
+    def __init__(self, file_obj, file_content, chunk_size=None, cached_sheet=None, csv_engine=CsvEngine.AUTO, stream_excel=False):
+        """
+        Parameters
+        ----------
+        file_obj: dict, required
+            the file object of the excel or csv file
+
+        file_content: bytes or binary file object, required
+            the content of the file, which is read once
+
+        chunk_size: int, optional
+            number of rows to read at a time from csv files
+
+        cached_sheet: CachedSheet, optional
+            the cached sheet of an excel file, which is read instead of
+            file_content when it has a frame and saved once parsed otherwise
+
+        csv_engine: CsvEngine, optional
+            the parser csv files are read with when only some of their columns
+            are parsed, picked by the size of the file and whether it is seekable by default
+
+        stream_excel: bool, optional
+            whether xlsx files are streamed chunk by chunk from their XML
+            rather than read whole with pandas
+        """
+        self._file_obj = file_obj
+        self._file_content = file_content
+        self._file_type = FileType[file_obj['file_type']]
+        self._header_row = int(file_obj['header_row'])
+        self._chunk_size = chunk_size
+        self._cached_sheet = cached_sheet
+        self._csv_engine = csv_engine
+        self._stream_excel = stream_excel
+
+
+
+    def read(self, column_indexes):
+        """
+        Returns a generator of data frames with the rows of the file
+
+        Only the columns at column_indexes are returned. For csv files whose
+        first rows show where those columns are in the file, only those columns
+        are parsed, and rows that are empty in all of them are left out, since
+        their other cells aren't read. Otherwise only the rows that are empty in
+        every column of the file are left out.
+
+        Cells of csv files are read as text, so that values are the same
+        whether the file is read whole or in chunks, and by either csv engine.
+        When a chunk_size is set, csv files are read chunk_size rows at a time,
+        so only a few chunks of the file are held as data frames at once. When
+        only some columns are parsed, the rows before header_row are skipped
+        by the parser instead of being parsed.
+
+        Excel files are read whole, unless stream_excel is set. xlsx files are
+        then read chunk by chunk like csv files, with the cells of the mapped
+        columns read as text, once their first rows show where those columns
+        are. Other excel files are still read whole.
+
+        Parameters
+        ----------
+        column_indexes: list, required
+            field_details indexes of the columns to read
+
+        Returns
+        ------
+        frames: generator
+            data frames with the rows of the file, in file order
+        """
+        if self._file_type != FileType.EXCEL and self._file_type != FileType.CSV:
+            raise MissingArgumentError('Couldn\'t process file. File Type must be either CSV or EXCEL file.')
+
+        source = self.__open()
+        if self._file_type == FileType.EXCEL and self._stream_excel and is_xlsx_file(source):
+            return self.__stream_excel(source, column_indexes)
+
+        file_columns = None
+        column_count = 0
+        skipped_rows = 0
+        if self._file_type == FileType.CSV:
+            probe, is_whole_file = self.__peek(source)
+            file_columns, column_count = self.__probe_file_columns(probe, is_whole_file, column_indexes)
+
+        if self._file_type == FileType.CSV and (file_columns is not None or self._chunk_size is not None):
+            # the rows before header_row are only needed to find the empty columns,
+            # and cells are read as text, so skipping them doesn't change any value
+            if file_columns is not None and self.__can_skip_rows(probe, self._header_row):
+                skipped_rows = self._header_row
+            return self.__read_chunks(source, column_indexes, file_columns, skipped_rows, probe, column_count)
+        return self.__read_all(source, column_indexes)
+
+
+    def __read_all(self, source, column_indexes):
+        # RELATIONSHIPS TO TAKE NOTICE
+        # LINE = INDEX + 2
+        # START_INDEX = HEADER
+        # TITLE_INDEX = HEADER - 1
+        if self._file_type == FileType.EXCEL:
+            df = self.__read_excel(source)
+        else:
+            df = self.__drop_empty_cells(pd.read_csv(source, header=0, dtype=str))
+
+        row_values_start_position = self.__get_first_product_position(df.index, self._header_row)
+
+        #if we do not find the position of the first items, it means something is wrong
+        if row_values_start_position is None:
+            self.__raise_missing_start_position()
+
+        yield df.iloc[row_values_start_position:][column_indexes]
+
+
+    def __read_excel(self, source):
+        """Reads the sheet of the excel file, or gets it from the cached sheet"""
+        if self._cached_sheet is not None and self._cached_sheet.frame is not None:
+            return self._cached_sheet.frame
+
+        df = self.__drop_empty_cells(pd.read_excel(source, header=0))
+        if self._cached_sheet is not None:
+            self._cached_sheet.save(df)
+        return df
+
+
+    def __drop_empty_cells(self, df):
+        """Leaves out the empty columns and rows of a whole sheet, labelling the columns by position"""
+        df = df.dropna(axis=1, how='all')
+        df.columns = range(len(df.columns))
+        return df.dropna(axis=0, how='all')
+
+
+    def __read_chunks(self, source, column_indexes, file_columns, skipped_rows, probe, column_count):
+        """
+        Reads the csv file in chunks.
+
+        With file_columns, the chunks are read by the csv engine, which gives
+        them the same values and index whichever parser it uses. Without a
+        chunk_size, PandasCsvEngine reads the file as a single chunk, and
+        PyarrowCsvEngine in the blocks it parses.
+
+        Without file_columns, whether a column is empty is only known once a value
+        has been seen in it, so chunks are held back until every needed column has
+        a value. Once more than MAX_PENDING_CHUNKS chunks are held back, they are
+        dropped and the rest of the file is only read to find its empty columns,
+        after which the file is read again from its start. A file streamed as it
+        downloads is copied while it is read, so it can be read again.
+        """
+        if file_columns is not None:
+            usecols = sorted(file_columns)
+            row_count = int(self._file_obj.get('actual_row_count') or 0)
+            csv_engine = get_csv_engine(self._csv_engine, row_count, self.__get_complete_lines(probe, False), is_seekable(source))
+            chunks = csv_engine.read_chunks(source, usecols, skipped_rows, self._chunk_size, column_count)
+            yield from self.__read_pruned_chunks(chunks, column_indexes, file_columns, skipped_rows)
+            return
+
+        column_count = max(column_indexes) + 1
+        copying_reader = None
+        if is_seekable(source):
+            position = source.tell()
+            reader = source
+        else:
+            copying_reader = CopyingReader(source, tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir='/tmp'))
+            reader = io.BufferedReader(copying_reader)
+        try:
+            chunks = pd.read_csv(reader, header=0, dtype=str, chunksize=self._chunk_size)
+            has_values = None
+            kept_columns = None
+            pending = []
+            for chunk in chunks:
+                chunk_has_values = chunk.notna().any(axis=0).to_numpy()
+                has_values = chunk_has_values if has_values is None else has_values | chunk_has_values
+                if pending is not None:
+                    pending.append(chunk)
+                    if len(pending) > MAX_PENDING_CHUNKS:
+                        pending = None
+                kept_columns = self.__get_kept_columns(has_values, column_count, False)
+                if kept_columns is not None:
+                    break
+
+            if has_values is None:
+                self.__raise_missing_start_position()
+            if kept_columns is None:
+                kept_columns = self.__get_kept_columns(has_values, column_count, True)
+
+            if pending is None:
+                chunks.close()
+                if copying_reader is None:
+                    source.seek(position)
+                else:
+                    # the copy has every byte read so far, the rest of the file is added to it
+                    shutil.copyfileobj(source, copying_reader.copy)
+                    reader = copying_reader.copy
+                    reader.seek(0)
+                chunks = pd.read_csv(reader, header=0, dtype=str, chunksize=self._chunk_size)
+                pending = []
+            elif copying_reader is not None:
+                copying_reader.close_copy()
+            yield from self.__select_chunks(itertools.chain(pending, chunks), column_indexes, kept_columns)
+        finally:
+            if copying_reader is not None:
+                copying_reader.close_copy()
+
+
+    def __select_chunks(self, chunks, column_indexes, kept_columns):
+        """Leaves out the empty rows and the rows before header_row of chunks of every file column, and selects the needed columns"""
+        found_start_position = False
+        for chunk in chunks:
+            chunk = chunk.dropna(axis=0, how='all')
+            chunk = chunk.iloc[chunk.index.searchsorted(self._header_row):]
+            if len(chunk) > 0:
+                if not found_start_position and chunk.index[0] != self._header_row:
+                    self.__raise_missing_start_position()
+                found_start_position = True
+                yield self.__select_columns(chunk, column_indexes, kept_columns)
+
+        if not found_start_position:
+            self.__raise_missing_start_position()
+
+
+    def __read_pruned_chunks(self, chunks, column_indexes, file_columns, skipped_rows):
+        """Labels chunks of the file columns in file_columns and leaves out their empty rows and the rows before header_row"""
+        usecols = sorted(file_columns)
+        found_start_position = False
+        for chunk in chunks:
+            chunk.columns = [file_columns[file_column] for file_column in usecols]
+            chunk.index += skipped_rows
+            chunk = chunk.dropna(axis=0, how='all')
+            if skipped_rows < self._header_row:
+                chunk = chunk.iloc[chunk.index.searchsorted(self._header_row):]
+            if len(chunk) > 0:
+                found_start_position = True
+                yield chunk[column_indexes]
+        if not found_start_position:
+            self.__raise_missing_start_position()
+
+
+    def __stream_excel(self, source, column_indexes):
+        """
+        Streams the sheet of an xlsx file in chunks.
+
+        The rows before header_row are skipped by their row number, which
+        counts every row of the sheet. When the first PROBE_ROWS rows don't show
+        which columns are empty, the file is read whole instead.
+        """
+        sheet = XlsxSheet(source)
+        try:
+            file_columns = self.__probe_sheet_columns(sheet, column_indexes)
+            if file_columns is not None:
+                chunks = sheet.read_chunks(sorted(file_columns), self._header_row, self._chunk_size or EXCEL_CHUNK_SIZE)
+                yield from self.__read_pruned_chunks(chunks, column_indexes, file_columns, self._header_row)
+                return
+        finally:
+            sheet.close()
+        source.seek(0)
+        yield from self.__read_all(source, column_indexes)
+
+
+    def __probe_sheet_columns(self, sheet, column_indexes):
+        """Finds the sheet column of each field_details index from the first rows of the sheet, like __probe_file_columns"""
+        has_values = []
+        is_whole_sheet = True
+        for index, values in sheet.read_rows():
+            if index >= PROBE_ROWS:
+                is_whole_sheet = False
+                break
+            has_values.extend([False] * (len(values) - len(has_values)))
+            for position, value in enumerate(values):
+                if not has_values[position] and not pd.isna(value):
+                    has_values[position] = True
+
+        kept_columns = self.__get_kept_columns(has_values, max(column_indexes) + 1, is_whole_sheet)
+        if kept_columns is None or len(kept_columns) <= max(column_indexes):
+            return None
+        return {kept_columns[index]: index for index in column_indexes}
+
+
+    def __select_columns(self, frame, column_indexes, kept_columns):
+        frame = frame.iloc[:, kept_columns]
+        frame.columns = range(len(kept_columns))
+        return frame[column_indexes]
+
+
+    def __peek(self, source):
+        """Returns the first bytes of the csv file without moving source, and whether they are the whole file"""
+        if hasattr(source, 'peek'):
+            return source.peek(PROBE_SIZE)[:PROBE_SIZE], False
+        if hasattr(source, 'seek'):
+            position = source.tell()
+            probe = source.read(PROBE_SIZE)
+            source.seek(position)
+            return probe, len(probe) < PROBE_SIZE
+        return None, False
+
+
+    def __probe_file_columns(self, probe, is_whole_file, column_indexes):
+        """
+        Finds the csv file column of each field_details index from the first rows of the file
+
+        Parameters
+        ----------
+        probe: bytes, required
+            the first bytes of the csv file
+
+        is_whole_file: bool, required
+            whether probe holds the whole file
+
+        column_indexes: list, required
+            field_details indexes of the columns to read
+
+        Returns
+        ------
+        file columns: dict
+            field_details index of each file column, or None when the first rows
+            don't show which file columns are empty
+
+        column count: int
+            number of columns in the header of the file, 0 without file columns
+        """
+        if probe is None or len(probe) == 0:
+            return None, 0
+
+        try:
+            probe_df = pd.read_csv(io.BytesIO(self.__get_complete_lines(probe, is_whole_file)), header=0, dtype=str)
+        except (ParserError, ValueError, UnicodeDecodeError):
+            return None, 0
+
+        has_values = probe_df.notna().any(axis=0).to_numpy()
+        kept_columns = self.__get_kept_columns(has_values, max(column_indexes) + 1, is_whole_file)
+        if kept_columns is None or len(kept_columns) <= max(column_indexes):
+            return None, 0
+        return {kept_columns[index]: index for index in column_indexes}, len(probe_df.columns)
+
+
+    def __get_complete_lines(self, probe, is_whole_file):
+        """Leaves out the last line of the probe unless it holds the whole file, since it may be cut off"""
+        if is_whole_file:
+            return probe
+        return probe[:probe.rfind(b'\n') + 1]
+
+
+    def __can_skip_rows(self, probe, row_count):
+        """
+        Checks whether the first row_count rows after the header can be skipped by line number
+
+        skiprows counts lines of the file, while the pandas index leaves out blank
+        lines and a quoted value can span several lines. Rows can only be skipped
+        when each of them is a single line that is not blank.
+        """
+        lines = probe.split(b'\n', row_count + 1)
+        if len(lines) < row_count + 2:
+            return False
+        for line in lines[:row_count + 1]:
+            if line.strip() == b'' or line.count(b'"') % 2 != 0:
+                return False
+        return True
+
+
+    def __get_kept_columns(self, has_values, column_count, is_complete):
+        """Gets the positions of the non empty columns, or None if it can't be known yet
+
+        Parameters
+        ----------
+        has_values: list, required
+            whether a value has been seen in each column of the file so far
+
+        column_count: int, required
+            number of non empty columns needed
+
+        is_complete: bool, required
+            whether the whole file has been read
+
+        Returns
+        ------
+        kept columns: list
+        """
+        kept_columns = []
+        for position in range(len(has_values)):
+            if len(kept_columns) == column_count:
+                break
+            if has_values[position]:
+                kept_columns.append(position)
+            elif not is_complete:
+                return None
+        return kept_columns
+
+
+    def __get_first_product_position(self, index_list, start_index_number):
+        """Gets the row position that we should start reading products from in the spreadsheet
+
+        Parameters
+        ----------
+        index_list: Index, required
+            The sorted row indexes from pandas or excel sheet
+
+        start_index_number: int, required
+            this is the line indicated from the spreadsheet as the first row to read from
+
+        Returns
+        ------
+        first row to read: int
+        """
+        position = index_list.searchsorted(start_index_number)
+        if position == len(index_list):
+            return None
+        if index_list[position] != start_index_number:
+            return None
+        return position
+
+
+    def __open(self):
+        if isinstance(self._file_content, (bytes, bytearray)):
+            return io.BytesIO(self._file_content)
+        return self._file_content
+
+
+    def __raise_missing_start_position(self):
+        raise Exception('Invalid file. Could not find values start postion. Details... FileId: ' + self._file_obj['id'])
+
+
+class CopyingReader(io.RawIOBase):
+    """
+    Raw binary stream that copies what it reads from a binary file object
+
+    Lets a file that is parsed as it downloads be read again from its start,
+    by copying its bytes until close_copy is called.
+    """
+
+    def __init__(self, source, copy):
+        self._source = source
+        self.copy = copy
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        data = self._source.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        if self.copy is not None and not self.copy.closed:
+            self.copy.write(data)
+        return size
+
+
+    def close_copy(self):
+        """Stops copying and deletes the copy"""
+        if self.copy is not None:
+            self.copy.close()
@@ -0,0 +1,307 @@
+import posixpath
+import zipfile
+from xml.etree.ElementTree import iterparse
+import numpy as np
+import pandas as pd
+from utility.csv_engines import get_na_values
+
+
+MAIN_NAMESPACE = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS_NAMESPACE = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DOCUMENT_RELATIONSHIP_NAMESPACE = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+ROW_TAG = MAIN_NAMESPACE + 'row'
+VALUE_TAG = MAIN_NAMESPACE + 'v'
+TEXT_TAG = MAIN_NAMESPACE + 't'
+RUN_TAG = MAIN_NAMESPACE + 'r'
+INLINE_STRING_TAG = MAIN_NAMESPACE + 'is'
+SHARED_STRING_TAG = MAIN_NAMESPACE + 'si'
+SHEET_DATA_TAG = MAIN_NAMESPACE + 'sheetData'
+NA_VALUE_SET = set(get_na_values())
+
+
+def is_xlsx_file(source):
+    """Checks whether a seekable excel file is an xlsx file rather than an xls file, leaving it at its start"""
+    is_xlsx = zipfile.is_zipfile(source)
+    source.seek(0)
+    return is_xlsx
+
+
+class XlsxSheet:
+    """
+    Class to stream the rows of the first worksheet of an xlsx file from its XML
+
+    Cells are parsed as the worksheet decompresses, one row element at a time,
+    and only the cells of the columns asked for are converted, so memory does
+    not grow with the number of rows of the sheet. Only the shared strings
+    table, which cells refer to by position, is held whole.
+
+    Cells are read as the text pandas reads for the same value from a csv
+    file: whole numbers without a decimal point, dates the way str shows them
+    and NaN for empty cells, errors and the values pandas reads as NaN. This is
+    what the csv chunks are made of, so rows of both go through the same
+    pipeline. openpyxl, which pandas reads excel files with, is only imported
+    to tell which number formats are dates and to convert them.
+    """
+
+    def __init__(self, source):
+        """
+        Parameters
+        ----------
+        source: binary file object, required
+            the seekable xlsx file
+        """
+        from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900
+        self._archive = zipfile.ZipFile(source)
+        workbook_path = self.__get_workbook_path()
+        workbook_relationships = self.__read_relationships(workbook_path)
+        self._epoch = CALENDAR_WINDOWS_1900
+        self._sheet_path = None
+        for event, element in iterparse(self._archive.open(workbook_path)):
+            if element.tag == MAIN_NAMESPACE + 'workbookPr' and element.get('date1904') in ('1', 'true'):
+                self._epoch = CALENDAR_MAC_1904
+            elif element.tag == MAIN_NAMESPACE + 'sheet' and self._sheet_path is None:
+                target_type, target = workbook_relationships[element.get(DOCUMENT_RELATIONSHIP_NAMESPACE + 'id')]
+                # pandas reads the first worksheet, which may come after chart sheets
+                if target_type == 'worksheet':
+                    self._sheet_path = target
+        if self._sheet_path is None:
+            raise ValueError('Workbook has no worksheet')
+
+        targets = {target_type: target for target_type, target in workbook_relationships.values()}
+        self._shared_strings = self.__read_shared_strings(targets.get('sharedStrings'))
+        self._date_styles, self._timedelta_styles = self.__read_date_styles(targets.get('styles'))
+
+
+    def read_rows(self, usecols=None, skipped_rows=0):
+        """
+        Reads the rows after the header row of the sheet
+
+        Parameters
+        ----------
+        usecols: list, optional
+            positions of the columns to read, all of them when None
+
+        skipped_rows: int, optional
+            number of rows after the header to skip
+
+        Returns
+        ------
+        rows: generator
+            (index, values) of each row that has cells, where index counts the
+            rows after the skipped ones like the pandas index and values are
+            the cells at usecols, or the cells up to the last one with a value
+        """
+        # the header row is sheet row 1, so the first row kept is row 2 + skipped_rows
+        first_row_number = 2 + skipped_rows
+        positions = None
+        if usecols is not None:
+            positions = {column: position for position, column in enumerate(usecols)}
+        column_numbers = {}
+        row_number = 0
+        sheet_data = None
+        for event, element in iterparse(self._archive.open(self._sheet_path), events=('start', 'end')):
+            if event == 'start':
+                if element.tag == SHEET_DATA_TAG:
+                    sheet_data = element
+                continue
+            if element.tag != ROW_TAG:
+                continue
+
+            row_number = int(element.get('r', row_number + 1))
+            if row_number >= first_row_number:
+                values = self.__read_cells(element, positions, column_numbers)
+                if values is not None:
+                    yield row_number - first_row_number, values
+            # rows are only needed until they are read
+            sheet_data.clear()
+
+
+    def read_chunks(self, usecols, skipped_rows, chunk_size):
+        """
+        Reads chunks of the sheet like the chunks of a csv file read by a csv engine
+
+        Parameters
+        ----------
+        usecols: list, required
+            sorted positions of the columns to read
+
+        skipped_rows: int, required
+            number of rows after the header to skip
+
+        chunk_size: int, required
+            number of rows in each chunk
+
+        Returns
+        ------
+        chunks: generator
+            data frames with the columns in the order of usecols, NaN for empty
+            cells and an index that counts the rows after the skipped ones
+        """
+        indexes = []
+        rows = []
+        for index, values in self.read_rows(usecols, skipped_rows):
+            indexes.append(index)
+            rows.append(values)
+            if len(rows) == chunk_size:
+                yield pd.DataFrame(rows, index=indexes, columns=range(len(usecols)), dtype=object)
+                indexes = []
+                rows = []
+        if len(rows) > 0:
+            yield pd.DataFrame(rows, index=indexes, columns=range(len(usecols)), dtype=object)
+
+
+    def close(self):
+        self._archive.close()
+
+
+    def __read_cells(self, row, positions, column_numbers):
+        """Returns the text of the cells of a row at positions, or None when the row has none of them"""
+        values = None
+        column = -1
+        for cell in row:
+            reference = cell.get('r')
+            if reference is None:
+                column += 1
+            else:
+                letters = reference.rstrip('0123456789')
+                column = column_numbers.get(letters)
+                if column is None:
+                    column = self.__get_column_number(letters)
+                    column_numbers[letters] = column
+
+            if positions is None:
+                value = self.__get_text(cell)
+                if value is np.nan:
+                    continue
+                if values is None:
+                    values = []
+                values.extend([np.nan] * (column + 1 - len(values)))
+                values[column] = value
+            elif column in positions:
+                if values is None:
+                    values = [np.nan] * len(positions)
+                values[positions[column]] = self.__get_text(cell)
+        return values
+
+
+    def __get_text(self, cell):
+        """Converts a cell into the text pandas reads for its value, or NaN"""
+        cell_type = cell.get('t', 'n')
+        if cell_type == 'inlineStr':
+            inline_string = cell.find(INLINE_STRING_TAG)
+            if inline_string is None:
+                return np.nan
+            return self.__get_string(self.__get_rich_text(inline_string))
+
+        value = cell.findtext(VALUE_TAG) or None
+        if value is None or cell_type == 'e':
+            return np.nan
+        if cell_type == 's':
+            return self.__get_string(self._shared_strings[int(value)])
+        if cell_type == 'str':
+            return self.__get_string(value)
+        if cell_type == 'b':
+            return str(bool(int(value)))
+        if cell_type == 'd':
+            from openpyxl.utils.datetime import from_ISO8601
+            return str(from_ISO8601(value))
+
+        number = float(value) if '.' in value or 'E' in value or 'e' in value else int(value)
+        style = int(cell.get('s', 0))
+        if style in self._date_styles:
+            from openpyxl.utils.datetime import from_excel
+            try:
+                return str(from_excel(number, self._epoch, timedelta=style in self._timedelta_styles))
+            except (OverflowError, ValueError):
+                # openpyxl reads dates it can't convert as errors
+                return np.nan
+        if isinstance(number, float) and number.is_integer():
+            number = int(number)
+        return str(number)
+
+
+    def __get_string(self, value):
+        if value in NA_VALUE_SET:
+            return np.nan
+        return value
+
+
+    def __get_rich_text(self, element):
+        """Joins the text of a string item the way openpyxl does, leaving out phonetic runs"""
+        text = element.findtext(TEXT_TAG)
+        runs = element.findall(RUN_TAG)
+        if len(runs) == 0:
+            return text or ''
+        return (text or '') + ''.join(run.findtext(TEXT_TAG) or '' for run in runs)
+
+
+    def __get_column_number(self, letters):
+        number = 0
+        for letter in letters:
+            number = number * 26 + ord(letter) - ord('A') + 1
+        return number - 1
+
+
+    def __get_workbook_path(self):
+        for target_type, target in self.__read_relationships('').values():
+            if target_type == 'officeDocument':
+                return target
+        return 'xl/workbook.xml'
+
+
+    def __read_relationships(self, part_path):
+        """Reads the type and path of the parts related to a part, by relationship id"""
+        directory, name = posixpath.split(part_path)
+        relationships_path = posixpath.join(directory, '_rels', name + '.rels')
+        relationships = {}
+        if relationships_path not in self._archive.namelist():
+            return relationships
+        for event, element in iterparse(self._archive.open(relationships_path)):
+            if element.tag != RELATIONSHIPS_NAMESPACE + 'Relationship' or element.get('TargetMode') == 'External':
+                continue
+            target = element.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(directory, target))
+            relationships[element.get('Id')] = (element.get('Type').rsplit('/', 1)[-1], target)
+        return relationships
+
+
+    def __read_shared_strings(self, path):
+        strings = []
+        if path is None:
+            return strings
+        for event, element in iterparse(self._archive.open(path)):
+            if element.tag == SHARED_STRING_TAG:
+                strings.append(self.__get_rich_text(element).replace('x005F_', ''))
+                element.clear()
+        return strings
+
+
+    def __read_date_styles(self, path):
+        """Finds the cell styles whose number format is a date, and those that are durations"""
+        from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+        date_styles = set()
+        timedelta_styles = set()
+        if path is None:
+            return date_styles, timedelta_styles
+
+        custom_formats = {}
+        style_formats = []
+        in_cell_styles = False
+        for event, element in iterparse(self._archive.open(path), events=('start', 'end')):
+            if element.tag == MAIN_NAMESPACE + 'cellXfs':
+                in_cell_styles = event == 'start'
+            elif event == 'end' and element.tag == MAIN_NAMESPACE + 'numFmt':
+                custom_formats[int(element.get('numFmtId'))] = element.get('formatCode')
+            elif event == 'end' and element.tag == MAIN_NAMESPACE + 'xf' and in_cell_styles:
+                style_formats.append(int(element.get('numFmtId', 0)))
+
+        for style, format_id in enumerate(style_formats):
+            number_format = custom_formats[format_id] if format_id in custom_formats else builtin_format_code(format_id)
+            if is_date_format(number_format):
+                date_styles.add(style)
+            if is_timedelta_format(number_format):
+                timedelta_styles.add(style)
+        return date_styles, timedelta_styles
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# the lambda code imports its modules relative to src, the way it is deployed
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from datamodel.custom_enums import ValueType
+from utility.column_normalizer import normalize_column, normalize_rows
+
+
+def test_converts_text_cells():
+    column = pd.Series(['10', ' 2.5', 'free', '', np.nan, '10'], dtype=object)
+
+    assert normalize_column(column, ValueType.FLOAT) == [10.0, 2.5, 'INVALID', None, None, 10.0]
+    assert normalize_column(column, ValueType.INT) == [10, 'INVALID', 'INVALID', None, None, 10]
+    assert normalize_column(column, ValueType.TEXT) == ['10', ' 2.5', 'free', None, None, '10']
+
+
+def test_converts_number_cells():
+    column = pd.Series([1.0, 2.5, np.nan])
+
+    assert normalize_column(column, ValueType.FLOAT) == [1.0, 2.5, None]
+    assert normalize_column(column, ValueType.INT) == [1, 2, None]
+    assert normalize_column(column, ValueType.TEXT) == ['1.0', '2.5', None]
+
+
+def test_converts_choices_without_case_or_spaces():
+    column = pd.Series([' Yes', 'n', 'maybe', 'Active ', 'archived', 'DRAFT', 'continue', 'deny'])
+
+    assert normalize_column(column, ValueType.BOOLEAN)[:3] == [True, False, 'INVALID']
+    assert normalize_column(column, ValueType.STATUS)[3:6] == ['ACTIVE', 'ARCHIVED', 'DRAFT']
+    assert normalize_column(column, ValueType.INVENTORY_POLICY)[5:] == ['INVALID', 'CONTINUE', 'DENY']
+
+
+def test_builds_rows_in_the_order_of_the_columns():
+    df = pd.DataFrame({0: ['Shirt', 'Pants'], 1: ['10', 'free']})
+
+    assert normalize_rows(df, [(1, ValueType.FLOAT), (0, ValueType.TEXT)]) == [(10.0, 'Shirt'), ('INVALID', 'Pants')]
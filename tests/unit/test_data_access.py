@@ -0,0 +1,180 @@
+import io
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import dataaccess.data_access
+from dataaccess.data_access import DataAccess
+from datamodel.custom_exceptions import DataAccessError
+
+
+FILE_ITEM = {'PK': 'file#file-1', 'SK': 'file', 'file_type': 'CSV', 's3_key': 'uploads/file-1.csv', 'header_row': '0', 'field_details': '{}'}
+JOB_ITEM = {'PK': 'job#job-1', 'SK': 'user#user', 'SK2': 'IMPORT_CREATE#--'}
+
+
+class BatchGetDynamoDB:
+    """Stands in for the dynamodb resource, answering each batch get with the next of responses"""
+
+    def __init__(self, responses):
+        self._responses = list(responses)
+        self.requests = []
+
+
+    def batch_get_item(self, RequestItems):
+        self.requests.append(RequestItems)
+        return self._responses.pop(0)
+
+
+@pytest.fixture
+def data_access(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-2')
+    monkeypatch.setenv('bulk_manager_table', 'BulkManager')
+    monkeypatch.setattr(dataaccess.data_access.time, 'sleep', lambda seconds: None)
+    return DataAccess()
+
+
+def test_gets_the_keys_a_batch_get_left_unprocessed(data_access):
+    job_key = {'PK': 'job#job-1', 'SK': 'user#user'}
+    data_access._dynamodb = BatchGetDynamoDB([
+        {'Responses': {'BulkManager': [FILE_ITEM]}, 'UnprocessedKeys': {'BulkManager': {'Keys': [job_key]}}},
+        {'Responses': {'BulkManager': [JOB_ITEM]}, 'UnprocessedKeys': {}},
+    ])
+
+    file_obj, job = data_access.get_file_and_job('file-1', 'job-1', 'user')
+
+    assert file_obj['s3_key'] == 'uploads/file-1.csv'
+    assert job == {'id': 'job-1', 'user_id': 'user', 'type': 'IMPORT_CREATE'}
+    # only the unprocessed key is asked for again
+    assert data_access._dynamodb.requests[1] == {'BulkManager': {'Keys': [job_key]}}
+
+
+def test_fails_when_keys_stay_unprocessed(data_access):
+    unprocessed = {'Responses': {}, 'UnprocessedKeys': {'BulkManager': {'Keys': [{'PK': 'job#job-1', 'SK': 'user#user'}]}}}
+    data_access._dynamodb = BatchGetDynamoDB([unprocessed] * dataaccess.data_access.BATCH_GET_ATTEMPTS)
+
+    with pytest.raises(DataAccessError):
+        data_access.get_file_and_job('file-1', 'job-1', 'user')
+    assert len(data_access._dynamodb.requests) == dataaccess.data_access.BATCH_GET_ATTEMPTS
+
+
+def test_fails_when_the_job_is_not_found(data_access):
+    data_access._dynamodb = BatchGetDynamoDB([{'Responses': {'BulkManager': [FILE_ITEM]}}])
+
+    with pytest.raises(DataAccessError, match='job job-1 was not found'):
+        data_access.get_file_and_job('file-1', 'job-1', 'user')
+
+
+class S3Client:
+    """Stands in for the s3 client, with the content and ETag of each key"""
+
+    def __init__(self, files=None):
+        self._files = dict(files or {})
+        self._lock = threading.Lock()
+        self.head_requests = []
+
+
+    def get_object(self, Bucket, Key):
+        content, etag = self._files[Key]
+        return {'Body': io.BytesIO(content), 'ETag': etag}
+
+
+    def head_object(self, Bucket, Key):
+        self.head_requests.append(Key)
+        return {'ETag': self._files[Key][1]}
+
+
+    def put_object(self, Bucket, Body, Key):
+        with self._lock:
+            self._files[Key] = (Body, '"' + str(len(self._files)) + '"')
+
+
+    def list_objects_v2(self, Bucket, Prefix, ContinuationToken='0'):
+        # two keys a page, to go through the continuation tokens
+        with self._lock:
+            keys = sorted(key for key in self._files if key.startswith(Prefix))
+        start = int(ContinuationToken)
+        response = {'Contents': [{'Key': key} for key in keys[start:start + 2]], 'IsTruncated': start + 2 < len(keys)}
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + 2)
+        return response
+
+
+    def delete_objects(self, Bucket, Delete):
+        with self._lock:
+            for deleted in Delete['Objects']:
+                self._files.pop(deleted['Key'], None)
+
+
+def test_downloads_a_product_file_with_its_etag(data_access):
+    data_access._s3_client = S3Client({'uploads/products.xlsx': (b'x' * 1000, '"etag-1"')})
+
+    product_file, etag = data_access.download_product_file('uploads/products.xlsx')
+
+    with product_file:
+        assert product_file.read() == b'x' * 1000
+    assert etag == '"etag-1"'
+    assert data_access._s3_client.head_requests == []
+
+
+def test_keeps_the_hashes_of_jobs_saved_at_the_same_time(data_access):
+    data_access._s3_client = S3Client()
+    jobs = ['job-' + str(job) for job in range(8)]
+
+    def save(job_id):
+        data_access.save_product_hashes('user', job_id, {'product-' + job_id: job_id + '-hash', 'shared': job_id + '-hash'}, job_count=20)
+
+    threads = [threading.Thread(target=save, args=(job_id,)) for job_id in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    job_hashes = data_access.get_product_hashes('user')
+    assert sorted(job_hash['job_id'] for job_hash in job_hashes) == jobs
+    for job_hash in job_hashes:
+        assert job_hash['hashes']['product-' + job_hash['job_id']] == job_hash['job_id'] + '-hash'
+
+
+def test_keeps_the_hashes_of_the_last_jobs(data_access):
+    data_access._s3_client = S3Client()
+    for job in range(5):
+        data_access.save_product_hashes('user', 'job-' + str(job), {'product': str(job)}, job_count=3)
+
+    assert [job_hash['job_id'] for job_hash in data_access.get_product_hashes('user')] == ['job-2', 'job-3', 'job-4']
+    assert [job_hash['job_id'] for job_hash in data_access.get_product_hashes('user', job_count=2)] == ['job-3', 'job-4']
+    assert data_access.get_product_hashes('other-user') == []
+
+
+def test_gets_the_status_of_jobs(data_access):
+    data_access._dynamodb = BatchGetDynamoDB([
+        {'Responses': {'BulkManager': [dict(JOB_ITEM, status='COMPLETED'), {'PK': 'job#job-2', 'SK': 'user#user', 'status': 'RUNNING'}]}},
+    ])
+
+    assert data_access.get_job_statuses('user', ['job-1', 'job-2', 'job-1', 'job-3']) == {'job-1': 'COMPLETED', 'job-2': 'RUNNING'}
+    assert len(data_access._dynamodb.requests[0]['BulkManager']['Keys']) == 3
+
+
+class Table:
+    """Stands in for the BulkManager table, with the keys of the items it has"""
+
+    def __init__(self, keys):
+        self._keys = keys
+        self.updates = []
+
+
+    def update_item(self, **update_args):
+        self.updates.append(update_args)
+        if 'ConditionExpression' in update_args and update_args['Key']['PK'] not in self._keys:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}}, 'UpdateItem')
+        return {'Attributes': {}}
+
+
+def test_only_updates_existing_jobs_when_asked_to(data_access):
+    data_access._bulk_manager_table = Table({'job#job-1'})
+
+    assert data_access.basic_job_update({'id': 'job-1', 'user_id': 'user', 'status': 'FAILED'}, only_existing=True)
+    assert not data_access.basic_job_update({'id': 'job-2', 'user_id': 'user', 'status': 'FAILED'}, only_existing=True)
+    assert data_access._bulk_manager_table.updates[1]['ConditionExpression'] == 'attribute_exists(PK)'
+    assert data_access.basic_job_update({'id': 'job-2', 'user_id': 'user', 'current_batch': 1})
+    assert 'ConditionExpression' not in data_access._bulk_manager_table.updates[2]
@@ -1,73 +1,418 @@
+import io
 import json
+import logging
+import os
+import subprocess
+import sys
+import threading
 
 import pytest
 
-from hello_world import app
-
-
-@pytest.fixture()
-def apigw_event():
-    """ Generates API GW Event"""
-
-    return {
-        "body": '{ "test": "body"}',
-        "resource": "/{proxy+}",
-        "requestContext": {
-            "resourceId": "123456",
-            "apiId": "1234567890",
-            "resourcePath": "/{proxy+}",
-            "httpMethod": "POST",
-            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
-            "accountId": "123456789012",
-            "identity": {
-                "apiKey": "",
-                "userArn": "",
-                "cognitoAuthenticationType": "",
-                "caller": "",
-                "userAgent": "Custom User Agent String",
-                "user": "",
-                "cognitoIdentityPoolId": "",
-                "cognitoIdentityId": "",
-                "cognitoAuthenticationProvider": "",
-                "sourceIp": "127.0.0.1",
-                "accountId": "",
-            },
-            "stage": "prod",
-        },
-        "queryStringParameters": {"foo": "bar"},
-        "headers": {
-            "Via": "1.1 08f323deadbeefa7af34d5feb414ce27.cloudfront.net (CloudFront)",
-            "Accept-Language": "en-US,en;q=0.8",
-            "CloudFront-Is-Desktop-Viewer": "true",
-            "CloudFront-Is-SmartTV-Viewer": "false",
-            "CloudFront-Is-Mobile-Viewer": "false",
-            "X-Forwarded-For": "127.0.0.1, 127.0.0.2",
-            "CloudFront-Viewer-Country": "US",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            "Upgrade-Insecure-Requests": "1",
-            "X-Forwarded-Port": "443",
-            "Host": "1234567890.execute-api.us-east-1.amazonaws.com",
-            "X-Forwarded-Proto": "https",
-            "X-Amz-Cf-Id": "aaaaaaaaaae3VYQb9jd-nvCd-de396Uhbp027Y2JvkCPNLmGJHqlaA==",
-            "CloudFront-Is-Tablet-Viewer": "false",
-            "Cache-Control": "max-age=0",
-            "User-Agent": "Custom User Agent String",
-            "CloudFront-Forwarded-Proto": "https",
-            "Accept-Encoding": "gzip, deflate, sdch",
-        },
-        "pathParameters": {"proxy": "/examplepath"},
-        "httpMethod": "POST",
-        "stageVariables": {"baz": "qux"},
-        "path": "/examplepath",
+import app
+import utility.sheet_reader
+from datamodel.custom_enums import ProductsFormat
+from dataaccess.prepared_products_writer import BatchedProductsWriter, PreparedProductsWriter, LocalPartStore
+from dataaccess.product_processor_publisher import LocalSnsClient, ProductProcessorPublisher
+from utility.csv_engines import PYARROW_MIN_ROWS
+from utility.sheet_cache import SheetCache
+
+
+FIELD_DETAILS = {'title': [{'index': '0'}], 'variantPrice': [{'index': '1'}]}
+FILES = {
+    'products.csv': b'Title,Price\nShirt,10\nPants,20\n',
+    'missing-column.csv': b'Price\n10\n',
+    'catalog.csv': b'Title,Price\n' + b''.join(b'Product ' + str(product).encode() + b',' + str(product).encode() + b'\n' for product in range(23)),
+    'large.csv': b'Title,Price\n' + b''.join(b'Product ' + str(product).encode() + b',' + str(product).encode() + b'\n' for product in range(PYARROW_MIN_ROWS)),
+}
+
+
+class StreamedFile(io.RawIOBase):
+    """Stands in for the body of a product file that is parsed as it downloads, which can't seek"""
+
+    def __init__(self, content):
+        self._content = io.BytesIO(content)
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        data = self._content.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class LocalDataAccess:
+    """Stand-in for DataAccess that reads files from FILES and writes prepared products to a directory"""
+
+    def __init__(self, directory):
+        self._directory = directory
+        self.job_updates = []
+        self.failed_jobs = []
+        self.published = []
+        self.messages = []
+        self.sns_client = LocalSnsClient(fail_ids=['3'])
+        self.product_hashes = {}
+        self.etag_requests = []
+        self.missing_jobs = set()
+        self.job_type = 'IMPORT_CREATE'
+        self.job_options = {}
+        self.product_hash_reads = []
+        self.opened_files = []
+
+
+    def get_file_and_job(self, file_id, job_id, user_id):
+        if file_id not in FILES:
+            raise KeyError('File ' + file_id + ' not found')
+        file_type = 'EXCEL' if file_id.endswith('.xlsx') else 'CSV'
+        file_obj = {'id': file_id, 'file_type': file_type, 'header_row': '0', 's3_key': file_id, 'field_details': FIELD_DETAILS, 'actual_row_count': str(FILES[file_id].count(b'\n') - 1)}
+        job = {
+            'id': job_id,
+            'user_id': user_id,
+            'type': self.job_type,
+            'options': dict({'addedTags': [], 'defaultPublishedStatus': True, 'defaultStatus': 'DRAFT'}, **self.job_options)
+        }
+        return file_obj, job
+
+
+    def update_job_transaction(self, job):
+        self.job_updates.append(job)
+
+
+    def update_failed_job_transaction(self, job):
+        self.failed_jobs.append(job['id'])
+
+
+    def open_product_file(self, file_key, seekable=False, metrics=None):
+        self.opened_files.append((file_key, seekable))
+        if seekable:
+            return io.BytesIO(FILES[file_key])
+        return io.BufferedReader(StreamedFile(FILES[file_key]))
+
+
+    def download_product_file(self, file_key, metrics=None):
+        return io.BytesIO(FILES[file_key]), 'etag'
+
+
+    def get_file_etag(self, file_key):
+        self.etag_requests.append(file_key)
+        return 'etag'
+
+
+    def get_prepared_products_writer(self, file_key, metrics=None, product_hashes=None, products_format=ProductsFormat.JSON):
+        return PreparedProductsWriter(LocalPartStore(self._directory, file_key), metrics=metrics, product_hashes=product_hashes, products_format=products_format)
+
+
+    def get_batched_products_writer(self, file_key, batch_size, on_first_batch=None, metrics=None, product_hashes=None, on_batch=None, products_format=ProductsFormat.JSON):
+        def get_part_store(key, key_format):
+            return LocalPartStore(self._directory, key)
+        return BatchedProductsWriter(get_part_store, file_key, batch_size, on_first_batch, metrics, product_hashes, on_batch, products_format)
+
+
+    def get_product_hashes(self, user_id):
+        self.product_hash_reads.append(user_id)
+        return self.product_hashes.get(user_id, [])
+
+
+    def save_product_hashes(self, user_id, job_id, hashes):
+        self.product_hashes.setdefault(user_id, []).append({'job_id': job_id, 'hashes': hashes})
+
+
+    def get_job_statuses(self, user_id, job_ids):
+        return {job_id: 'COMPLETED' for job_id in job_ids}
+
+
+    def basic_job_update(self, job, only_existing=False):
+        if only_existing and job['id'] in self.missing_jobs:
+            return False
+        self.job_updates.append(job)
+        return True
+
+
+    def publish_to_product_processor(self, message):
+        self.published.append(message['jobId'])
+        self.messages.append(message)
+
+
+    def publish_batch_to_product_processor(self, messages):
+        ProductProcessorPublisher(self.sns_client, 'import-topic').publish_batch(messages)
+
+
+def get_record(message):
+    return {'Sns': {'Message': json.dumps(message)}}
+
+
+def test_prepares_every_record_and_isolates_failures(tmp_path, monkeypatch, caplog):
+    # the root logger is left at WARNING, like in the Lambda runtime
+    assert logging.getLogger().getEffectiveLevel() == logging.WARNING
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    event = {'Records': [
+        get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'}),
+        get_record({'fileId': 'missing-column.csv', 'jobId': 'job-2', 'userId': 'user'}),
+        {'Sns': {'Message': 'not json'}},
+        get_record({'fileId': 'products.csv', 'jobId': 'job-3', 'userId': 'user'}),
+    ]}
+
+    app.lambda_handler(event, None)
+
+    assert sorted(data_access.published) == ['job-1', 'job-3']
+    assert data_access.failed_jobs == ['job-2']
+    with open(os.path.join(str(tmp_path), 'products_job_id_job-1.json')) as file:
+        products = json.load(file)
+    assert [product['title'] for product in products] == ['Shirt', 'Pants']
+    totals = [job['total_products'] for job in data_access.job_updates if 'total_products' in job]
+    assert totals == [2, 2]
+
+    # every job logs one line of metrics
+    metrics = [json.loads(record.args[0]) for record in caplog.records if record.msg.startswith('JOB_METRICS')]
+    assert sorted((job_metrics['jobId'], job_metrics['failed']) for job_metrics in metrics) == [
+        ('job-1', False), ('job-2', True), ('job-3', False)
+    ]
+    job_metrics = next(job_metrics for job_metrics in metrics if job_metrics['jobId'] == 'job-1')
+    assert job_metrics['counts'] == {'rows': 2, 'products': 2, 'variants': 2}
+    assert {'lookup', 'parse', 'normalize', 'transform', 'serialize', 'upload', 'publish'} <= set(job_metrics['stages_ms'])
+
+
+def test_only_releases_the_jobs_that_were_marked_as_preparing(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+
+    # the lookup fails before the PREPARING transaction incremented the active job count
+    app.lambda_handler({'Records': [get_record({'fileId': 'deleted.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert data_access.failed_jobs == []
+    assert data_access.job_updates == [{'id': 'job-1', 'user_id': 'user', 'status': 'FAILED'}]
+
+    # a job that doesn't exist isn't created by marking it as failed
+    data_access.missing_jobs.add('job-3')
+    app.lambda_handler({'Records': [get_record({'fileId': 'deleted.csv', 'jobId': 'job-3', 'userId': 'user'})]}, None)
+
+    assert data_access.job_updates == [{'id': 'job-1', 'user_id': 'user', 'status': 'FAILED'}]
+
+    def fail_transaction(job):
+        raise Exception('Transaction cancelled')
+
+    monkeypatch.setattr(data_access, 'update_job_transaction', fail_transaction)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-2', 'userId': 'user'})]}, None)
+
+    assert data_access.failed_jobs == []
+    assert data_access.job_updates[-1] == {'id': 'job-2', 'user_id': 'user', 'status': 'FAILED'}
+
+
+def test_marks_the_job_as_failed_after_it_was_marked_as_preparing_when_the_download_fails(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+
+    def fail_download(file_key, seekable=False, metrics=None):
+        raise Exception('Access denied')
+
+    monkeypatch.setattr(data_access, 'open_product_file', fail_download)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert data_access.job_updates == [{'id': 'job-1', 'user_id': 'user', 'status': 'PREPARING'}]
+    assert data_access.failed_jobs == ['job-1']
+
+
+def test_closes_the_product_file_when_the_job_cant_be_marked_as_preparing(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    product_files = []
+
+    def open_product_file(file_key, seekable=False, metrics=None):
+        product_files.append(io.BytesIO(FILES[file_key]))
+        return product_files[-1]
+
+    def fail_transaction(job):
+        raise Exception('Transaction cancelled')
+
+    monkeypatch.setattr(data_access, 'open_product_file', open_product_file)
+    monkeypatch.setattr(data_access, 'update_job_transaction', fail_transaction)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert [product_file.closed for product_file in product_files] == [True]
+    assert data_access.published == []
+
+
+def test_only_asks_for_the_etag_of_excel_files_with_a_cached_sheet(tmp_path, monkeypatch):
+    pytest.importorskip('openpyxl')
+    import pandas as pd
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    sheet_cache = SheetCache(os.path.join(str(tmp_path), 'sheets'))
+    monkeypatch.setattr(app, 'get_sheet_cache', lambda: sheet_cache)
+    excel_file = io.BytesIO()
+    pd.DataFrame({'Title': ['Shirt', 'Pants'], 'Price': [10, 20]}).to_excel(excel_file, index=False)
+    monkeypatch.setitem(FILES, 'products.xlsx', excel_file.getvalue())
+
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.xlsx', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+    assert data_access.etag_requests == []
+    assert sheet_cache.has_file('products.xlsx')
+
+    # the second job finds the sheet the first one cached under the ETag of its download
+    monkeypatch.setitem(FILES, 'products.xlsx', b'')
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.xlsx', 'jobId': 'job-2', 'userId': 'user'})]}, None)
+    assert data_access.etag_requests == ['products.xlsx']
+    assert sorted(data_access.published) == ['job-1', 'job-2']
+    with open(os.path.join(str(tmp_path), 'products_job_id_job-2.json')) as file:
+        assert [product['title'] for product in json.load(file)] == ['Shirt', 'Pants']
+
+
+def test_only_reads_the_product_hashes_of_edit_imports_of_changed_products(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    # the create import saves its hashes without reading the earlier ones
+    assert data_access.product_hash_reads == []
+    assert data_access.product_hashes['user'][0]['job_id'] == 'job-1'
+
+    data_access.job_type = 'IMPORT_EDIT'
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-2', 'userId': 'user'})]}, None)
+    assert data_access.product_hash_reads == []
+    assert 'unchanged_products' not in data_access.job_updates[-1]
+
+    data_access.job_options = {'onlyChangedProducts': True}
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-3', 'userId': 'user'})]}, None)
+    assert data_access.product_hash_reads == ['user']
+    # products without a handle are always prepared
+    assert data_access.job_updates[-1]['unchanged_products'] == 0
+
+
+def test_prepares_every_product_when_the_product_hashes_cant_be_read(tmp_path, monkeypatch, caplog):
+    data_access = LocalDataAccess(str(tmp_path))
+    data_access.job_type = 'IMPORT_EDIT'
+    data_access.job_options = {'onlyChangedProducts': True}
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+
+    def fail_read(user_id):
+        raise Exception('Access denied')
+
+    monkeypatch.setattr(data_access, 'get_product_hashes', fail_read)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert data_access.published == ['job-1']
+    assert data_access.failed_jobs == []
+    assert data_access.job_updates[-1]['unchanged_products'] == 0
+    assert data_access.job_updates[-1]['total_products'] == 2
+    assert data_access.product_hashes['user'][0]['job_id'] == 'job-1'
+    assert any('Could not get product hashes' in record.getMessage() for record in caplog.records)
+
+
+def test_starts_processing_after_the_first_batch(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    monkeypatch.setenv('products_batch_size', '1')
+
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert data_access.messages == [{'jobId': 'job-1', 'userId': 'user', 'manifest': 'products_job_id_job-1_manifest.json'}]
+    # the first update points the processor at the manifest, the last one completes the job
+    assert data_access.job_updates[1] == {
+        'id': 'job-1', 'user_id': 'user', 'current_batch': 1, 'input_products': 'products_job_id_job-1_manifest.json', 'products_format': 'JSON'
     }
+    assert data_access.job_updates[-1]['total_products'] == 2
+    assert data_access.job_updates[-1]['total_batches'] == 2
+    with open(os.path.join(str(tmp_path), 'products_job_id_job-1_manifest.json')) as file:
+        manifest = json.load(file)
+    assert manifest['complete'] is True
+    assert [batch['key'] for batch in manifest['batches']] == ['products_job_id_job-1_batch_1.json', 'products_job_id_job-1_batch_2.json']
+
+
+def test_leaves_the_job_to_the_processor_when_generation_fails_after_the_first_batch(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    monkeypatch.setenv('products_batch_size', '1')
+
+    class FailingProductGenerator:
+        def __init__(self, info):
+            pass
+
+        def iter_products(self):
+            yield {'title': 'Shirt', 'errors': [], 'warnings': []}
+            yield {'title': 'Pants', 'errors': [], 'warnings': []}
+            raise ValueError('generation failed')
+
+    monkeypatch.setattr(app, 'import_product_generator', lambda: FailingProductGenerator)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert data_access.messages == [{'jobId': 'job-1', 'userId': 'user', 'manifest': 'products_job_id_job-1_manifest.json'}]
+    # the active job count is given back by the processor, which sets the final status
+    assert data_access.failed_jobs == []
+    assert all('status' not in job or job['status'] == 'PREPARING' for job in data_access.job_updates)
+    with open(os.path.join(str(tmp_path), 'products_job_id_job-1_manifest.json')) as file:
+        manifest = json.load(file)
+    assert manifest['failed'] is True
+    assert manifest['truncated'] is True
+    assert manifest['total_products'] == 2
+
+
+def test_publishes_a_message_for_each_batch_with_fan_out(tmp_path, monkeypatch):
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    monkeypatch.setenv('products_batch_size', '2')
+    monkeypatch.setenv('products_fan_out', 'true')
+
+    app.lambda_handler({'Records': [get_record({'fileId': 'catalog.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+
+    assert data_access.messages == []
+    messages = data_access.sns_client.messages
+    assert sorted(message['batch'] for message in messages) == list(range(1, 13))
+    assert sum(message['batchProducts'] for message in messages) == 23
+    # the first batch is published on its own, the rest ten at a time, and a failed message is published again
+    assert [len(request) for request in data_access.sns_client.requests] == [1, 10, 1, 1]
+    assert data_access.job_updates[1]['fan_out'] is True
+    assert data_access.job_updates[-1]['total_batches'] == 12
+
+
+def test_reads_large_csv_files_with_pyarrow_by_default(tmp_path, monkeypatch):
+    pytest.importorskip('pyarrow')
+    monkeypatch.delenv('csv_engine', raising=False)
+    monkeypatch.delenv('csv_chunk_size', raising=False)
+    data_access = LocalDataAccess(str(tmp_path))
+    monkeypatch.setattr(app, 'get_data_access', lambda: data_access)
+    csv_engines = []
+    get_csv_engine = utility.sheet_reader.get_csv_engine
+
+    def recording_get_csv_engine(*args):
+        csv_engines.append(type(get_csv_engine(*args)).__name__)
+        return get_csv_engine(*args)
+
+    monkeypatch.setattr(utility.sheet_reader, 'get_csv_engine', recording_get_csv_engine)
+    app.lambda_handler({'Records': [get_record({'fileId': 'large.csv', 'jobId': 'job-1', 'userId': 'user'})]}, None)
+    app.lambda_handler({'Records': [get_record({'fileId': 'products.csv', 'jobId': 'job-2', 'userId': 'user'})]}, None)
+
+    # the large file is downloaded before it is parsed, so pyarrow can read it again with pandas
+    assert data_access.opened_files == [('large.csv', True), ('products.csv', False)]
+    assert csv_engines == ['PyarrowCsvEngine', 'PandasCsvEngine']
+    assert data_access.published == ['job-1', 'job-2']
+    with open(os.path.join(str(tmp_path), 'products_job_id_job-1.json')) as file:
+        products = json.load(file)
+    assert [product['title'] for product in products[:2]] == ['Product 0', 'Product 1']
+    assert products[1]['variants'] == [{'price': 1.0}]
+
+
+def test_reuses_the_data_access_of_a_thread(monkeypatch):
+    created = []
+
+    class CountingDataAccess:
+        def __init__(self):
+            created.append(self)
+
+    monkeypatch.setattr(app, 'DataAccess', CountingDataAccess)
+    monkeypatch.setattr(app, 'thread_data', threading.local())
 
+    data_access = app.get_data_access()
+    assert app.get_data_access() is data_access
+    thread = threading.Thread(target=app.get_data_access)
+    thread.start()
+    thread.join()
+    assert len(created) == 2
 
-def test_lambda_handler(apigw_event, mocker):
 
-    ret = app.lambda_handler(apigw_event, "")
-    data = json.loads(ret["body"])
+def test_imports_pandas_only_once_there_is_a_file_to_read():
+    src = os.path.dirname(os.path.abspath(app.__file__))
+    output = subprocess.check_output([sys.executable, '-c', 'import sys, app; print("pandas" in sys.modules)'], cwd=src)
 
-    assert ret["statusCode"] == 200
-    assert "message" in ret["body"]
-    assert data["message"] == "hello world"
-    # assert "location" in data.dict_keys()
+    assert output.strip() == b'False'
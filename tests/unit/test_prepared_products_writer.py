@@ -0,0 +1,137 @@
+import gzip
+import json
+import os
+
+from dataaccess.prepared_products_writer import BatchedProductsWriter, PreparedProductsWriter, LocalPartStore
+from datamodel.custom_enums import ProductsFormat
+from utility.product_hashes import ProductHashes
+
+
+PRODUCTS = [{'title': 'Product ' + str(product), 'variants': [{'price': float(product)}]} for product in range(200)]
+HANDLE_PRODUCTS = [{'errors': [], 'handle': 'product-' + str(product), 'variants': [{'price': float(product)}]} for product in range(5)]
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def test_writes_the_same_bytes_as_json_dumps(tmp_path):
+    with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'products.json')) as writer:
+        total_products = writer.write_all(PRODUCTS)
+
+    assert total_products == len(PRODUCTS)
+    assert read(os.path.join(str(tmp_path), 'products.json')) == json.dumps(PRODUCTS).encode('utf-8')
+
+
+def test_writes_the_same_bytes_when_uploaded_in_parts(tmp_path):
+    with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'products.json'), part_size=256) as writer:
+        writer.write_all(PRODUCTS)
+
+    assert read(os.path.join(str(tmp_path), 'products.json')) == json.dumps(PRODUCTS).encode('utf-8')
+    # the parts are removed once the file is complete
+    assert os.listdir(str(tmp_path)) == ['products.json']
+
+
+def test_writes_compressed_lines(tmp_path):
+    for part_size in [256, 1024 * 1024]:
+        with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'products.ndjson.gz'), part_size=part_size, products_format=ProductsFormat.NDJSON_GZIP) as writer:
+            writer.write_all(PRODUCTS)
+
+        lines = gzip.decompress(read(os.path.join(str(tmp_path), 'products.ndjson.gz'))).splitlines()
+        assert [json.loads(line) for line in lines] == PRODUCTS
+
+
+def test_writes_an_empty_array_without_products(tmp_path):
+    with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'products.json')) as writer:
+        writer.write_all([])
+
+    assert read(os.path.join(str(tmp_path), 'products.json')) == b'[]'
+
+
+def test_leaves_out_products_that_have_not_changed(tmp_path):
+    product_hashes = ProductHashes({}, True)
+    with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'create.json'), product_hashes=product_hashes) as writer:
+        writer.write_all(HANDLE_PRODUCTS)
+
+    edited_products = [dict(product) for product in HANDLE_PRODUCTS]
+    edited_products[1]['variants'] = [{'price': 15.0}]
+    edited_products[3]['errors'] = ['Row 5: Product Title is empty']
+    edited_products.append({'errors': [], 'handle': 'product-new', 'variants': []})
+    product_hashes = ProductHashes(product_hashes.get_hashes(), True)
+    with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'edit.json'), product_hashes=product_hashes) as writer:
+        total_products = writer.write_all(edited_products)
+
+    # products with errors are always written
+    expected_products = [edited_products[1], edited_products[3], edited_products[5]]
+    assert total_products == 3
+    assert read(os.path.join(str(tmp_path), 'edit.json')) == json.dumps(expected_products).encode('utf-8')
+    assert product_hashes.get_unchanged_count() == 3
+    # the product with errors keeps the hash of the earlier job
+    assert sorted(product_hashes.get_hashes()) == ['product-0', 'product-1', 'product-2', 'product-4', 'product-new']
+
+
+def test_writes_batches_and_starts_processing_after_the_first_one(tmp_path):
+    directory = str(tmp_path)
+    started = []
+
+    def start_processing(manifest_key):
+        with open(os.path.join(directory, manifest_key)) as file:
+            started.append(json.load(file))
+
+    def get_part_store(key, products_format):
+        return LocalPartStore(directory, key)
+
+    with BatchedProductsWriter(get_part_store, 'products', 64, start_processing) as writer:
+        total_products = writer.write_all(PRODUCTS)
+
+    assert total_products == len(PRODUCTS)
+    assert len(started) == 1
+    assert started[0]['complete'] is False
+    assert started[0]['batches'] == [{'key': 'products_batch_1.json', 'total_products': 64}]
+    with open(os.path.join(directory, 'products_manifest.json')) as file:
+        manifest = json.load(file)
+    assert manifest['complete'] is True
+    assert manifest['total_products'] == len(PRODUCTS)
+    assert [batch['total_products'] for batch in manifest['batches']] == [64, 64, 64, 8]
+    products = []
+    for batch in manifest['batches']:
+        products.extend(json.loads(read(os.path.join(directory, batch['key']))))
+    assert products == PRODUCTS
+
+
+def test_discards_the_parts_when_generation_fails(tmp_path):
+    def failing_products():
+        yield from PRODUCTS
+        raise ValueError('generation failed')
+
+    try:
+        with PreparedProductsWriter(LocalPartStore(str(tmp_path), 'products.json'), part_size=256) as writer:
+            writer.write_all(failing_products())
+    except ValueError:
+        pass
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_marks_the_manifest_as_truncated_when_generation_fails_after_the_first_batch(tmp_path):
+    directory = str(tmp_path)
+
+    def failing_products():
+        yield from PRODUCTS[:100]
+        raise ValueError('generation failed')
+
+    def get_part_store(key, products_format):
+        return LocalPartStore(directory, key)
+
+    try:
+        with BatchedProductsWriter(get_part_store, 'products', 64) as writer:
+            writer.write_all(failing_products())
+    except ValueError:
+        pass
+
+    with open(os.path.join(directory, 'products_manifest.json')) as file:
+        manifest = json.load(file)
+    assert (manifest['complete'], manifest['failed'], manifest['truncated']) == (False, True, True)
+    assert manifest['batches'] == [{'key': 'products_batch_1.json', 'total_products': 64}]
+    assert sorted(os.listdir(directory)) == ['products_batch_1.json', 'products_manifest.json']
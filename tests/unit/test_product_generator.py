@@ -0,0 +1,367 @@
+import datetime
+import io
+
+import pytest
+
+import utility.csv_engines
+import utility.product_generator
+from datamodel.custom_enums import CsvEngine, TaskType
+from datamodel.custom_exceptions import MissingArgumentError
+from utility.csv_engines import PYARROW_MIN_ROWS, PandasCsvEngine, PyarrowCsvEngine, get_csv_engine
+from utility.product_generator import ProductGenerator
+
+
+FIELD_DETAILS = {
+    'handle': [{'index': '0'}],
+    'title': [{'index': '1'}],
+    'option1Name': [{'index': '2'}],
+    'option1Value': [{'index': '3'}],
+    'variantPrice': [{'index': '4'}],
+    'variantTaxable': [{'index': '5'}],
+    'status': [{'index': '6'}],
+}
+
+# field_details indexes leave out columns that are completely empty, so every
+# column of the files below has a value in some row
+HEADER = 'Handle,Title,Option1 Name,Option1 Value,Price,Taxable,Status\n'
+
+
+def generate(content, field_details=FIELD_DETAILS, header_row='0', file_type='CSV', **info):
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    product_generator_info = {
+        'file_object': {'id': 'file', 'file_type': file_type, 'header_row': header_row, 'field_details': field_details},
+        'file_content': io.BytesIO(content),
+        'job_type': TaskType.IMPORT_CREATE,
+        'options': {'addedTags': ['imported'], 'defaultPublishedStatus': True, 'defaultStatus': 'DRAFT'},
+    }
+    options = info.pop('options', {})
+    product_generator_info['options'].update(options)
+    product_generator_info.update(info)
+    product_generator = ProductGenerator(product_generator_info)
+    return product_generator.get_products(), product_generator
+
+
+def test_groups_variant_rows_under_the_product_above():
+    content = HEADER + (
+        'shirt,Shirt,Size,S,10,yes,active\n'
+        'shirt,,,M,12.5,no,\n'
+        'pants,Pants,Size,32,30,,draft\n'
+    )
+
+    products, product_generator = generate(content)
+
+    assert [product['title'] for product in products] == ['Shirt', 'Pants']
+    assert products[0] == {
+        'errors': [],
+        'warnings': [],
+        'title': 'Shirt',
+        'handle': 'shirt',
+        'tags': ['imported'],
+        'published': True,
+        'options': ['Size'],
+        'option1Name': 'Size',
+        'status': 'ACTIVE',
+        'images': [],
+        'variants': [
+            {'options': ['S'], 'price': 10.0, 'taxable': True},
+            {'options': ['M'], 'price': 12.5, 'taxable': False},
+        ],
+    }
+    assert products[1]['status'] == 'DRAFT'
+    assert not product_generator.is_product_limit_exceeded()
+
+
+def test_reports_invalid_values_with_row_numbers():
+    content = HEADER + (
+        ',,Size,S,free,maybe,bogus\n'
+        ',,,S,5,,\n'
+        'shirt,Shirt,,,,,\n'
+    )
+
+    products, product_generator = generate(content)
+
+    # rows without a title or handle are products of their own
+    assert len(products) == 3
+    assert products[0]['title'] == 'Invalid Title'
+    assert products[0]['errors'] == ['Row 2: Product Title is empty']
+    assert products[0]['warnings'] == [
+        'Row 2: Invalid status Value. Valid values are: ACTIVE, DRAFT, ARCHIVED. Replacing with default status value.',
+        'Row 2: Invalid variant price Value. Value should be a number.',
+        'Row 2: Invalid variant taxable Value. Valid values are: [TRUE, YES, Y] for True, and [FALSE, NO, N] for False.',
+    ]
+    assert products[1]['errors'] == [
+        'Row 3: Product Title is empty',
+        'Row 3: Value for option1 Name is invalid. Please ensure value is not empty.',
+        'Row 3: There is no Option1 Name associated with the Option1 value.',
+    ]
+
+
+def test_reports_duplicate_variant_titles():
+    content = HEADER + (
+        'shirt,Shirt,Size,S,10,y,active\n'
+        'shirt,,,S,11,,\n'
+    )
+
+    products, product_generator = generate(content)
+
+    assert products[0]['errors'] == ['Row 3: Variant title S, already exist']
+    assert 'variantTitles' not in products[0]
+
+
+def test_stops_at_the_product_limit():
+    content = HEADER + ''.join('p' + str(product) + ',P' + str(product) + ',Size,S,1,y,active\n' for product in range(5))
+
+    products, product_generator = generate(content, product_limit=3)
+
+    assert [product['title'] for product in products] == ['P0', 'P1', 'P2']
+    assert product_generator.is_product_limit_exceeded()
+
+
+def test_stops_reading_chunks_at_the_product_limit():
+    content = (HEADER + ''.join('p' + str(product) + ',P' + str(product) + ',Size,S,1,y,active\n' for product in range(100000))).encode('utf-8')
+    read_sizes = []
+
+    class RecordingFile(io.BytesIO):
+        def read(self, size=-1):
+            data = super().read(size)
+            read_sizes.append(len(data))
+            return data
+
+        def read1(self, size=-1):
+            data = super().read1(size)
+            read_sizes.append(len(data))
+            return data
+
+        def readinto(self, buffer):
+            size = super().readinto(buffer)
+            read_sizes.append(size)
+            return size
+
+    products, product_generator = generate(b'', product_limit=3, chunk_size=10, file_content=RecordingFile(content))
+
+    assert len(products) == 3
+    assert product_generator.is_product_limit_exceeded()
+    assert sum(read_sizes) < len(content) / 2
+
+
+def test_chunked_read_gives_the_same_products():
+    content = HEADER + ''.join(
+        'p' + str(row // 3) + ',P' + str(row // 3) + ',Size,S' + str(row % 3) + ',' + str(row) + ',y,active\n' for row in range(50)
+    )
+
+    products, product_generator = generate(content)
+    for chunk_size in [1, 4, 7, 100]:
+        chunked_products, product_generator = generate(content, chunk_size=chunk_size)
+        assert chunked_products == products
+
+
+def test_chunked_read_gives_the_same_numbers():
+    field_details = dict(
+        FIELD_DETAILS,
+        variantQuantity=[{'index': '7', 'location': 'location'}],
+        variantCost=[{'index': '8'}],
+        variantWeight=[{'index': '9', 'weightUnit': 'KILOGRAMS'}],
+    )
+    # a whole read parses these columns as floats, chunks keep them as text
+    content = 'Handle,Title,Option1 Name,Option1 Value,Price,Taxable,Status,Quantity,Cost,Weight\n' + (
+        'shirt,Shirt,Size,S,1.50,y,active,2.0,0.5,1\n'
+        'shirt,,,M,10,,,,,\n'
+        'shirt,,,L,,,,10,3.0,2.25\n'
+        'pants,Pants,Size,32,2.5,n,draft,0,,0.0\n'
+    )
+
+    products, product_generator = generate(content, field_details=field_details)
+    for chunk_size in [1, 3]:
+        chunked_products, product_generator = generate(content, field_details=field_details, chunk_size=chunk_size)
+        assert chunked_products == products
+    assert products[0]['variants'][0]['inventoryQuantities'] == [{'availableQuantity': 2, 'locationId': 'location'}]
+    assert products[0]['warnings'] == []
+
+
+def test_chunked_read_gives_the_same_text():
+    field_details = dict(
+        FIELD_DETAILS,
+        variantSku=[{'index': '7'}],
+        variantBarcode=[{'index': '8'}],
+        variantQuantity=[{'index': '9', 'location': 'location'}],
+        metafields=[{'index': '10', 'name': 'material'}],
+    )
+    # whole reads used to parse these columns as numbers, dropping leading zeros and truncating quantities
+    content = 'Handle,Title,Option1 Name,Option1 Value,Price,Taxable,Status,SKU,Barcode,Quantity,Material\n' + (
+        'shirt,Shirt,Size,S,1,y,active,00123,0456,2.5,10\n'
+        'shirt,,,M,1,,,124,,3,\n'
+        'pants,Pants,Size,32,2,n,draft,125,789,4,2.0\n'
+    )
+
+    for chunk_size in [None, 1, 2]:
+        products, product_generator = generate(content, field_details=field_details, chunk_size=chunk_size)
+        assert [variant['sku'] for variant in products[0]['variants']] == ['00123', '124']
+        assert [variant.get('barcode') for variant in products[0]['variants']] == ['0456', None]
+        assert [variant.get('inventoryQuantities') for variant in products[0]['variants']] == [None, [{'availableQuantity': 3, 'locationId': 'location'}]]
+        assert products[0]['metafields'][0]['value'] == '10'
+        assert products[1]['metafields'][0]['value'] == '2.0'
+
+
+def test_skips_rows_before_the_header_row():
+    content = 'Report,,,,,,\ngenerated today,,,,,,\n' + HEADER + 'shirt,Shirt,Size,S,free,y,active\n'
+
+    for chunk_size in [None, 2]:
+        products, product_generator = generate(content, header_row='2', chunk_size=chunk_size)
+        assert [product['title'] for product in products] == ['Shirt']
+        # row numbers count the lines of the file
+        assert products[0]['warnings'] == ['Row 4: Invalid variant price Value. Value should be a number.']
+
+
+def test_hash_grouping_joins_rows_that_are_not_contiguous():
+    content = HEADER + (
+        'shirt,Shirt,Size,S,10,y,active\n'
+        'pants,Pants,Size,32,30,,\n'
+        'shirt,,,M,12,,\n'
+    )
+
+    products, product_generator = generate(content, options={'variantGrouping': 'HASH'})
+
+    assert [product['title'] for product in products] == ['Shirt', 'Pants']
+    assert [variant['options'] for variant in products[0]['variants']] == [['S'], ['M']]
+
+
+@pytest.mark.parametrize('grouping', ['CONTIGUOUS', 'HASH'])
+def test_worker_processes_give_the_same_products(monkeypatch, grouping):
+    monkeypatch.setattr(utility.product_generator, 'SHARD_SIZE', 4)
+    monkeypatch.setattr(utility.product_generator, 'PARALLEL_MIN_ROWS', 10)
+    content = HEADER + ''.join(
+        'p' + str(row // 3 % 11) + ',P' + str(row // 3 % 11) + ',Size,S' + str(row % 3) + ',' + str(row) + ',y,active\n' for row in range(60)
+    ) + ',,Size,S,free,maybe,bogus\n'
+    options = {'variantGrouping': grouping}
+
+    products, product_generator = generate(content, options=options)
+    for info in [{}, {'chunk_size': 7}, {'product_limit': 5}]:
+        serial_products, serial_generator = generate(content, options=options, **info)
+        parallel_products, parallel_generator = generate(content, options=options, processes=2, **info)
+        assert parallel_products == serial_products
+        assert parallel_generator.is_product_limit_exceeded() == serial_generator.is_product_limit_exceeded()
+    assert products[-1]['errors'] == ['Row 62: Product Title is empty']
+
+
+@pytest.mark.parametrize('header_row', ['0', '2'])
+def test_pyarrow_engine_gives_the_same_products(header_row):
+    pytest.importorskip('pyarrow')
+    content = 'Report,,,,,,\ngenerated today,,,,,,\n' if header_row == '2' else ''
+    content += HEADER + (
+        'shirt,Shirt,Size,S,NA,y,active\n'
+        'shirt,,Size,"M\nL",null,,\n'
+        '\n'
+        'pants,"Pants, long",Size,32,,N/A,""\n'
+        ',,,,,,\n'
+        'hat,Hat,Size,One, 5 ,n,bogus\n'
+    )
+
+    products, product_generator = generate(content, header_row=header_row, chunk_size=2, csv_engine=CsvEngine.PANDAS)
+    pyarrow_products, product_generator = generate(content, header_row=header_row, chunk_size=2, csv_engine=CsvEngine.PYARROW)
+    assert pyarrow_products == products
+    assert [product['title'] for product in products] == ['Shirt', 'Pants, long', 'Hat']
+
+
+@pytest.mark.parametrize('block_size', [64, 4 * 1024 * 1024])
+def test_pyarrow_engine_reads_rows_with_missing_fields_like_pandas(monkeypatch, block_size):
+    pytest.importorskip('pyarrow')
+    # with small blocks, pyarrow fails on the short row after it already read the first rows
+    monkeypatch.setattr(utility.csv_engines, 'PYARROW_BLOCK_SIZE', block_size)
+    content = HEADER + ''.join('p' + str(row) + ',P' + str(row) + ',Size,S,' + str(row) + ',y,active\n' for row in range(10)) + (
+        'short,Short,Size\n'
+        'hat,Hat,Size,One,5,n,draft\n'
+        'cap,Cap\n'
+    )
+
+    products, product_generator = generate(content, chunk_size=4, csv_engine=CsvEngine.PANDAS)
+    pyarrow_products, product_generator = generate(content, chunk_size=4, csv_engine=CsvEngine.PYARROW)
+    assert pyarrow_products == products
+    assert [product['title'] for product in products[-3:]] == ['Short', 'Hat', 'Cap']
+
+
+def test_auto_engine_only_reads_seekable_files_with_pyarrow():
+    pytest.importorskip('pyarrow')
+    probe = HEADER.encode('utf-8') + b'shirt,Shirt,Size,S,10,y,active\n'
+
+    assert isinstance(get_csv_engine(CsvEngine.AUTO, PYARROW_MIN_ROWS, probe, True), PyarrowCsvEngine)
+    assert isinstance(get_csv_engine(CsvEngine.AUTO, PYARROW_MIN_ROWS, probe, False), PandasCsvEngine)
+    assert isinstance(get_csv_engine(CsvEngine.AUTO, PYARROW_MIN_ROWS - 1, probe, True), PandasCsvEngine)
+
+
+def test_streamed_xlsx_file_gives_the_products_of_the_same_csv_file():
+    openpyxl = pytest.importorskip('openpyxl')
+    rows = [
+        ['Report'],
+        ['Handle', 'Title', 'Option1 Name', 'Option1 Value', 'Price', 'Taxable', 'Status'],
+        ['shirt', 'Shirt', 'Size', 'S', 10, True, 'active'],
+        ['shirt', None, 'Size', 'M', 10.5, None, None],
+        [],
+        ['pants', 'NA', 'Size', 32, 'free', 'n', 'bogus'],
+        ['hat', 'Hat', 'Size', 'One', 7.0, 'y', 'draft'],
+    ]
+    workbook = openpyxl.Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    xlsx_file = io.BytesIO()
+    workbook.save(xlsx_file)
+    content = 'Report,,,,,,\n' + HEADER + (
+        'shirt,Shirt,Size,S,10,True,active\n'
+        'shirt,,Size,M,10.5,,\n'
+        ',,,,,,\n'
+        'pants,NA,Size,32,free,n,bogus\n'
+        'hat,Hat,Size,One,7,y,draft\n'
+    )
+
+    products, product_generator = generate(content, header_row='1', chunk_size=2)
+    for chunk_size in [None, 2]:
+        xlsx_products, product_generator = generate(xlsx_file.getvalue(), header_row='1', file_type='EXCEL', stream_excel=True, chunk_size=chunk_size)
+        assert xlsx_products == products
+    assert [product['title'] for product in products] == ['Shirt', 'Invalid Title', 'Hat']
+
+
+def test_keeps_rows_with_values_only_in_unmapped_columns_of_excel_files():
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Handle', 'Title', 'Option1 Name', 'Option1 Value', 'Price', 'Taxable', 'Status', 'Notes'])
+    workbook.active.append(['shirt', 'Shirt', 'Size', 'S', 10, 'y', 'active', None])
+    workbook.active.append([None, None, None, None, None, None, None, 'discontinued'])
+    workbook.active.append([])
+    workbook.active.append(['hat', 'Hat', 'Size', 'One', 7, 'y', 'draft', None])
+    xlsx_file = io.BytesIO()
+    workbook.save(xlsx_file)
+
+    products, product_generator = generate(xlsx_file.getvalue(), file_type='EXCEL')
+
+    # only the row that is empty in every column is left out
+    assert [product['title'] for product in products] == ['Shirt', 'Invalid Title', 'Hat']
+    assert products[1]['errors'][0] == 'Row 3: Product Title is empty'
+
+
+def test_reports_date_cells_in_number_columns_as_invalid():
+    openpyxl = pytest.importorskip('openpyxl')
+    field_details = dict(FIELD_DETAILS, variantCost=[{'index': '7'}], variantWeight=[{'index': '8', 'weightUnit': 'KILOGRAMS'}])
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Handle', 'Title', 'Option1 Name', 'Option1 Value', 'Price', 'Taxable', 'Status', 'Cost', 'Weight'])
+    for size in ['S', 'M']:
+        date = datetime.datetime(2020, 1, 2)
+        workbook.active.append(['shirt', 'Shirt', 'Size', size, date, 'y', 'active', date, date])
+    xlsx_file = io.BytesIO()
+    workbook.save(xlsx_file)
+
+    for stream_excel in [False, True]:
+        products, product_generator = generate(xlsx_file.getvalue(), field_details=field_details, file_type='EXCEL', stream_excel=stream_excel)
+        assert products[0]['warnings'][:3] == [
+            'Row 2: Invalid variant weight value. Value should be a number.',
+            'Row 2: Invalid variant cost Value. Value should be a number.',
+            'Row 2: Invalid variant price Value. Value should be a number.',
+        ]
+        assert len(products[0]['warnings']) == 6
+        assert all('price' not in variant and 'weight' not in variant for variant in products[0]['variants'])
+
+
+def test_requires_a_title_column():
+    field_details = {'handle': [{'index': '0'}]}
+
+    with pytest.raises(MissingArgumentError):
+        generate(HEADER + 'shirt,Shirt,,,,,\n', field_details=field_details)
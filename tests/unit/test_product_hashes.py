@@ -0,0 +1,36 @@
+import json
+
+from utility.product_hashes import ProductHashes, merge_job_hashes
+
+
+def test_only_keeps_the_hashes_of_completed_jobs():
+    job_hashes = [
+        {'job_id': 'job-1', 'hashes': {'shirt': 'a', 'pants': 'b', 'hat': 'c', 'sock': 'd'}},
+        {'job_id': 'job-2', 'hashes': {'shirt': 'e', 'pants': None}},
+        {'job_id': 'job-3', 'hashes': {'hat': 'f'}},
+        {'job_id': 'job-4', 'hashes': {'sock': 'g'}},
+    ]
+    job_statuses = {'job-1': 'COMPLETED', 'job-2': 'COMPLETED', 'job-3': 'RUNNING', 'job-4': 'PARTIALLY COMPLETED'}
+
+    # handles of jobs that may not have been applied, and duplicated handles, are unknown
+    assert merge_job_hashes(job_hashes, job_statuses) == {'shirt': 'e'}
+
+
+def test_reports_products_without_a_completed_hash_as_changed():
+    product = {'errors': [], 'handle': 'shirt', 'variants': []}
+    product_hashes = ProductHashes(merge_job_hashes([{'job_id': 'job-1', 'hashes': {'shirt': 'a'}}], {}), True)
+
+    assert product_hashes.is_written(product, b'{"handle": "shirt"}')
+    assert product_hashes.get_unchanged_count() == 0
+
+
+def test_leaves_the_row_numbers_of_warnings_out_of_the_hash():
+    product = {'errors': [], 'warnings': ['Row 2: Invalid variant price Value. Value should be a number.'], 'handle': 'shirt', 'variants': []}
+    moved_product = dict(product, warnings=['Row 7: Invalid variant price Value. Value should be a number.'])
+    product_hashes = ProductHashes({}, True)
+    product_hashes.is_written(product, json.dumps(product).encode('utf-8'))
+
+    moved_hashes = ProductHashes({'shirt': product_hashes.get_hashes()['shirt']}, True)
+
+    assert not moved_hashes.is_written(moved_product, json.dumps(moved_product).encode('utf-8'))
+    assert moved_hashes.get_unchanged_count() == 1
@@ -0,0 +1,36 @@
+from datamodel.custom_enums import ValueType
+from utility.row_plan import get_row_plan
+
+
+FIELD_DETAILS = {
+    'title': [{'index': '0'}],
+    'handle': [{'index': '0'}],
+    'variantPrice': [{'index': '3'}],
+    'variantCompareAtPrice': [{'index': '3'}],
+    'variantTaxable': [{'index': '3'}],
+}
+
+
+def test_normalizes_each_column_once_per_value_type():
+    plan = get_row_plan(FIELD_DETAILS)
+
+    assert plan.columns == [(0, ValueType.TEXT), (3, ValueType.FLOAT), (3, ValueType.BOOLEAN)]
+    assert plan.title == plan.handle == 0
+    assert plan.variant_price == plan.compare_price == 1
+    assert plan.variant_taxable == 2
+    assert plan.column_indexes == [0, 3]
+
+
+def test_leaves_fields_that_are_not_mapped_out():
+    plan = get_row_plan(FIELD_DETAILS)
+
+    assert plan.vendor is None
+    assert plan.variant_quantities == []
+    assert not plan.has_seo
+    assert not plan.has_inventory_item
+
+
+def test_reuses_the_plan_of_the_same_field_details():
+    reordered = dict(reversed(list(FIELD_DETAILS.items())))
+
+    assert get_row_plan(reordered) is get_row_plan(FIELD_DETAILS)
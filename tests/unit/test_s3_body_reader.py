@@ -0,0 +1,56 @@
+import io
+
+import pandas as pd
+
+from dataaccess.s3_body_reader import S3BodyReader
+from utility.job_metrics import JobMetrics
+
+
+CONTENT = ('Handle,Title\n' + ''.join('product-' + str(product) + ',Product ' + str(product) + '\n' for product in range(500))).encode('utf-8')
+
+
+class StreamingBody:
+    """Stands in for the body of a get_object response, which returns at most max_read bytes a read"""
+
+    def __init__(self, content, max_read=100):
+        self._content = io.BytesIO(content)
+        self._max_read = max_read
+        self.closed = False
+
+
+    def read(self, size):
+        return self._content.read(min(size, self._max_read))
+
+
+    def close(self):
+        self.closed = True
+
+
+def test_reads_the_body_as_a_buffered_file():
+    with io.BufferedReader(S3BodyReader(StreamingBody(CONTENT)), 256) as file:
+        assert file.readline() == b'Handle,Title\n'
+        assert file.read() == CONTENT[len('Handle,Title\n'):]
+
+
+def test_parses_the_body_while_it_is_read():
+    df = pd.read_csv(io.BufferedReader(S3BodyReader(StreamingBody(CONTENT)), 256))
+
+    assert len(df) == 500
+    assert df['Title'].iloc[-1] == 'Product 499'
+
+
+def test_adds_the_read_time_and_bytes_to_the_metrics():
+    metrics = JobMetrics()
+    with io.BufferedReader(S3BodyReader(StreamingBody(CONTENT), metrics), 256) as file:
+        file.read()
+
+    assert metrics.to_dict()['counts'] == {'file_bytes': len(CONTENT)}
+    assert 'download' in metrics.to_dict()['stages_ms']
+
+
+def test_closes_the_body():
+    body = StreamingBody(CONTENT)
+    file = io.BufferedReader(S3BodyReader(body))
+    file.close()
+
+    assert body.closed
@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+from datamodel.custom_exceptions import ShardWorkerError
+from utility.shard_pool import ShardPool
+
+
+# held by another thread of the process that starts the workers
+held_lock = threading.Lock()
+
+
+def square(shard):
+    return [value * value for value in shard]
+
+
+def acquire_held_lock(shard):
+    acquired = held_lock.acquire(timeout=5)
+    if acquired:
+        held_lock.release()
+    return acquired
+
+
+def fail(shard):
+    raise ValueError('bad shard')
+
+
+def test_returns_the_results_in_the_order_of_the_shards():
+    results = ShardPool(square, 2).map([[1, 2], [3], [4, 5, 6]])
+
+    assert list(results) == [[1, 4], [9], [16, 25, 36]]
+
+
+def test_starts_workers_that_dont_share_the_locks_of_other_threads():
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_lock():
+        with held_lock:
+            locked.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    locked.wait()
+    try:
+        # a worker forked from this process would start with the lock held
+        assert list(ShardPool(acquire_held_lock, 1).map([[1]])) == [True]
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_reports_shards_that_fail():
+    with pytest.raises(ShardWorkerError, match='bad shard'):
+        list(ShardPool(fail, 1).map([[1]]))
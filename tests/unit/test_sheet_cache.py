@@ -0,0 +1,64 @@
+import io
+import os
+
+import pandas as pd
+
+from datamodel.custom_enums import TaskType
+from utility.product_generator import ProductGenerator
+from utility.sheet_cache import SheetCache
+
+
+FIELD_DETAILS = {'title': [{'index': '0'}], 'variantPrice': [{'index': '1'}]}
+
+
+def get_frame(row_count):
+    return pd.DataFrame({'title': ['Product ' + str(row) for row in range(row_count)], 'price': list(range(row_count))})
+
+
+def get_frame_size(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+def test_keeps_the_most_recently_used_sheets_in_memory_and_on_disk(tmp_path):
+    frames = [get_frame(100) for sheet in range(3)]
+    directory = os.path.join(str(tmp_path), 'sheets')
+    sheet_cache = SheetCache(directory, memory_limit=get_frame_size(frames[0]) * 2, disk_limit=10 * 1024 * 1024)
+    for sheet in range(3):
+        sheet_cache.put('sheet-' + str(sheet), frames[sheet])
+
+    # the first sheet was evicted from memory, so it is loaded from its file
+    assert sheet_cache.get('sheet-2') is frames[2]
+    loaded_frame = sheet_cache.get('sheet-0')
+    assert loaded_frame is not frames[0]
+    assert loaded_frame.equals(frames[0])
+    assert sheet_cache.get('sheet-3') is None
+
+
+def test_evicts_the_least_recently_used_files(tmp_path):
+    directory = os.path.join(str(tmp_path), 'sheets')
+    sheet_cache = SheetCache(directory, memory_limit=0, disk_limit=1)
+    sheet_cache.put('sheet', get_frame(100))
+
+    # a sheet larger than the limits isn't kept at all
+    assert sheet_cache.get('sheet') is None
+    assert os.listdir(directory) == []
+
+
+def test_generates_the_same_products_from_a_cached_sheet(tmp_path):
+    excel_file = io.BytesIO()
+    pd.DataFrame({'Title': ['Shirt', 'Pants'], 'Price': [10, 20]}).to_excel(excel_file, index=False)
+    sheet_cache = SheetCache(os.path.join(str(tmp_path), 'sheets'))
+
+    def generate(file_content):
+        return ProductGenerator({
+            'file_object': {'id': 'file', 'file_type': 'EXCEL', 'header_row': '0', 'field_details': FIELD_DETAILS},
+            'file_content': file_content,
+            'job_type': TaskType.IMPORT_CREATE,
+            'options': {'addedTags': [], 'defaultPublishedStatus': True, 'defaultStatus': 'DRAFT'},
+            'cached_sheet': sheet_cache.get_sheet('products.xlsx#etag'),
+        }).get_products()
+
+    products = generate(excel_file.getvalue())
+    # the second job doesn't read the file
+    assert generate(io.BytesIO()) == products
+    assert [product['variants'][0]['price'] for product in products] == [10.0, 20.0]
@@ -0,0 +1,110 @@
+import io
+
+import pandas as pd
+import pytest
+
+import utility.sheet_reader
+from utility.sheet_reader import SheetReader
+
+
+FILE_OBJECT = {'id': 'file', 'file_type': 'CSV', 'header_row': '0'}
+
+# field_details indexes leave out the Empty column, so Title is index 1 and Price is index 3
+CONTENT = (
+    'Handle,Empty,Title,Notes,Price\n'
+    'shirt,,Shirt,long sleeves,10\n'
+    ',,,only notes,\n'
+    'pants,,Pants,,20\n'
+).encode('utf-8')
+
+
+def read(content, column_indexes, chunk_size=None):
+    frames = SheetReader(FILE_OBJECT, content, chunk_size=chunk_size).read(column_indexes)
+    return pd.concat(list(frames))
+
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_returns_the_mapped_columns_by_field_details_index(chunk_size):
+    df = read(CONTENT, [0, 1, 3], chunk_size)
+
+    assert list(df.columns) == [0, 1, 3]
+    assert df[1].tolist() == ['Shirt', 'Pants']
+    # rows with values only in other columns are left out, the index still counts them
+    assert df.index.tolist() == [0, 2]
+
+
+def test_only_parses_the_mapped_columns_once_the_whole_file_shows_the_empty_ones(monkeypatch):
+    usecols = []
+    read_csv = pd.read_csv
+
+    def recording_read_csv(*args, **kwargs):
+        usecols.append(kwargs.get('usecols'))
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(utility.sheet_reader.pd, 'read_csv', recording_read_csv)
+    read(CONTENT, [0, 1])
+
+    assert usecols[-1] == [0, 2]
+
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_reads_every_column_when_the_first_rows_leave_a_column_empty(monkeypatch, chunk_size):
+    # the Late column only has a value after the probed bytes, so Title can't be placed from them
+    monkeypatch.setattr(utility.sheet_reader, 'PROBE_SIZE', 40)
+    content = ('Handle,Late,Title\n' + 'a,,A\n' * 5 + 'b,x,B\n').encode('utf-8')
+
+    df = read(content, [0, 2], chunk_size)
+
+    assert df[2].tolist() == ['A'] * 5 + ['B']
+
+
+class StreamedFile(io.RawIOBase):
+    """Stands in for a product file that is parsed as it downloads, which can't seek"""
+
+    def __init__(self, content):
+        self._content = io.BytesIO(content)
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, buffer):
+        data = self._content.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+@pytest.mark.parametrize('streamed', [False, True])
+def test_reads_the_file_again_once_too_many_chunks_are_held_back(monkeypatch, streamed):
+    monkeypatch.setattr(utility.sheet_reader, 'PROBE_SIZE', 40)
+    monkeypatch.setattr(utility.sheet_reader, 'MAX_PENDING_CHUNKS', 2)
+    read_csv_calls = []
+    read_csv = pd.read_csv
+
+    def recording_read_csv(*args, **kwargs):
+        read_csv_calls.append(kwargs.get('usecols'))
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(utility.sheet_reader.pd, 'read_csv', recording_read_csv)
+    content = ('Handle,Late,Title\n' + 'a,,A\n' * 20 + 'b,x,B\n' + 'c,,C\n' * 5).encode('utf-8')
+    source = io.BufferedReader(StreamedFile(content)) if streamed else io.BytesIO(content)
+
+    frames = list(SheetReader(FILE_OBJECT, source, chunk_size=2).read([0, 2]))
+
+    df = pd.concat(frames)
+    assert df[2].tolist() == ['A'] * 20 + ['B'] + ['C'] * 5
+    assert df.index.tolist() == list(range(26))
+    # the probe, the read that finds the empty columns and the read of the rows
+    assert len(read_csv_calls) == 3
+
+
+@pytest.mark.parametrize('chunk_size', [None, 2])
+def test_keeps_rows_with_values_only_in_other_columns_when_every_column_is_parsed(monkeypatch, chunk_size):
+    monkeypatch.setattr(utility.sheet_reader, 'PROBE_SIZE', 40)
+    content = ('Handle,Late,Title,Notes\n' + 'a,,A,\n' * 5 + ',,,only notes\n' + 'b,x,B,\n').encode('utf-8')
+
+    df = read(content, [0, 2], chunk_size)
+
+    assert df.index.tolist() == list(range(7))
+    assert df[2].isna().tolist() == [False] * 5 + [True, False]